@@ -1,14 +1,52 @@
 import io
 import os
-import re
 from dataclasses import dataclass
 from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
 import streamlit as st
 
+from parse_cache import PARSE_CACHE
+from colstats import FrameStats, frame_stats
+from correlation import METHODS as CORR_METHODS, CorrResult, frame_correlation
+from cube import CUBE_FUNCS, GroupCube, build_cube
+from decimate import METHODS as DECIMATE_METHODS, decimate
+from distances import METRICS as DISTANCE_METRICS, neighbor_table, pair_table, pairwise_distances
+from peaks import annotate_bands, compile_bands, default_band_mapping, detect_peaks, peak_index_for
+from preprocess import BASELINES, NORMALIZATIONS, Preprocessing, preprocess_for
+from process_model import batch_regression, build_sample_table, strongest_fits
+from profiling import Profiler, enabled_from_env
+from recompute import GRAPH, Input
+from sidecar import persist_uploads_enabled, read_bytes
+from sample_ids import parse_sample_ids
+from sample_metadata import load_sample_metadata
+from sampling import sample_frame
+from spectra import SpectraMatrix, detect_ftir_structure, spectra_for
+from ultrasonic import (
+    ENVELOPES,
+    SignalMatrix,
+    detect_echoes,
+    detect_signal_layout,
+    echo_features,
+    envelope,
+    spectral_features,
+    trace_stats,
+)
+from streaming import (
+    STREAM_THRESHOLD_BYTES,
+    StreamSummary,
+    groupby_for,
+    resolve_server_path,
+    server_data_dir,
+    source_key,
+    stream_for,
+)
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".sidecar")
+MAX_HEATMAP_GROUPS = 150
 
 st.set_page_config(
     page_title="菠萝叶纤维分析平台 - Pineapple Leaf Fiber Analysis",
@@ -27,51 +65,42 @@ class DataSummary:
     categorical_cols: List[str]
 
 
-def load_file(upload) -> Optional[pd.DataFrame]:
+def load_file(upload) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
+    """Parsed upload and its content key (reused as the dataset key)."""
     if upload is None:
-        return None
+        return None, None
 
     name = upload.name.lower()
     data = upload.getvalue()
 
     if name.endswith(".csv"):
-        return pd.read_csv(io.BytesIO(data))
+        return PARSE_CACHE.get_or_parse_keyed(data, ("csv",), lambda: pd.read_csv(io.BytesIO(data)))
     if name.endswith(".xlsx") or name.endswith(".xls"):
-        return pd.read_excel(io.BytesIO(data))
+        options = ("excel", 0)
+
+        def parse() -> pd.DataFrame:
+            return pd.read_excel(io.BytesIO(data))
+
+        if persist_uploads_enabled():
+            return PARSE_CACHE.get_or_parse_keyed(data, options, lambda: read_bytes(data, options, parse))
+        return PARSE_CACHE.get_or_parse_keyed(data, options, parse)
 
     st.error("仅支持 CSV / XLSX / XLS 文件")
-    return None
-
-
-def summarize(df: pd.DataFrame) -> DataSummary:
-    numeric_cols = df.select_dtypes(include="number").columns.tolist()
-    candidate_cols = df.columns.tolist()
-    categorical_cols = []
-    first_col = candidate_cols[0] if candidate_cols else None
-    for col in candidate_cols:
-        series = df[col]
-        if str(col).lower().startswith("unnamed"):
-            continue
-        if series.dtype == "object" or str(series.dtype).startswith("category"):
-            categorical_cols.append(col)
-            continue
-        unique_count = series.nunique(dropna=True)
-        if unique_count <= min(50, max(2, len(series) // 20)):
-            categorical_cols.append(col)
-    if first_col and not str(first_col).lower().startswith("unnamed"):
-        if first_col not in categorical_cols:
-            categorical_cols.insert(0, first_col)
+    return None, None
+
+
+def summarize(df: pd.DataFrame, stats: Optional[FrameStats] = None) -> DataSummary:
+    stats = stats if stats is not None else frame_stats(df)
     return DataSummary(
-        rows=len(df),
-        cols=len(df.columns),
-        missing_total=int(df.isna().sum().sum()),
-        numeric_cols=numeric_cols,
-        categorical_cols=categorical_cols,
+        rows=stats.rows,
+        cols=len(stats.columns),
+        missing_total=int(stats.missing_counts.sum()),
+        numeric_cols=stats.numeric_columns(),
+        categorical_cols=stats.categorical_columns(),
     )
 
 
-def render_overview(df: pd.DataFrame) -> None:
-    summary = summarize(df)
+def render_overview(df: pd.DataFrame, summary: DataSummary) -> None:
 
     c1, c2, c3, c4 = st.columns(4)
     c1.metric("行数", summary.rows)
@@ -83,168 +112,189 @@ def render_overview(df: pd.DataFrame) -> None:
     st.dataframe(df.head(st.session_state.get("preview_rows", 200)), use_container_width=True)
 
 
-def safe_sample(df: pd.DataFrame, max_rows: int) -> pd.DataFrame:
-    if len(df) <= max_rows:
-        return df
-    return df.sample(n=max_rows, random_state=42)
-
-
 def ui_divider() -> None:
     st.markdown("---")
 
 
-def detect_ftir_structure(df: pd.DataFrame) -> Optional[Dict[str, object]]:
-    if df.shape[1] < 5:
+def spectra_figure(
+    x: np.ndarray, block: np.ndarray, labels, title: str, legend_title: Optional[str], n_out: int, method: str,
+    x_title: str = "wavenumber", y_title: str = "intensity", reverse_x: bool = True,
+) -> go.Figure:
+    xs, ys = decimate(x, block, n_out, method)
+    trace_cls = go.Scattergl if ys.size > 200_000 else go.Scatter
+    fig = go.Figure()
+    names = [None] * len(ys) if labels is None else [str(v) for v in labels]
+    for i, name in enumerate(names):
+        fig.add_trace(trace_cls(x=xs[i], y=ys[i], mode="lines", name=name, showlegend=name is not None))
+    fig.update_layout(title=title, legend_title_text=legend_title, xaxis_title=x_title, yaxis_title=y_title)
+    if reverse_x:
+        fig.update_xaxes(autorange="reversed")
+    return fig
+
+
+def map_peaks_to_bands(peaks_df: pd.DataFrame, band_df: pd.DataFrame) -> pd.DataFrame:
+    columns = ["波段", "峰值", "对应基团", "对应成分", "透过率"]
+    if peaks_df.empty:
+        return pd.DataFrame(columns=columns)
+    peaks = pd.DataFrame(
+        {
+            "峰值": peaks_df["峰值"].to_numpy(dtype=float),
+            "透过率": peaks_df["透过率"].to_numpy(dtype=float),
+        }
+    )
+    return compile_bands(band_df).annotate(peaks)[columns]
+
+
+def compute_group_mean(sm: SpectraMatrix, keys: pd.Series) -> Tuple[List[str], np.ndarray]:
+    labels, means = sm.group_mean(keys.to_numpy(dtype=object))
+    return [str(g) for g in labels], means
+
+
+# Derived artifacts, recomputed only when their inputs change (see recompute.py).
+@GRAPH.node("colstats", inputs=["dataset", "stream"])
+def node_colstats(dataset: pd.DataFrame, stream: Optional[StreamSummary]) -> FrameStats:
+    # In streaming mode the dataset is only the reservoir; the stats cover every row.
+    return stream.stats if stream is not None else frame_stats(dataset)
+
+
+@GRAPH.node("summary", inputs=["dataset"], deps=["colstats"])
+def node_summary(dataset: pd.DataFrame, colstats: FrameStats) -> DataSummary:
+    return summarize(dataset, colstats)
+
+
+@GRAPH.node("describe", deps=["colstats"])
+def node_describe(colstats: FrameStats) -> pd.DataFrame:
+    if not colstats.numeric_columns():
+        return pd.DataFrame()
+    return colstats.describe()
+
+
+@GRAPH.node("missing", deps=["colstats"])
+def node_missing(colstats: FrameStats) -> pd.Series:
+    missing = colstats.missing().sort_values(ascending=False, kind="stable")
+    return missing[missing > 0]
+
+
+@GRAPH.node("cube", inputs=["dataset"], deps=["summary", "colstats"])
+def node_cube(dataset: pd.DataFrame, summary: DataSummary, colstats: FrameStats) -> GroupCube:
+    return build_cube(dataset, summary.categorical_cols, summary.numeric_cols, colstats.nunique())
+
+
+@GRAPH.node("chart_df", inputs=["dataset", "chart_rows", "sample_by"])
+def node_chart_df(dataset: pd.DataFrame, chart_rows: int, sample_by: Optional[str]) -> pd.DataFrame:
+    return sample_frame(dataset, chart_rows, sample_by)
+
+
+@GRAPH.node("corr", inputs=["dataset", "corr_method", "corr_float32"])
+def node_corr(dataset: pd.DataFrame, corr_method: str, corr_float32: bool) -> Optional[CorrResult]:
+    return frame_correlation(dataset, corr_method, corr_float32)
+
+
+@GRAPH.node("ftir", inputs=["dataset"])
+def node_ftir(dataset: pd.DataFrame) -> Optional[Dict[str, object]]:
+    return detect_ftir_structure(dataset)
+
+
+@GRAPH.node("spectra", inputs=["dataset", "dataset_key"], deps=["ftir"])
+def node_spectra(dataset: pd.DataFrame, dataset_key: str, ftir: Optional[Dict[str, object]]) -> Optional[SpectraMatrix]:
+    if not ftir:
         return None
-    sample_col = df.columns[0]
-    w_cols: List[str] = []
-    w_values: List[float] = []
-    for col in df.columns[1:]:
-        try:
-            w_val = float(col)
-            w_cols.append(col)
-            w_values.append(w_val)
-        except (TypeError, ValueError):
-            if pd.api.types.is_numeric_dtype(df[col]):
-                w_cols.append(col)
-                w_values.append(float(len(w_values)))
-    if len(w_cols) < 20:
+    return spectra_for(dataset, ftir, memmap_dir=os.path.join(CACHE_DIR, "spectra"), key=dataset_key)
+
+
+@GRAPH.node("spectra_pre", inputs=["preprocessing"], deps=["spectra"])
+def node_spectra_pre(preprocessing: Preprocessing, spectra: SpectraMatrix) -> SpectraMatrix:
+    # Everything downstream (averages, group means, variance, peaks) reads this matrix.
+    return preprocess_for(spectra, preprocessing)
+
+
+@GRAPH.node("sample_keys", deps=["spectra"])
+def node_sample_keys(spectra: SpectraMatrix) -> Dict[str, pd.Series]:
+    ids = pd.Series(spectra.sample_ids, dtype=object)
+    keys = parse_sample_ids(ids)
+    return {
+        # IDs outside the naming scheme form their own prefix group.
+        "_prefix": keys["prefix"].astype(object).fillna(ids.astype(str).str.strip()),
+        "_series": keys["series"],
+        "_replicate": keys["replicate"],
+        "_sample": ids,
+    }
+
+
+@GRAPH.node("avg_spectrum", inputs=["avg_samples"], deps=["spectra_pre"])
+def node_avg_spectrum(avg_samples: Tuple[str, ...], spectra_pre: SpectraMatrix) -> np.ndarray:
+    return spectra_pre.mean(list(avg_samples))
+
+
+@GRAPH.node("group_means", inputs=["group_key"], deps=["spectra_pre", "sample_keys"])
+def node_group_means(group_key: str, spectra_pre: SpectraMatrix, sample_keys: Dict[str, pd.Series]):
+    return compute_group_mean(spectra_pre, sample_keys[group_key])
+
+
+@GRAPH.node("summary_means", inputs=["summary_group_key"], deps=["spectra_pre", "sample_keys"])
+def node_summary_means(summary_group_key: str, spectra_pre: SpectraMatrix, sample_keys: Dict[str, pd.Series]):
+    return compute_group_mean(spectra_pre, sample_keys[summary_group_key])
+
+
+@GRAPH.node("variance", deps=["spectra_pre"])
+def node_variance(spectra_pre: SpectraMatrix) -> np.ndarray:
+    return np.nanvar(spectra_pre.values, axis=0)
+
+
+@GRAPH.node("group_distances", inputs=["distance_metric"], deps=["summary_means"])
+def node_group_distances(distance_metric: str, summary_means) -> Tuple[List[str], np.ndarray]:
+    group_names, group_means = summary_means
+    return group_names, pairwise_distances(group_means, distance_metric)
+
+
+@GRAPH.node("signal_layout", inputs=["dataset"])
+def node_signal_layout(dataset: pd.DataFrame) -> Optional[Dict[str, object]]:
+    return detect_signal_layout(dataset)
+
+
+@GRAPH.node("signals", inputs=["dataset"], deps=["signal_layout"])
+def node_signals(dataset: pd.DataFrame, signal_layout: Optional[Dict[str, object]]) -> Optional[SignalMatrix]:
+    if not signal_layout:
         return None
-    order = np.argsort(w_values)[::-1]
-    ordered_cols = [w_cols[i] for i in order]
-    ordered_vals = [w_values[i] for i in order]
+    return SignalMatrix.from_frame(dataset, signal_layout)
+
+
+@GRAPH.node("signal_keys", deps=["signals"])
+def node_signal_keys(signals: SignalMatrix) -> Dict[str, pd.Series]:
+    names = pd.Series(signals.samples, dtype=object)
+    # Repeat measurements are named "LB2-1 (1)", "LB2-1(2)"; group them under LB2-1.
+    keys = parse_sample_ids(names.str.replace(r"\s*\(\d+\)$", "", regex=True))
     return {
-        "sample_col": sample_col,
-        "w_cols": ordered_cols,
-        "w_vals": ordered_vals,
+        "_prefix": keys["prefix"].astype(object).fillna(names.str.strip()),
+        "_series": keys["series"].astype(object).fillna("-").astype(str),
+        "_sample": keys["sample"].astype(object),
     }
 
 
-def build_long_spectra(df: pd.DataFrame, sample_col: str, w_cols: List[str], w_vals: List[float], samples: List[str]) -> pd.DataFrame:
-    sub = df[df[sample_col].isin(samples)][[sample_col] + w_cols].copy()
-    sub = sub.melt(id_vars=[sample_col], var_name="wavenumber", value_name="intensity")
-    mapper = dict(zip(w_cols, w_vals))
-    sub["wavenumber"] = sub["wavenumber"].map(mapper)
-    return sub.sort_values("wavenumber", ascending=False)
-
-
-def smooth_series(values: np.ndarray, window: int) -> np.ndarray:
-    if window <= 1:
-        return values
-    return pd.Series(values).rolling(window=window, center=True, min_periods=1).mean().to_numpy()
-
-
-def detect_peaks(x: np.ndarray, y: np.ndarray, window: int, min_prom: float, top_n: int) -> pd.DataFrame:
-    y_s = smooth_series(y, window)
-    peaks: List[Tuple[float, float, float]] = []
-    for i in range(1, len(y_s) - 1):
-        if y_s[i] > y_s[i - 1] and y_s[i] > y_s[i + 1]:
-            left = np.min(y_s[max(0, i - window) : i]) if i - window >= 0 else y_s[i - 1]
-            right = np.min(y_s[i + 1 : i + window + 1]) if i + window + 1 <= len(y_s) else y_s[i + 1]
-            prominence = y_s[i] - max(left, right)
-            if prominence >= min_prom:
-                peaks.append((x[i], y[i], y_s[i], prominence))
-    if not peaks:
-        return pd.DataFrame(columns=["峰值", "透过率", "平滑强度", "峰突出度"])
-    peaks = sorted(peaks, key=lambda t: t[3], reverse=True)[:top_n]
-    return pd.DataFrame(peaks, columns=["峰值", "透过率", "平滑强度", "峰突出度"])
-
-
-def default_band_mapping() -> pd.DataFrame:
-    return pd.DataFrame(
-        [
-            {"波段下限": 3600, "波段上限": 3200, "对应基团": "O-H 伸缩", "对应成分": "纤维素/水分"},
-            {"波段下限": 2960, "波段上限": 2850, "对应基团": "C-H 伸缩", "对应成分": "蜡质/有机物"},
-            {"波段下限": 1750, "波段上限": 1715, "对应基团": "C=O 伸缩", "对应成分": "果胶/半纤维素"},
-            {"波段下限": 1605, "波段上限": 1585, "对应基团": "芳香环 C=C", "对应成分": "木质素"},
-            {"波段下限": 1510, "波段上限": 1495, "对应基团": "芳香环 C=C", "对应成分": "木质素"},
-            {"波段下限": 1435, "波段上限": 1415, "对应基团": "芳香环振动", "对应成分": "木质素"},
-            {"波段下限": 1260, "波段上限": 1230, "对应基团": "C-O 伸缩", "对应成分": "木质素/半纤维素"},
-            {"波段下限": 1040, "波段上限": 1005, "对应基团": "C-O-C 伸缩", "对应成分": "纤维素骨架"},
-            {"波段下限": 905, "波段上限": 885, "对应基团": "β-糖苷键", "对应成分": "纤维素"},
-        ]
-    )
+@GRAPH.node("signal_features", inputs=["signal_rate"], deps=["signals"])
+def node_signal_features(signal_rate: float, signals: SignalMatrix) -> pd.DataFrame:
+    stats = trace_stats(signals)
+    spectral = spectral_features(signals, sample_rate=signal_rate or 1.0)
+    return pd.concat([stats, spectral], axis=1)
 
 
-def map_peaks_to_bands(peaks_df: pd.DataFrame, band_df: pd.DataFrame) -> pd.DataFrame:
-    rows = []
-    for _, row in peaks_df.iterrows():
-        peak = float(row["峰值"])
-        match = None
-        for _, b in band_df.iterrows():
-            low = float(b["波段下限"])
-            high = float(b["波段上限"])
-            band_min, band_max = min(low, high), max(low, high)
-            if band_min <= peak <= band_max:
-                match = b
-                break
-        if match is None:
-            band = "未知"
-            group = "未知"
-            comp = "未知"
-        else:
-            band = f"{match['波段下限']}-{match['波段上限']}"
-            group = match["对应基团"]
-            comp = match["对应成分"]
-        rows.append(
-            {
-                "波段": band,
-                "峰值": peak,
-                "对应基团": group,
-                "对应成分": comp,
-                "透过率": float(row["透过率"]),
-            }
-        )
-    return pd.DataFrame(rows)
-
-
-def parse_sample_code(name: str) -> Tuple[str, Optional[int], Optional[int]]:
-    match = re.match(r"^([A-Za-z]+)(\d+)(?:-?(\d+))?$", str(name).strip())
-    if not match:
-        return str(name), None, None
-    prefix = match.group(1).upper()
-    series = int(match.group(2)) if match.group(2) else None
-    replicate = int(match.group(3)) if match.group(3) else None
-    return prefix, series, replicate
-
-
-def load_sample_metadata(base_dir: str) -> Dict[str, object]:
-    path = os.path.join(base_dir, "Sample.xlsx")
-    if not os.path.exists(path):
-        return {}
-    df = pd.read_excel(path, sheet_name=0)
-    meta: Dict[str, object] = {}
-    if len(df.columns) > 1:
-        meta["experiment_text"] = str(df.columns[1])
-
-    sample_map: Dict[str, str] = {}
-    if len(df.columns) >= 3:
-        col_code = df.columns[1]
-        col_desc = df.columns[2]
-        for _, row in df.iterrows():
-            code = str(row.get(col_code, "")).strip()
-            desc = str(row.get(col_desc, "")).strip()
-            if re.match(r"^[A-Za-z]{2}\d+", code) and desc:
-                prefix = re.match(r"^([A-Za-z]{2})", code).group(1).upper()
-                if prefix not in sample_map:
-                    sample_map[prefix] = desc
-    meta["sample_map"] = sample_map
-    return meta
-
-
-def compute_group_mean(df: pd.DataFrame, sample_col: str, w_cols: List[str], group_keys: List[str]) -> pd.DataFrame:
-    grouped = df.groupby(group_keys)[w_cols].mean(numeric_only=True)
-    grouped = grouped.reset_index()
-    return grouped
+@GRAPH.node("echoes", inputs=["echo_method", "echo_window", "echo_k"], deps=["signals"])
+def node_echoes(echo_method: str, echo_window: int, echo_k: float, signals: SignalMatrix) -> pd.DataFrame:
+    return detect_echoes(signals, echo_method, echo_window, echo_k)
+
+
+@GRAPH.node("echo_features", inputs=["signal_rate"], deps=["signals", "echoes"])
+def node_echo_features(signal_rate: float, signals: SignalMatrix, echoes: pd.DataFrame) -> pd.DataFrame:
+    return echo_features(signals, echoes, sample_rate=signal_rate or None)
 
 
 st.title("🌿 菠萝叶纤维分析平台 | Pineapple Leaf Fiber Analysis")
-st.caption("📊 综合数据分析 | FTIR光谱 | 力学性能 | 提取率 | 纤维形态 | 报告生成")
+st.caption("📊 综合数据分析 | FTIR光谱 | 力学性能 | 提取率 | 纤维形态 | 超声信号 | 报告生成")
 
 # Main tab navigation
 analysis_tab = st.selectbox(
     "选择分析模块 Select Analysis Module",
-    ["📂 通用数据分析 General", "🔬 FTIR 光谱分析", "💪 断裂强度分析", "📈 纤维提取率分析", "📏 纤维形态分析", "📄 报告生成器"],
+    ["📂 通用数据分析 General", "🔬 FTIR 光谱分析", "💪 断裂强度分析", "📈 纤维提取率分析", "📏 纤维形态分析", "📄 报告生成器", "🔊 超声信号分析"],
     index=0
 )
 
@@ -254,6 +304,15 @@ with st.sidebar:
     st.header("导入数据")
     upload = st.file_uploader("选择 CSV 或 Excel 文件", type=["csv", "xlsx", "xls"])
     st.caption("建议先做基础清洗：空值、异常值、字段类型")
+    stream_mode = st.checkbox(
+        "流式读取 CSV（超大文件）",
+        value=False,
+        help=f"分块读取并统计，内存中只保留图表抽样；CSV 超过 {STREAM_THRESHOLD_BYTES // (1024 * 1024)} MB 时自动启用",
+    )
+    stream_root = server_data_dir()
+    stream_path = ""
+    if stream_mode and stream_root:
+        stream_path = st.text_input(f"或输入数据目录 {stream_root} 下的 CSV 路径（流式）", value="").strip()
 
     ui_divider()
     st.header("性能与展示限制")
@@ -261,6 +320,10 @@ with st.sidebar:
     chart_rows = st.number_input("图表最大行数", min_value=200, max_value=200000, value=20000, step=200)
     st.session_state["preview_rows"] = int(preview_rows)
     st.session_state["chart_rows"] = int(chart_rows)
+    plot_points = st.number_input("谱线每条最多点数（像素预算）", min_value=200, max_value=20000, value=2000, step=200)
+    plot_method = DECIMATE_METHODS[st.selectbox("谱线降采样方式", list(DECIMATE_METHODS), index=0)]
+    profile_on = st.checkbox("性能剖析模式", value=enabled_from_env(), help="记录各分区耗时与峰值内存，并追加写入 .sidecar/profile.jsonl")
+    profile_slot = st.empty()
 
     if st.button("使用示例数据"):
         sample = pd.DataFrame(
@@ -272,24 +335,92 @@ with st.sidebar:
             }
         )
         st.session_state["df"] = sample
-
-
-if upload is not None:
-    df = load_file(upload)
+        st.session_state["df_key"] = "example"
+        st.session_state.pop("stream", None)
+
+profiler = Profiler(enabled=profile_on, log_path=os.path.join(CACHE_DIR, "profile.jsonl"))
+
+
+def finish_profile() -> None:
+    if not profiler.enabled:
+        return
+    profiler.flush(tab=analysis_tab, dataset=st.session_state.get("df_key"))
+    with profile_slot.container():
+        with st.expander(f"本次运行剖析（{profiler.total_ms():.0f} ms）", expanded=False):
+            if not profiler.memory_traced:
+                st.caption("另一会话正在记录内存，本次仅记录耗时")
+            st.dataframe(profiler.frame(), use_container_width=True)
+
+
+profiler.mark("加载数据")
+stream_source = None
+if stream_path:
+    stream_source = resolve_server_path(stream_path, stream_root)
+    if stream_source is None:
+        st.sidebar.error(f"数据目录中找不到文件：{stream_path}")
+elif upload is not None and upload.name.lower().endswith(".csv") and (stream_mode or upload.size > STREAM_THRESHOLD_BYTES):
+    stream_source = upload
+
+if stream_source is not None:
+    stream_status = st.sidebar.empty()
+    stream_key = source_key(stream_source)
+    with st.spinner("正在分块读取 CSV…"):
+        stream = stream_for(
+            stream_key,
+            stream_source,
+            int(chart_rows),
+            progress=lambda rows: stream_status.caption(f"已读取 {rows:,} 行…"),
+        )
+    stream_status.empty()
+    st.session_state["df"] = stream.sample
+    # The sample depends on the reservoir size, so downstream nodes must key on it too.
+    st.session_state["df_key"] = f"{stream_key}:{int(chart_rows)}"
+    st.session_state["stream"] = stream
+elif upload is not None:
+    df, upload_key = load_file(upload)
     if df is not None:
         st.session_state["df"] = df
+        st.session_state["df_key"] = upload_key
+        st.session_state.pop("stream", None)
 
+cache_stats = PARSE_CACHE.stats()
+st.sidebar.caption(
+    f"解析缓存：命中 {cache_stats.hits} / 未命中 {cache_stats.misses} / 淘汰 {cache_stats.evictions}"
+    f"（{cache_stats.entries} 项，{cache_stats.nbytes / 1e6:.1f} MB）"
+)
 
 df = st.session_state.get("df")
 
 if df is None:
     st.info("请在左侧上传文件或使用示例数据。 | Please upload a file or use sample data.")
+    finish_profile()
     st.stop()
 
+dataset_key = st.session_state.get("df_key") or str(pd.util.hash_pandas_object(df, index=False).sum())
+stream = st.session_state.get("stream")
+run = GRAPH.evaluation(
+    dataset=Input(df, dataset_key),
+    stream=Input(stream, dataset_key),
+    dataset_key=dataset_key,
+    chart_rows=st.session_state.get("chart_rows", 20000),
+)
+
+if stream is not None:
+    st.info(
+        f"🚰 流式模式：{os.path.basename(stream.source)} 共 {stream.rows:,} 行，分 {stream.chunks} 块读取（{stream.seconds:.1f} s），"
+        f"内存中仅保留 {len(stream.sample):,} 行均匀抽样。\n\n"
+        "**精确（全量）**：行数、缺失值、均值/标准差/极值、数值列直方图、类别频数、分组 sum/mean/count/min/max。\n\n"
+        "**近似**：分位数与唯一值（数据量大时）、中位数、相关性，以及各专用模块（基于抽样）。"
+    )
+    if stream.coerced:
+        bad = ", ".join(f"{col}: {n}" for col, n in stream.coerced.items())
+        st.warning(f"以下数值列中有无法解析的文本单元格，已按缺失处理：{bad}")
+
 # ====================================================================================
 # TAB-SPECIFIC ANALYSIS SECTIONS
 # ====================================================================================
 
+profiler.mark(analysis_tab if analysis_tab not in ["📂 通用数据分析 General", "🔬 FTIR 光谱分析"] else "概览")
 if analysis_tab == "💪 断裂强度分析":
     st.header("💪 断裂强度分析 | Break Force Analysis")
     
@@ -318,6 +449,7 @@ if analysis_tab == "💪 断裂强度分析":
     
     if len(replicate_cols) < 1:
         st.warning("⚠️ 请至少选择1个重复测试列")
+        finish_profile()
         st.stop()
     
     # Calculate average
@@ -332,8 +464,9 @@ if analysis_tab == "💪 断裂强度分析":
     df_analysis['CV(%)'] = (df_analysis['StdDev'] / df_analysis['Average'] * 100).round(2)
     
     # Extract sample groups
-    df_analysis['Group'] = df_analysis[sample_col].astype(str).str.extract(r'^([A-Z]+)', expand=False)
-    df_analysis['Is_Control'] = df_analysis[sample_col].astype(str).str.contains('0$', na=False)
+    sample_keys = parse_sample_ids(df_analysis[sample_col])
+    df_analysis['Group'] = sample_keys['prefix']
+    df_analysis['Is_Control'] = sample_keys['is_control']
     
     # Display results
     st.subheader("📊 统计结果 Statistical Results")
@@ -358,7 +491,7 @@ if analysis_tab == "💪 断裂强度分析":
     st.subheader("📈 按组分析 Group Analysis")
     
     if df_analysis['Group'].notna().sum() > 0:
-        group_stats = df_analysis.groupby('Group')['Average'].agg(['count', 'mean', 'std', 'min', 'max']).reset_index()
+        group_stats = df_analysis.groupby('Group', observed=True)['Average'].agg(['count', 'mean', 'std', 'min', 'max']).reset_index()
         group_stats.columns = ['组别 Group', '样本数 N', '平均值 Mean', '标准差 Std', '最小值 Min', '最大值 Max']
         
         st.dataframe(group_stats.style.format({
@@ -369,8 +502,6 @@ if analysis_tab == "💪 断裂强度分析":
         }), use_container_width=True)
         
         # Visualizations
-        import plotly.graph_objects as go
-        
         col1, col2 = st.columns(2)
         
         with col1:
@@ -465,7 +596,7 @@ elif analysis_tab == "📈 纤维提取率分析":
         df_analysis = df_analysis[df_analysis['Extraction_Rate'].notna()]
     
     # Extract groups
-    df_analysis['Group'] = df_analysis[sample_col].astype(str).str.extract(r'^([A-Z]+)', expand=False)
+    df_analysis['Group'] = parse_sample_ids(df_analysis[sample_col])['prefix']
     
     # Statistics
     st.subheader("📊 统计结果")
@@ -489,7 +620,7 @@ elif analysis_tab == "📈 纤维提取率分析":
     if df_analysis['Group'].notna().sum() > 0:
         st.subheader("📈 按组分析")
         
-        group_stats = df_analysis.groupby('Group')['Extraction_Rate'].agg(['count', 'mean', 'std', 'min', 'max']).reset_index()
+        group_stats = df_analysis.groupby('Group', observed=True)['Extraction_Rate'].agg(['count', 'mean', 'std', 'min', 'max']).reset_index()
         group_stats['mean_%'] = (group_stats['mean'] * 100).round(1)
         
         st.dataframe(group_stats, use_container_width=True)
@@ -600,7 +731,59 @@ elif analysis_tab == "📄 报告生成器":
     - 🔲 PowerPoint 演示文稿
     - 🔲 自定义报告模板
     """)
-    
+
+    st.subheader("🔗 工艺参数 × 响应联合分析")
+    sample_table = build_sample_table(os.path.dirname(os.path.abspath(__file__)), st.session_state.get("band_map"))
+    if not sample_table:
+        st.info("未找到 Break_force.xlsx / 纤维提取率.xlsx / FTIR.xlsx，无法建立联合样本表。")
+    else:
+        st.caption(
+            "按解析后的样本编号合并：" + "、".join(sample_table.sources)
+            + "，并附加 Sample.xlsx 中的处理参数；每个响应对每个过程变量做一元线性回归（批量矩阵计算）。"
+        )
+        with st.expander("联合样本表", expanded=False):
+            st.dataframe(sample_table.frame, use_container_width=True, hide_index=True)
+        group_options = {"按纤维类型": ["纤维类型"], "不分组": None, "按纤维类型 + 系列": ["纤维类型", "系列"]}
+        col_a, col_b, col_c = st.columns(3)
+        group_choice = col_a.selectbox("分组方式:", list(group_options), key="fit_group")
+        include_controls = col_b.checkbox("包含对照样（系列 0）", value=False, key="fit_controls")
+        alpha = col_c.number_input("显著性水平 α", min_value=0.001, max_value=0.5, value=0.05, step=0.01, key="fit_alpha")
+        fit_frame = sample_table.frame
+        if not include_controls:
+            fit_frame = fit_frame[fit_frame["系列"].fillna(0) > 0]
+        fits = batch_regression(fit_frame, sample_table.responses, sample_table.variables, by=group_options[group_choice])
+        if fits.empty:
+            st.info("没有可拟合的响应-变量组合（每组至少需要 3 个完整样本且变量不恒定）。")
+        else:
+            only_sig = st.checkbox("只显示显著结果 (p < α)", value=True, key="fit_sig")
+            shown = strongest_fits(fits, alpha, len(fits)) if only_sig else fits
+            st.dataframe(
+                shown.style.format({"斜率": "{:.4g}", "截距": "{:.4g}", "r": "{:.3f}", "R²": "{:.3f}", "t": "{:.2f}", "p值": "{:.3g}"}),
+                use_container_width=True,
+                hide_index=True,
+            )
+            st.download_button(
+                "下载回归结果 CSV",
+                data=fits.to_csv(index=False).encode("utf-8-sig"),
+                file_name="process_regression.csv",
+                mime="text/csv",
+            )
+            col_y, col_x = st.columns(2)
+            fit_y = col_y.selectbox("响应:", sample_table.responses, key="fit_y")
+            fit_x = col_x.selectbox("过程变量:", sample_table.variables, key="fit_x")
+            fig = px.scatter(
+                fit_frame, x=fit_x, y=fit_y, color="纤维类型", hover_data=["样本"],
+                title=f"{fit_y} vs {fit_x}",
+            )
+            lines = fits[(fits["响应"] == fit_y) & (fits["过程变量"] == fit_x)]
+            x_line = np.array([fit_frame[fit_x].min(), fit_frame[fit_x].max()], dtype=float)
+            for _, row in lines.iterrows():
+                fig.add_trace(go.Scatter(
+                    x=x_line, y=row["截距"] + row["斜率"] * x_line, mode="lines", line={"dash": "dash"},
+                    name=f"{row['分组']} 拟合 (r={row['r']:.2f})",
+                ))
+            st.plotly_chart(fig, use_container_width=True)
+
     if st.button("生成简易文本报告"):
         st.subheader("📋 数据分析报告")
         st.markdown(f"""
@@ -618,33 +801,141 @@ elif analysis_tab == "📄 报告生成器":
         if len(numeric_df.columns) > 0:
             st.dataframe(numeric_df.describe(), use_container_width=True)
 
+elif analysis_tab == "🔊 超声信号分析":
+    st.header("🔊 超声信号分析 | Ultrasonic Signal Analysis")
+
+    st.info("📋 **数据格式要求**: 每列一条回波信号，第一行为样本名；样本名之后未命名的列视为该样本的重复测量")
+
+    signals = run["signals"]
+    if signals is None:
+        st.warning("⚠️ 未检测到超声信号结构（首行样本名 + 每列一条数值信号）")
+        finish_profile()
+        st.stop()
+
+    signal_keys = run["signal_keys"]
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("信号条数 Traces", signals.n_traces)
+    col2.metric("样本数 Samples", len(signals.unique_samples()))
+    col3.metric("每条点数 Points", signals.n_timepoints)
+    col4.metric("重复测量 Repeats", int((~signals.primary).sum()))
+
+    col_a, col_b = st.columns(2)
+    signal_rate = col_a.number_input(
+        "采样率 (Hz，0 表示按采样点计)", min_value=0.0, value=0.0, step=1e6, format="%.6g", key="signal_rate"
+    )
+    only_named = col_b.checkbox("仅分析命名列（每个样本的第一条信号）", value=False, key="signal_named")
+    time_unit = "s" if signal_rate else "采样点"
+    time_axis = np.arange(signals.n_timepoints) / signal_rate if signal_rate else np.arange(signals.n_timepoints)
+    run.bind(signal_rate=float(signal_rate))
+
+    with st.expander("📈 信号叠加 Trace Overlay", expanded=True):
+        all_samples = signals.unique_samples()
+        pick = st.multiselect("选择样本", all_samples, default=all_samples[: min(3, len(all_samples))], key="signal_samples")
+        rows = np.flatnonzero(np.isin(signals.samples, pick) & (signals.primary | (not only_named)))
+        if len(rows):
+            labels = [f"{signals.samples[r]} #{signals.trace[r] + 1}" for r in rows]
+            fig = spectra_figure(
+                time_axis, signals.values[rows], labels, "回波信号", "样本 #重复", int(plot_points), plot_method,
+                x_title=f"时间 ({time_unit})", y_title="幅值", reverse_x=False,
+            )
+            st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.warning("请至少选择一个样本")
+
+    features = run["signal_features"]
+    with st.expander("📍 回波分割与飞行时间 Echoes / TOF", expanded=False):
+        col_a, col_b, col_c = st.columns(3)
+        echo_method = col_a.selectbox("包络", list(ENVELOPES), format_func=ENVELOPES.get, key="echo_method")
+        echo_window = col_b.number_input("包络窗口（采样点）", min_value=1, max_value=201, value=15, step=2, key="echo_window")
+        echo_k = col_c.number_input("阈值（噪声 MAD 倍数）", min_value=1.0, max_value=30.0, value=6.0, step=0.5, key="echo_k")
+        run.bind(echo_method=echo_method, echo_window=int(echo_window), echo_k=float(echo_k))
+        echoes = run["echoes"]
+        st.caption(f"共检测到 {len(echoes)} 个回波；回波按到达顺序编号，对应直接回弹 / 纤维 / 溶液 / 杂质仅为假设，需结合实验验证。")
+        if len(rows):
+            env = envelope(signals.select(rows), echo_method, int(echo_window))
+            fig = spectra_figure(
+                time_axis, env, labels, "信号包络", "样本 #重复", int(plot_points), plot_method,
+                x_title=f"时间 ({time_unit})", y_title="包络幅值", reverse_x=False,
+            )
+            picked = echoes[echoes["Trace"].isin(rows)]
+            fig.add_trace(go.Scatter(
+                x=time_axis[picked["Peak"].to_numpy(dtype=np.intp)], y=picked["PeakAmplitude"], mode="markers",
+                marker={"symbol": "x", "size": 9}, name="回波峰",
+            ))
+            st.plotly_chart(fig, use_container_width=True)
+        features = pd.concat([features, run["echo_features"]], axis=1)
+
+    features = features[features["Points"] > 0]
+    if only_named:
+        features = features[signals.primary[features.index]]
+    group_options = {"样本前缀 (LB/LD/SS/SR)": "_prefix", "系列编号 (1/2/3/4)": "_series", "样本": "_sample"}
+
+    st.subheader("📊 逐样本统计 Per-Sample Statistics")
+    metric_cols = [c for c in features.columns if c not in ("Sample", "Trace")]
+    by_sample = features[metric_cols].groupby(signal_keys["_sample"].to_numpy()[features.index], sort=False)
+    per_sample = by_sample.mean()
+    per_sample.insert(0, "信号条数", by_sample.size())
+    per_sample.index.name = "样本"
+    st.dataframe(per_sample, use_container_width=True)
+
+    st.subheader("📈 组间对比 Group Comparison")
+    col_a, col_b = st.columns(2)
+    group_choice = col_a.selectbox("分组方式", list(group_options), index=0, key="signal_group")
+    default_metric = metric_cols.index("RMS") if "RMS" in metric_cols else 0
+    metric = col_b.selectbox("对比指标", metric_cols, index=default_metric, key="signal_metric")
+    plot_df = features.assign(Group=signal_keys[group_options[group_choice]].to_numpy()[features.index])
+    group_stats = plot_df.groupby("Group", sort=False)[metric].agg(["count", "mean", "std", "min", "max"]).reset_index()
+    group_stats.columns = ["组别 Group", "信号数 N", "平均值 Mean", "标准差 Std", "最小值 Min", "最大值 Max"]
+    st.dataframe(group_stats, use_container_width=True, hide_index=True)
+    col1, col2 = st.columns(2)
+    with col1:
+        fig_box = px.box(plot_df, x="Group", y=metric, points="all", hover_data=["Sample"], title=f"{metric} 分布")
+        st.plotly_chart(fig_box, use_container_width=True)
+    with col2:
+        fig_bar = px.bar(group_stats, x="组别 Group", y="平均值 Mean", error_y="标准差 Std", title=f"组间平均 {metric}")
+        st.plotly_chart(fig_bar, use_container_width=True)
+
+    st.subheader("💾 导出结果 Export Results")
+    st.download_button(
+        label="📥 下载逐信号特征 CSV",
+        data=features.to_csv(index=False).encode("utf-8-sig"),
+        file_name="ultrasonic_signal_features.csv",
+        mime="text/csv",
+    )
+
 elif analysis_tab == "🔬 FTIR 光谱分析":
     st.header("🔬 FTIR 光谱分析 | FTIR Spectroscopy Analysis")
     # Continue with existing FTIR code below...
-    render_overview(df)
+    render_overview(df, run["summary"])
 
 else:  # Default: General Analysis
-    render_overview(df)
+    render_overview(df, run["summary"])
 
 # Only show general analysis tabs if in general mode
 if analysis_tab in ["📂 通用数据分析 General", "🔬 FTIR 光谱分析"]:
     pass  # Continue with existing code below
 else:
+    finish_profile()
     st.stop()  # Stop execution if in specialized analysis mode
 
 ui_divider()
 
+profiler.mark("统计概览")
 st.subheader("统计概览")
 with st.expander("描述性统计（数值列）", expanded=True):
-    numeric_cols = df.select_dtypes(include="number").columns
-    if len(numeric_cols) == 0:
+    described = run["describe"]
+    if described.empty:
         st.warning("没有可用的数值列")
     else:
-        st.dataframe(df[numeric_cols].describe().T, use_container_width=True)
+        st.dataframe(described, use_container_width=True)
+        if not run["colstats"].quantiles_exact:
+            st.caption("数据量较大，25% / 50% / 75% 分位数为单次扫描的近似值；其余统计量为精确值。")
+
+with st.expander("列概况（类型 / 缺失率 / 唯一值）", expanded=False):
+    st.dataframe(run["colstats"].overview(), use_container_width=True)
 
 with st.expander("缺失值分布", expanded=False):
-    missing = df.isna().sum().sort_values(ascending=False)
-    missing = missing[missing > 0]
+    missing = run["missing"]
     if missing.empty:
         st.success("无缺失值")
     else:
@@ -652,20 +943,37 @@ with st.expander("缺失值分布", expanded=False):
 
 ui_divider()
 
+profiler.mark("可视化")
 st.subheader("可视化")
 
-chart_df = safe_sample(df, st.session_state.get("chart_rows", 20000))
-if len(chart_df) < len(df):
-    st.info(f"为避免浏览器过载，图表仅使用抽样数据：{len(chart_df)} 行 / 总计 {len(df)} 行。")
-
-summary = summarize(df)
+summary = run["summary"]
+sample_by = None
+if len(df) > st.session_state.get("chart_rows", 20000) and summary.categorical_cols:
+    sample_options = ["（均匀抽样）"] + summary.categorical_cols
+    sample_pick = st.selectbox("抽样方式：按列分层（保证每组都有数据）", sample_options, key="sample_by")
+    sample_by = None if sample_pick == sample_options[0] else sample_pick
+run.bind(sample_by=sample_by)
+chart_df = run["chart_df"]
+if len(chart_df) < summary.rows:
+    how = f"按 {sample_by} 分层抽样" if sample_by else "抽样数据"
+    st.info(f"为避免浏览器过载，图表仅使用{how}：{len(chart_df)} 行 / 总计 {summary.rows} 行；频数、分组汇总与相关性基于全部数据。")
 
 cols = st.columns(2)
 
 with cols[0]:
     st.markdown("**数值列分布**")
-    num_col = st.selectbox("选择数值列", df.select_dtypes(include="number").columns, key="num_col")
-    if num_col:
+    num_col = st.selectbox("选择数值列", summary.numeric_cols, key="num_col")
+    if num_col and stream is not None and num_col in stream.hists:
+        hist = stream.hists[num_col].table(30)
+        fig = px.bar(x=(hist["下限"] + hist["上限"]) / 2, y=hist["数量"], title=f"{num_col} 分布（全量，精确）")
+        fig.update_traces(width=float((hist["上限"] - hist["下限"]).iloc[0]))
+        fig.update_layout(xaxis_title=str(num_col), yaxis_title="count", bargap=0)
+        st.plotly_chart(fig, use_container_width=True)
+    elif num_col and sample_by:
+        # Strata are over-represented in the sample, so show each one separately.
+        fig = px.histogram(chart_df, x=num_col, color=sample_by, nbins=30, barmode="overlay", title=f"{num_col} 分布（按 {sample_by} 分层）")
+        st.plotly_chart(fig, use_container_width=True)
+    elif num_col:
         fig = px.histogram(chart_df, x=num_col, nbins=30, title=f"{num_col} 分布")
         st.plotly_chart(fig, use_container_width=True)
 
@@ -673,21 +981,41 @@ with cols[1]:
     st.markdown("**类别列对比**")
     cat_col = st.selectbox("选择类别列", summary.categorical_cols, key="cat_col")
     if cat_col:
-        vc = chart_df[cat_col].value_counts().reset_index()
+        exact_counts = stream.counts[cat_col].top() if stream is not None and cat_col in stream.counts else None
+        vc = (exact_counts if exact_counts is not None else df[cat_col].value_counts()).reset_index()
         vc.columns = [cat_col, "数量"]
-        fig = px.bar(vc, x=cat_col, y="数量", title=f"{cat_col} 频数")
+        note = "" if stream is None else ("（全量，精确）" if exact_counts is not None else "（抽样，近似）")
+        fig = px.bar(vc, x=cat_col, y="数量", title=f"{cat_col} 频数{note}")
         st.plotly_chart(fig, use_container_width=True)
 
 ui_divider()
 
+profiler.mark("分组汇总")
 st.subheader("分组汇总")
 
 group_cols = st.multiselect("选择分组列", df.columns.tolist())
-agg_col = st.selectbox("选择聚合列（数值）", df.select_dtypes(include="number").columns, key="agg_col")
-agg_func = st.selectbox("聚合方式", ["sum", "mean", "median", "count", "min", "max"])
+agg_col = st.selectbox("选择聚合列（数值）", run["summary"].numeric_cols, key="agg_col")
+agg_func = st.selectbox("聚合方式", CUBE_FUNCS)
 
 if group_cols and agg_col:
-    grouped = chart_df.groupby(group_cols)[agg_col].agg(agg_func).reset_index()
+    if stream is not None and stream_source is not None and agg_func != "median":
+        full = groupby_for(dataset_key, stream_source, stream.plan, group_cols, agg_col)
+        grouped = full[group_cols + [agg_func]].rename(columns={agg_func: agg_col})
+        st.caption("分组汇总基于全量数据分块计算（精确）。")
+    elif stream is not None:
+        grouped = df.groupby(group_cols, observed=True)[agg_col].agg(agg_func).reset_index()
+        st.caption("中位数（或数据源已不可用时）基于抽样计算，为近似值。")
+    else:
+        cube = run["cube"]
+        if cube.covers(group_cols) and agg_col in cube.measures:
+            grouped = cube.query(group_cols, agg_col, agg_func)
+            approx = agg_func == "median" and not cube.median_exact(agg_col)
+            st.caption(
+                f"由预聚合立方体汇总（{cube.cells} 个分组组合）"
+                + ("，中位数来自分位数草图，为近似值。" if approx else "，结果与逐行计算一致。")
+            )
+        else:
+            grouped = df.groupby(group_cols, observed=True)[agg_col].agg(agg_func).reset_index()
     st.dataframe(grouped, use_container_width=True)
 
     if len(group_cols) == 1:
@@ -696,40 +1024,87 @@ if group_cols and agg_col:
 
 ui_divider()
 
+profiler.mark("相关性")
 st.subheader("相关性（数值列）")
-num_df = chart_df.select_dtypes(include="number")
-if num_df.shape[1] >= 2:
-    corr = num_df.corr(numeric_only=True)
-    fig = px.imshow(corr, text_auto=True, title="相关矩阵")
+if stream is not None:
+    st.caption("流式模式下相关性基于抽样计算，为近似值。")
+corr_cols = st.columns(3)
+corr_label = corr_cols[0].selectbox("相关系数", list(CORR_METHODS), key="corr_method")
+corr_float32 = corr_cols[1].checkbox("float32 计算（更快，精度约 1e-6）", value=False, key="corr_float32")
+corr_order = corr_cols[2].checkbox("聚类排序", value=False, key="corr_order", help="按相关结构重排行列，使相关的列聚在一起")
+run.bind(corr_method=CORR_METHODS[corr_label], corr_float32=corr_float32)
+corr = run["corr"]
+if corr is not None:
+    heat = corr.heatmap
+    if corr_order:
+        heat = heat.iloc[corr.order, corr.order]
+    if corr.binned:
+        title = f"相关矩阵（{len(corr.columns)} 列，按相邻列分 {len(heat)} 段取平均）"
+    else:
+        title = "相关矩阵"
+    fig = px.imshow(
+        heat,
+        text_auto=".2f" if len(heat) <= 20 else False,
+        zmin=-1,
+        zmax=1,
+        color_continuous_scale="RdBu_r",
+        title=title,
+    )
     st.plotly_chart(fig, use_container_width=True)
+    with st.expander("相关性最强的列对", expanded=corr.binned):
+        pair_count = max(1, len(corr.top_pairs))
+        top_n = st.number_input("显示对数", min_value=1, max_value=pair_count, value=min(20, pair_count), step=5)
+        st.dataframe(corr.top_pairs.head(int(top_n)), use_container_width=True)
 else:
     st.info("数值列不足，无法计算相关性。")
 
 ui_divider()
 
+profiler.mark("FTIR 专用分析")
 st.subheader("FTIR 专用分析")
-ftir = detect_ftir_structure(df)
+ftir = run["ftir"]
 meta = load_sample_metadata(os.path.dirname(__file__))
 if not ftir:
     st.info("未检测到典型 FTIR 结构（首列样本名 + 大量波数列）。")
 else:
-    sample_col = ftir["sample_col"]
-    w_cols = ftir["w_cols"]
-    w_vals = ftir["w_vals"]
-
-    df_ftir = df.copy()
-    df_ftir[sample_col] = df_ftir[sample_col].astype(str)
-    df_ftir["_prefix"], df_ftir["_series"], df_ftir["_replicate"] = zip(
-        *df_ftir[sample_col].map(parse_sample_code)
-    )
-    all_samples = df_ftir[sample_col].dropna().unique().tolist()
+    with st.expander("光谱预处理（基线 / 归一化 / Savitzky–Golay）", expanded=False), profiler.section("光谱预处理"):
+        c1, c2, c3 = st.columns(3)
+        pre_baseline = c1.selectbox("基线校正", list(BASELINES), format_func=BASELINES.get, key="pre_baseline")
+        pre_normalize = c2.selectbox("归一化", list(NORMALIZATIONS), format_func=NORMALIZATIONS.get, key="pre_normalize")
+        pre_window = c3.selectbox("SG 窗口（0 为不平滑）", [0, 5, 7, 9, 11, 15, 21, 31], index=0, key="pre_sg_window")
+        pre_args = {}
+        if pre_baseline == "als":
+            c1, c2, c3 = st.columns(3)
+            pre_args["lam"] = 10.0 ** c1.number_input("平滑度 log10(λ)", min_value=2.0, max_value=9.0, value=5.0, step=0.5, key="pre_lam")
+            pre_args["p"] = c2.number_input("非对称权重 p", min_value=0.001, max_value=0.2, value=0.01, step=0.005, format="%.3f", key="pre_p")
+            pre_args["iterations"] = int(c3.number_input("迭代次数", min_value=1, max_value=50, value=10, step=1, key="pre_iter"))
+        if pre_window:
+            c1, c2 = st.columns(2)
+            pre_args["sg_order"] = c1.selectbox("多项式阶数", [2, 3, 4], index=0, key="pre_sg_order")
+            pre_args["derivative"] = c2.selectbox("导数阶数", list(range(pre_args["sg_order"] + 1))[:3], index=0, key="pre_sg_deriv")
+        preprocessing = Preprocessing(pre_baseline, normalize=pre_normalize, sg_window=pre_window, **pre_args)
+        st.caption(
+            f"当前：{preprocessing.label()}。顺序为基线 → 归一化 → Savitzky–Golay；基线按峰朝上（吸光度）拟合。"
+            "谱线、平均谱、差异谱、峰位检测与分组平均均使用预处理后的光谱，每组参数的结果会被缓存。"
+        )
+        if preprocessing.derivative:
+            st.caption("导数谱中吸收峰的位置表现为过零点（一阶）或极小值（二阶），峰位检测只查找极大值。")
+    run.bind(preprocessing=preprocessing)
+    sm = run["spectra_pre"]
+    spectra_key = dataset_key if preprocessing.is_identity else f"{dataset_key}-{preprocessing.key}"
+    sample_col = sm.sample_col
+    w_vals = sm.wavenumbers
+    all_samples = sm.unique_samples()
     default_samples = all_samples[: min(5, len(all_samples))]
 
-    if meta.get("experiment_text"):
-        with st.expander("实验说明（来自 Sample.xlsx）", expanded=False):
-            st.write(meta["experiment_text"])
+    if meta.experiment_text:
+        with st.expander("实验说明（来自 Sample.xlsx）", expanded=False), profiler.section("实验说明（来自 Sample.xlsx）"):
+            st.write(meta.experiment_text)
+            if len(meta.params):
+                st.markdown("**处理参数（按系列-重复编号）**")
+                st.dataframe(meta.params, use_container_width=True, hide_index=True)
 
-    with st.expander("FTIR 波段-基团映射", expanded=False):
+    with st.expander("FTIR 波段-基团映射", expanded=False), profiler.section("FTIR 波段-基团映射"):
         if "band_map" not in st.session_state:
             st.session_state["band_map"] = default_band_mapping()
         st.caption("可在下方粘贴 CSV 进行编辑并应用。列名需包含：波段下限、波段上限、对应基团、对应成分。")
@@ -751,71 +1126,64 @@ else:
             except Exception as exc:
                 st.error(f"CSV 解析失败：{exc}")
 
-    with st.expander("谱线绘制（单样本/多样本）", expanded=True):
+    with st.expander("谱线绘制（单样本/多样本）", expanded=True), profiler.section("谱线绘制（单样本/多样本）"):
         pick_samples = st.multiselect("选择样本", all_samples, default=default_samples, key="ftir_samples")
-        step = st.number_input("每隔 N 个波数取点", min_value=1, max_value=20, value=1, step=1)
         if pick_samples:
-            w_cols_step = w_cols[:: int(step)]
-            w_vals_step = w_vals[:: int(step)]
-            long_df = build_long_spectra(df_ftir, sample_col, w_cols_step, w_vals_step, pick_samples)
-            fig = px.line(long_df, x="wavenumber", y="intensity", color=sample_col, title="样本谱线")
-            fig.update_xaxes(autorange="reversed")
+            rows = sm.positions(pick_samples)
+            fig = spectra_figure(
+                w_vals, sm.values[rows], sm.sample_ids[rows], "样本谱线", str(sample_col), int(plot_points), plot_method
+            )
             st.plotly_chart(fig, use_container_width=True)
         else:
             st.warning("请至少选择一个样本")
 
-    with st.expander("平均谱", expanded=False):
+    with st.expander("平均谱", expanded=False), profiler.section("平均谱"):
         avg_samples = st.multiselect("选择用于平均的样本", all_samples, default=default_samples, key="ftir_avg_samples")
         if avg_samples:
-            sub = df_ftir[df_ftir[sample_col].isin(avg_samples)][w_cols].copy()
-            avg = sub.mean(axis=0, skipna=True).to_numpy()
-            avg_df = pd.DataFrame({"wavenumber": w_vals, "intensity": avg}).sort_values("wavenumber", ascending=False)
-            fig = px.line(avg_df, x="wavenumber", y="intensity", title="平均谱")
-            fig.update_xaxes(autorange="reversed")
+            run.bind(avg_samples=tuple(avg_samples))
+            avg = run["avg_spectrum"]
+            fig = spectra_figure(w_vals, avg, None, "平均谱", None, int(plot_points), plot_method)
             st.plotly_chart(fig, use_container_width=True)
         else:
             st.warning("请至少选择一个样本")
 
-    with st.expander("差异谱（样本 - 参考）", expanded=False):
+    with st.expander("差异谱（样本 - 参考）", expanded=False), profiler.section("差异谱（样本 - 参考）"):
         ref_sample = st.selectbox("参考样本", all_samples, index=0, key="ftir_ref")
         diff_samples = st.multiselect("对比样本", all_samples, default=default_samples, key="ftir_diff_samples")
         if ref_sample and diff_samples:
-            ref_row = df_ftir[df_ftir[sample_col] == ref_sample][w_cols].iloc[0].to_numpy()
-            rows = []
-            for s in diff_samples:
-                target = df_ftir[df_ftir[sample_col] == s][w_cols].iloc[0].to_numpy()
-                diff = target - ref_row
-                rows.append(pd.DataFrame({"wavenumber": w_vals, "intensity": diff, "样本": s}))
-            diff_df = pd.concat(rows, ignore_index=True).sort_values("wavenumber", ascending=False)
-            fig = px.line(diff_df, x="wavenumber", y="intensity", color="样本", title="差异谱")
-            fig.update_xaxes(autorange="reversed")
+            ref_row = sm.row(ref_sample)
+            diffs = np.vstack([sm.row(s) for s in diff_samples]) - ref_row
+            fig = spectra_figure(w_vals, diffs, diff_samples, "差异谱", "样本", int(plot_points), plot_method)
             st.plotly_chart(fig, use_container_width=True)
         else:
             st.warning("请选择参考样本和至少一个对比样本")
 
-    with st.expander("峰位检测", expanded=False):
+    with st.expander("峰位检测", expanded=False), profiler.section("峰位检测"):
         peak_mode = st.selectbox("峰位来源", ["单一样本", "平均谱"], index=0)
         peak_sample = st.selectbox("选择样本", all_samples, index=0, key="ftir_peak_sample")
         smooth_window = st.number_input("平滑窗口", min_value=1, max_value=31, value=5, step=2)
         if peak_mode == "平均谱":
             avg_samples = st.multiselect("选择用于平均的样本", all_samples, default=default_samples, key="ftir_peak_avg")
             if avg_samples:
-                y_vals = df_ftir[df_ftir[sample_col].isin(avg_samples)][w_cols].mean(axis=0, skipna=True).to_numpy()
+                y_vals = sm.mean(avg_samples)
             else:
-                y_vals = df_ftir[df_ftir[sample_col] == peak_sample][w_cols].iloc[0].to_numpy()
+                y_vals = sm.row(peak_sample)
         else:
-            y_vals = df_ftir[df_ftir[sample_col] == peak_sample][w_cols].iloc[0].to_numpy()
+            y_vals = sm.row(peak_sample)
         prom_max = float(np.nanmax(y_vals) - np.nanmin(y_vals))
         prom_max = prom_max if prom_max > 0 else 0.01
-        min_prom = st.slider("最小峰突出度", min_value=0.0, max_value=prom_max, value=min(0.001, prom_max), step=0.001)
+        prom_step = min(0.001, float(f"{prom_max / 100:.1g}"))
+        min_prom = st.slider("最小峰突出度", min_value=0.0, max_value=prom_max, value=min(0.001, prom_max), step=prom_step)
         top_n = st.number_input("返回峰数量", min_value=5, max_value=50, value=15, step=1)
-        peaks_df = detect_peaks(np.array(w_vals), y_vals, int(smooth_window), float(min_prom), int(top_n))
+        peaks_df = detect_peaks(w_vals, y_vals, int(smooth_window), float(min_prom), int(top_n))
         st.dataframe(peaks_df, use_container_width=True)
 
         band_df = st.session_state.get("band_map", default_band_mapping())
         result_df = map_peaks_to_bands(peaks_df, band_df)
         st.markdown("**FTIR 峰表（波段 / 峰值 / 基团 / 成分 / 透过率）**")
         st.dataframe(result_df, use_container_width=True)
+        if st.checkbox("显示重叠波段的全部匹配", value=False, key="ftir_all_band_matches") and not peaks_df.empty:
+            st.dataframe(compile_bands(band_df).explode(peaks_df[["峰值", "透过率"]]), use_container_width=True)
         if not result_df.empty:
             comp_counts = result_df["对应成分"].value_counts().to_dict()
             comp_summary = ", ".join([f"{k}: {v}" for k, v in comp_counts.items()])
@@ -828,52 +1196,73 @@ else:
             mime="text/csv",
         )
 
-    with st.expander("分组平均谱与差异", expanded=False):
+    with st.expander("全样本峰索引（批量）", expanded=False), profiler.section("全样本峰索引（批量）"):
+        st.caption("对数据集中所有样本一次性检测峰位并缓存，参数或数据变化时才重新计算。")
+        c1, c2 = st.columns(2)
+        index_window = c1.number_input("平滑窗口", min_value=1, max_value=31, value=5, step=2, key="peak_index_window")
+        index_prom = c2.number_input("最小峰突出度", min_value=0.0, value=0.001, step=0.001, format="%.4f", key="peak_index_prom")
+        peak_index = peak_index_for(
+            sm,
+            spectra_key,
+            int(index_window),
+            float(index_prom),
+            store_dir=os.path.join(CACHE_DIR, "peaks"),
+        )
+        st.caption(f"索引共 {len(peak_index)} 个峰，覆盖 {sm.n_samples} 条谱线。")
+        c3, c4 = st.columns(2)
+        range_low = c3.number_input("波数下限", value=1715.0, step=5.0, key="peak_range_low")
+        range_high = c4.number_input("波数上限", value=1740.0, step=5.0, key="peak_range_high")
+        hits = peak_index.samples_with_peak(range_low, range_high)
+        st.markdown(f"**在 {min(range_low, range_high):.0f}–{max(range_low, range_high):.0f} cm⁻¹ 内有峰的样本：{len(hits)} 个**")
+        st.dataframe(hits, use_container_width=True)
+        band_df = st.session_state.get("band_map", default_band_mapping())
+        all_peaks = annotate_bands(peak_index.by_sample.drop(columns=["row", "rank"]), band_df)
+        st.download_button(
+            "下载全样本峰表 CSV",
+            data=all_peaks.to_csv(index=False).encode("utf-8-sig"),
+            file_name="ftir_peak_index.csv",
+            mime="text/csv",
+        )
+
+    with st.expander("分组平均谱与差异", expanded=False), profiler.section("分组平均谱与差异"):
         group_mode = st.selectbox("分组方式", ["样本前缀 (LB/LD/SS/SR)", "系列编号 (1/2/3/4)"], index=0)
         if group_mode.startswith("样本前缀"):
             group_key = "_prefix"
         else:
             group_key = "_series"
-        grouped = compute_group_mean(df_ftir, sample_col, w_cols, [group_key])
-        group_vals = grouped[group_key].dropna().astype(str).tolist()
+        run.bind(group_key=group_key)
+        group_vals, group_means = run["group_means"]
+        group_rows = {g: i for i, g in enumerate(group_vals)}
         selected_groups = st.multiselect("选择对比组", group_vals, default=group_vals[: min(4, len(group_vals))])
         if selected_groups:
-            rows = []
-            for g in selected_groups:
-                row = grouped[grouped[group_key].astype(str) == str(g)][w_cols].iloc[0].to_numpy()
-                rows.append(pd.DataFrame({"wavenumber": w_vals, "intensity": row, "组别": str(g)}))
-            gdf = pd.concat(rows, ignore_index=True).sort_values("wavenumber", ascending=False)
-            fig = px.line(gdf, x="wavenumber", y="intensity", color="组别", title="分组平均谱")
-            fig.update_xaxes(autorange="reversed")
+            block = group_means[[group_rows[str(g)] for g in selected_groups]]
+            fig = spectra_figure(w_vals, block, selected_groups, "分组平均谱", "组别", int(plot_points), plot_method)
             st.plotly_chart(fig, use_container_width=True)
 
             if len(selected_groups) >= 2:
                 base = selected_groups[0]
-                base_row = grouped[grouped[group_key].astype(str) == str(base)][w_cols].iloc[0].to_numpy()
-                diff_rows = []
-                for g in selected_groups[1:]:
-                    row = grouped[grouped[group_key].astype(str) == str(g)][w_cols].iloc[0].to_numpy()
-                    diff_rows.append(pd.DataFrame({"wavenumber": w_vals, "intensity": row - base_row, "组别": f"{g}-vs-{base}"}))
-                diff_df = pd.concat(diff_rows, ignore_index=True).sort_values("wavenumber", ascending=False)
-                fig = px.line(diff_df, x="wavenumber", y="intensity", color="组别", title="组间差异谱")
-                fig.update_xaxes(autorange="reversed")
+                base_row = group_means[group_rows[str(base)]]
+                block = group_means[[group_rows[str(g)] for g in selected_groups[1:]]] - base_row
+                labels = [f"{g}-vs-{base}" for g in selected_groups[1:]]
+                fig = spectra_figure(w_vals, block, labels, "组间差异谱", "组别", int(plot_points), plot_method)
                 st.plotly_chart(fig, use_container_width=True)
         else:
             st.warning("请选择至少一个组")
 
 ui_divider()
 
+profiler.mark("自动分析摘要")
 st.subheader("自动分析摘要")
 if ftir:
     summary_lines = []
     summary_lines.append(f"检测到 FTIR 结构：样本列为 {ftir['sample_col']}，波数列约 {len(ftir['w_cols'])} 个。")
 
-    if meta.get("sample_map"):
-        maps = meta["sample_map"]
+    if meta.prefix_desc:
+        maps = meta.prefix_desc
         mapped = ", ".join([f"{k}: {v}" for k, v in maps.items()])
         summary_lines.append(f"样本前缀含义：{mapped}。")
 
-    if meta.get("experiment_text"):
+    if meta.experiment_text:
         summary_lines.append("实验采用超声波辅助碱浸出处理，变量包括时间、液固比、NaOH 浓度与温度。")
 
     if "ftir_samples" in st.session_state and st.session_state["ftir_samples"]:
@@ -886,35 +1275,65 @@ if ftir:
 
     if "ftir_peak_sample" in st.session_state:
         peak_sample = st.session_state["ftir_peak_sample"]
-        y_vals = df_ftir[df_ftir[ftir["sample_col"]] == peak_sample][ftir["w_cols"]].iloc[0].to_numpy()
-        peaks_df = detect_peaks(np.array(ftir["w_vals"]), y_vals, 5, 0.001, 10)
+        summary_index = peak_index_for(
+            sm,
+            spectra_key,
+            5,
+            0.001,
+            store_dir=os.path.join(CACHE_DIR, "peaks"),
+        )
+        peaks_df = summary_index.for_row(int(sm.positions([peak_sample])[0]), 10)
         if not peaks_df.empty:
             top_peaks = ", ".join([f"{row['峰值']:.1f}" for _, row in peaks_df.head(5).iterrows()])
             summary_lines.append(f"样本 {peak_sample} 的主要峰位（前 5）：{top_peaks}。")
 
     # Variability across all samples
-    matrix = df_ftir[ftir["w_cols"]].to_numpy(dtype=float)
-    variance = np.nanvar(matrix, axis=0)
+    variance = run["variance"]
     top_var_idx = np.argsort(variance)[-8:][::-1]
-    var_points = ", ".join([f"{ftir['w_vals'][i]:.1f}" for i in top_var_idx])
+    var_points = ", ".join([f"{sm.wavenumbers[i]:.1f}" for i in top_var_idx])
     summary_lines.append(f"全样本变化较大的波数点（前 8）：{var_points}。")
 
-    # Group differences by prefix
-    grouped = compute_group_mean(df_ftir, ftir["sample_col"], ftir["w_cols"], ["_prefix"])
-    if len(grouped) >= 2:
-        group_names = grouped["_prefix"].astype(str).tolist()
-        distances = []
-        for i in range(len(group_names)):
-            for j in range(i + 1, len(group_names)):
-                a = grouped.iloc[i][ftir["w_cols"]].to_numpy(dtype=float)
-                b = grouped.iloc[j][ftir["w_cols"]].to_numpy(dtype=float)
-                dist = float(np.nanmean(np.abs(a - b)))
-                distances.append((group_names[i], group_names[j], dist))
-        distances.sort(key=lambda t: t[2], reverse=True)
-        g1, g2, dist = distances[0]
-        summary_lines.append(f"组间平均谱差异最大：{g1} vs {g2}（平均绝对差 {dist:.4g}）。")
+    # Group differences
+    c1, c2 = st.columns(2)
+    group_options = {"样本前缀": "_prefix", "系列编号": "_series", "单个样本": "_sample"}
+    summary_group = c1.selectbox("组间距离分组方式", list(group_options), index=0, key="summary_group")
+    metric_label = c2.selectbox("距离度量", list(DISTANCE_METRICS), index=0, key="summary_metric")
+    run.bind(summary_group_key=group_options[summary_group], distance_metric=DISTANCE_METRICS[metric_label])
+    group_names, group_dist = run["group_distances"]
+    farthest = pair_table(group_names, group_dist, k=10, largest=True)
+    if not farthest.empty:
+        g1, g2, dist = farthest.iloc[0]
+        summary_lines.append(f"组间平均谱差异最大：{g1} vs {g2}（{metric_label} {dist:.4g}）。")
         summary_lines.append("推测：这些组别在化学组成或杂质去除程度上可能存在差异，需结合工艺参数验证。")
 
     st.write("\n".join([f"• {line}" for line in summary_lines]) if summary_lines else "暂无可总结的结果。")
+
+    if len(group_names) >= 2:
+        with st.expander(f"组间距离矩阵（{summary_group}，{metric_label}）", expanded=False):
+            if len(group_names) <= MAX_HEATMAP_GROUPS:
+                fig = px.imshow(
+                    group_dist,
+                    x=group_names,
+                    y=group_names,
+                    text_auto=".3g" if len(group_names) <= 12 else False,
+                    color_continuous_scale="Viridis",
+                    title="组间距离热图",
+                )
+                st.plotly_chart(fig, use_container_width=True)
+            else:
+                st.info(f"共 {len(group_names)} 组，超过 {MAX_HEATMAP_GROUPS} 组时不绘制热图，仅列出表格。")
+            c1, c2 = st.columns(2)
+            c1.markdown("**差异最大的组对**")
+            c1.dataframe(farthest, use_container_width=True)
+            c2.markdown("**差异最小的组对**")
+            c2.dataframe(pair_table(group_names, group_dist, k=10, largest=False), use_container_width=True)
+            st.markdown("**各组最近 / 最远的组**")
+            st.dataframe(neighbor_table(group_names, group_dist), use_container_width=True)
 else:
     st.info("当前数据不满足 FTIR 结构，无法自动总结。")
+
+finish_profile()
+
+with st.sidebar.expander("计算节点耗时", expanded=False):
+    st.caption("仅重算输入发生变化的节点，其余直接复用上次结果。")
+    st.dataframe(run.timings(), use_container_width=True)
@@ -0,0 +1,308 @@
+"""
+Benchmarks for the vectorized engines
+向量化引擎的性能基准
+
+Times each engine against the loop or pandas code it replaced. Correctness
+is covered by tests/; this script only prints timings.
+
+    python bench/benchmarks.py                  every benchmark
+    python bench/benchmarks.py peaks colstats   selected ones
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "tests"))
+
+import numpy as np
+import pandas as pd
+
+from reference import (
+    detect_peaks_reference,
+    echoes_reference,
+    groupby_reference,
+    pairwise_reference,
+    regression_data,
+    regression_reference,
+    signal_frame,
+    spectral_reference,
+    synthetic_spectra,
+    synthetic_spectrum,
+    trace_stats_reference,
+)
+
+
+def _ms(start: float) -> float:
+    return (time.perf_counter() - start) * 1e3
+
+
+def bench_peaks(rng: np.random.Generator) -> None:
+    from peaks import compile_bands, detect_peaks, detect_peaks_batch
+
+    print(f"{'points':>8} {'loop (ms)':>12} {'vectorized (ms)':>16} {'speedup':>9}")
+    for n in (1_000, 5_000, 20_000, 100_000):
+        x, y = synthetic_spectrum(n, rng)
+        t0 = time.perf_counter()
+        detect_peaks_reference(x, y, 5, 0.001, 15)
+        loop_ms = _ms(t0)
+        t0 = time.perf_counter()
+        for _ in range(10):
+            detect_peaks(x, y, 5, 0.001, 15)
+        vec_ms = _ms(t0) / 10
+        print(f"{n:>8} {loop_ms:>12.2f} {vec_ms:>16.3f} {loop_ms / vec_ms:>8.1f}x")
+
+    matrix = np.stack([synthetic_spectrum(5_000, rng)[1] for _ in range(1_000)])
+    x = np.linspace(4000.0, 400.0, 5_000)
+    t0 = time.perf_counter()
+    batch = detect_peaks_batch(x, matrix, 5, 0.001, 15)
+    print(f"batch: 1000 x 5000 spectra in {_ms(t0):.1f} ms, {len(batch)} peaks")
+
+    low = rng.uniform(400, 4000, 500)
+    bands = pd.DataFrame({"波段下限": low + rng.uniform(5, 80, 500), "波段上限": low, "对应基团": "-", "对应成分": "-"})
+    peak_wn = rng.uniform(400, 4000, 300_000)
+    t0 = time.perf_counter()
+    band_index = compile_bands(bands)
+    band_index.first_match(peak_wn)
+    pairs = band_index.all_matches(peak_wn)[0]
+    print(f"bands: 500 overlapping bands x 300000 peaks in {_ms(t0):.1f} ms ({len(pairs)} matches)")
+
+
+def bench_distances(rng: np.random.Generator) -> None:
+    from distances import pairwise_distances
+
+    print(f"{'groups':>7} {'points':>7} {'metric':>10} {'loop (ms)':>11} {'blocked (ms)':>13}")
+    for m, n in ((8, 5_000), (68, 5_000), (400, 5_000), (1_000, 5_000)):
+        spectra = rng.normal(size=(m, n)).cumsum(axis=1)
+        for metric in ("mean_abs", "cosine"):
+            loop_ms = f"{'-':>11}"
+            if m <= 68:
+                t0 = time.perf_counter()
+                pairwise_reference(spectra, metric)
+                loop_ms = f"{_ms(t0):11.1f}"
+            t0 = time.perf_counter()
+            pairwise_distances(spectra, metric)
+            print(f"{m:>7} {n:>7} {metric:>10} {loop_ms} {_ms(t0):13.1f}")
+
+
+def bench_correlation(rng: np.random.Generator) -> None:
+    from correlation import correlate
+
+    print(f"{'table':>12} {'pandas (ms)':>12} {'blocked (ms)':>13} {'float32 (ms)':>13}")
+    for n, p in ((68, 1_800), (68, 5_000), (5_000, 400)):
+        data = rng.normal(size=(n, p)).cumsum(axis=1)
+        df = pd.DataFrame(data)
+        pandas_ms = f"{'-':>12}"
+        if p <= 2_000:
+            t0 = time.perf_counter()
+            df.corr()
+            pandas_ms = f"{_ms(t0):12.1f}"
+        t0 = time.perf_counter()
+        correlate(data, df.columns)
+        blocked_ms = _ms(t0)
+        t0 = time.perf_counter()
+        correlate(data, df.columns, dtype=np.float32)
+        print(f"{f'{n} x {p}':>12} {pandas_ms} {blocked_ms:13.1f} {_ms(t0):13.1f}")
+
+
+def bench_cube(rng: np.random.Generator) -> None:
+    from cube import build_cube
+
+    rows = 2_000_000
+    df = pd.DataFrame(
+        {
+            "前缀": rng.choice(["LB", "LD", "SS", "SR", "CK"], rows),
+            "系列": rng.integers(0, 20, rows),
+            "重复": rng.integers(0, 5, rows),
+            **{f"m{i}": rng.normal(size=rows) for i in range(6)},
+        }
+    )
+    t0 = time.perf_counter()
+    cube = build_cube(df, ["前缀", "系列", "重复"], [f"m{i}" for i in range(6)])
+    build_ms = _ms(t0)
+    t0 = time.perf_counter()
+    cube.sketch("m0")
+    print(f"{rows} rows, {cube.cells} cells, cube build {build_ms:.0f} ms, median sketch {_ms(t0):.0f} ms")
+    print(f"{'group by':>14} {'func':>7} {'pandas (ms)':>12} {'cube (ms)':>10}")
+    for group_cols in (["前缀"], ["前缀", "系列"], ["系列", "重复"]):
+        for func in ("mean", "std", "median"):
+            t0 = time.perf_counter()
+            groupby_reference(df, group_cols, "m0", func)
+            pandas_ms = _ms(t0)
+            t0 = time.perf_counter()
+            cube.query(group_cols, "m0", func)
+            print(f"{'+'.join(group_cols):>14} {func:>7} {pandas_ms:>12.1f} {_ms(t0):>10.1f}")
+
+
+def bench_colstats(rng: np.random.Generator) -> None:
+    from colstats import frame_stats
+
+    wide = pd.DataFrame(rng.normal(size=(68, 5_000)))
+    wide.insert(0, "Sample", [f"S{i}" for i in range(68)])
+    tall = pd.DataFrame(rng.normal(size=(500_000, 16)))
+    for i, card in enumerate((4, 50, 5_000, 500_000)):
+        tall[f"text{i}"] = pd.Series([f"v{j}" for j in range(card)]).sample(500_000, replace=True, random_state=i).to_numpy()
+    print(f"{'table':>14} {'pandas (ms)':>12} {'one pass (ms)':>14}")
+    for name, df in (("68 x 5001", wide), ("500000 x 20", tall)):
+        t0 = time.perf_counter()
+        numeric = df.select_dtypes(include="number").columns
+        df[numeric].describe().T
+        df.isna().sum()
+        [df[c].nunique() for c in df.columns]
+        pandas_ms = _ms(t0)
+        t0 = time.perf_counter()
+        stats = frame_stats(df)
+        stats.describe()
+        stats.missing()
+        stats.categorical_columns()
+        print(f"{name:>14} {pandas_ms:>12.1f} {_ms(t0):>14.1f}")
+
+
+def bench_streaming(rng: np.random.Generator) -> None:
+    from streaming import stream_csv, stream_groupby
+
+    rows = 600_000
+    df = pd.DataFrame(
+        {
+            "样本": rng.choice(["LB0", "LB1-1", "LD2-3", "SS4-5", "SR3-2"], rows),
+            "批次": rng.integers(1, 5, rows),
+            "强度": rng.normal(50, 12, rows).round(3),
+            "读数": rng.lognormal(0, 1, rows),
+        }
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "big.csv")
+        df.to_csv(path, index=False)
+        t0 = time.perf_counter()
+        summary = stream_csv(path, reservoir_rows=5_000, chunksize=50_000)
+        stream_s = _ms(t0) / 1e3
+        t0 = time.perf_counter()
+        stream_groupby(path, summary.plan, ["样本", "批次"], "强度", chunksize=50_000)
+        group_s = _ms(t0) / 1e3
+    print(f"stream {rows} rows: {stream_s:.2f} s, streamed group-by: {group_s:.2f} s, "
+          f"sample memory {summary.sample.memory_usage(deep=True).sum() / 1e6:.1f} MB "
+          f"vs full {df.memory_usage(deep=True).sum() / 1e6:.1f} MB")
+
+
+def bench_process_model(rng: np.random.Generator) -> None:
+    from process_model import regression_arrays
+
+    print(f"{'grid':>26} {'loop (ms)':>10} {'batched (ms)':>13}")
+    for n, p, r, g in ((84, 4, 11, 4), (2_000, 4, 200, 8), (20_000, 8, 500, 20)):
+        x, y, groups = regression_data(n, p, r, g, rng)
+        t0 = time.perf_counter()
+        regression_arrays(x, y, groups, g)
+        batched_ms = _ms(t0)
+        loop_ms = f"{'-':>10}"
+        if g * p * r <= 10_000:
+            t0 = time.perf_counter()
+            regression_reference(x, y, groups, g)
+            loop_ms = f"{_ms(t0):10.1f}"
+        print(f"{f'{n} rows, {p}x{r} pairs, {g} groups':>26} {loop_ms} {batched_ms:13.1f}")
+
+
+def bench_preprocess(rng: np.random.Generator) -> None:
+    from preprocess import Preprocessing, als_baseline, preprocess_values, rubberband_baseline, savgol_rows
+
+    steps = (
+        ("ALS (lam=1e5)", lambda x, y: als_baseline(y, 1e5, 0.01, 10)),
+        ("rubber band", rubberband_baseline),
+        ("SG d1 (w=15)", lambda x, y: savgol_rows(x, y, 15, 3, 1)),
+        ("full pipeline", lambda x, y: preprocess_values(x, y, Preprocessing("als", normalize="area", sg_window=15, sg_order=3))),
+    )
+    print(f"{'spectra x points':>18} {'step':>16} {'one by one (ms)':>16} {'matrix (ms)':>12}")
+    for m, n in ((68, 5033), (1000, 5033)):
+        x, y = synthetic_spectra(m, n, rng)
+        for name, fn in steps:
+            # Row-at-a-time timing on a few spectra, scaled to all of them.
+            t0 = time.perf_counter()
+            for row in y[:4]:
+                fn(x, row[None, :])
+            one_ms = _ms(t0) * m / 4
+            t0 = time.perf_counter()
+            fn(x, y)
+            print(f"{f'{m} x {n}':>18} {name:>16} {one_ms:16.1f} {_ms(t0):12.1f}")
+
+
+def bench_ultrasonic(rng: np.random.Generator) -> None:
+    from ultrasonic import ENVELOPES, SignalMatrix, default_bands, detect_echoes, echo_features, pooled_stats
+    from ultrasonic import spectral_features, trace_stats
+
+    print(f"{'traces x points':>18} {'loop (ms)':>10} {'matrix (ms)':>12}")
+    for n_samples, n_time in ((130, 1200), (1000, 1200), (1000, 5000)):
+        df = signal_frame(n_samples, n_time, 1, rng)
+        t0 = time.perf_counter()
+        trace_stats_reference(df)
+        loop_ms = _ms(t0)
+        t0 = time.perf_counter()
+        sm = SignalMatrix.from_frame(df)
+        trace_stats(sm)
+        pooled_stats(sm)
+        print(f"{f'{n_samples} x {n_time}':>18} {loop_ms:10.1f} {_ms(t0):12.1f}")
+
+    print(f"\n{'traces x points':>18} {'loop FFT (ms)':>14} {'batched FFT (ms)':>17}")
+    for n_traces, n_time in ((400, 1200), (5000, 1200), (20000, 1024)):
+        values = rng.normal(size=(n_traces, n_time))
+        sm = SignalMatrix(values, np.ones_like(values, dtype=bool), np.array(["x"] * n_traces, dtype=object),
+                          np.zeros(n_traces, dtype=np.intp), np.arange(n_traces).astype(object))
+        loop_ms = f"{'-':>14}"
+        if n_traces <= 5000:
+            t0 = time.perf_counter()
+            spectral_reference(sm, default_bands())
+            loop_ms = f"{_ms(t0):14.1f}"
+        t0 = time.perf_counter()
+        spectral_features(sm)
+        print(f"{f'{n_traces} x {n_time}':>18} {loop_ms} {_ms(t0):17.1f}")
+
+    print(f"\n{'echo detection':>18} {'traces':>7} {'seconds':>8} {'traces/s':>9}")
+    sm = SignalMatrix.from_frame(signal_frame(200, 1200, 1, rng))
+    t0 = time.perf_counter()
+    echoes_reference(sm)
+    seconds = _ms(t0) / 1e3
+    print(f"{'loop (rms)':>18} {sm.n_traces:7d} {seconds:8.2f} {sm.n_traces / seconds:9.0f}")
+    gappy = SignalMatrix.from_frame(signal_frame(20_000, 1200, 1, rng))
+    dense = SignalMatrix(np.nan_to_num(gappy.values, nan=-1.0), np.ones_like(gappy.valid), gappy.samples,
+                         gappy.trace, gappy.columns)
+    for label, sm in (("", dense), (", 1% gaps", gappy)):
+        for method in ENVELOPES:
+            t0 = time.perf_counter()
+            echo_features(sm, detect_echoes(sm, method))
+            seconds = _ms(t0) / 1e3
+            print(f"{method + label:>18} {sm.n_traces:7d} {seconds:8.2f} {sm.n_traces / seconds:9.0f}")
+
+
+def bench_sample_metadata(rng: np.random.Generator) -> None:
+    from sample_metadata import load_sample_metadata
+
+    t0 = time.perf_counter()
+    meta = load_sample_metadata(REPO_DIR)
+    first_ms = _ms(t0)
+    t0 = time.perf_counter()
+    load_sample_metadata(REPO_DIR)
+    if meta:
+        print(f"{meta.path}: first load {first_ms:.1f} ms, cached {_ms(t0):.3f} ms")
+    else:
+        print("no sample metadata workbook under the repo")
+
+
+BENCHMARKS = {name[len("bench_"):]: fn for name, fn in globals().items() if name.startswith("bench_")}
+
+
+def main(argv=None) -> int:
+    names = (sys.argv[1:] if argv is None else argv) or list(BENCHMARKS)
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        print(f"unknown benchmark(s): {', '.join(unknown)}; choose from {', '.join(BENCHMARKS)}")
+        return 2
+    for name in names:
+        print(f"\n== {name}")
+        BENCHMARKS[name](np.random.default_rng(0))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,444 @@
+"""
+Single-pass column statistics
+单次扫描的列统计引擎
+
+FrameStats consumes a table chunk by chunk (an in-memory DataFrame sliced by
+rows, or a CSV read with chunksize) and keeps, for every column:
+
+    count / missing      exact
+    mean / std           exact (per-chunk moments merged with Chan/Welford)
+    min / max            exact
+    25% / 50% / 75%      exact until a column holds more values than the
+                         sketch buffer, then a mergeable centroid sketch
+    distinct values      exact up to DISTINCT_EXACT_LIMIT, then HyperLogLog
+
+Numeric columns are updated as one 2D block per chunk, so a wide FTIR table
+costs a handful of array operations instead of one pass per column.
+"""
+
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+DISTINCT_EXACT_LIMIT = 1024
+HLL_PRECISION = 10
+SKETCH_SIZE = 512
+SKETCH_CELL_BUDGET = 4_000_000
+CHUNK_CELLS = 8_000_000
+CSV_CHUNK_ROWS = 100_000
+QUANTILES = (0.25, 0.5, 0.75)
+
+
+def is_numeric_kind(dtype) -> bool:
+    return (
+        pd.api.types.is_numeric_dtype(dtype)
+        and not pd.api.types.is_bool_dtype(dtype)
+        and not pd.api.types.is_timedelta64_dtype(dtype)
+    )
+
+
+class QuantileSketch:
+    """Mergeable weighted-centroid quantile sketch for a block of columns.
+
+    Stored column-major (ncols x entries) so every sort runs along contiguous
+    memory. Raw values carry weight 1; once a column holds more than
+    exact_rows entries they are merged into k equal-weight centroids.
+    """
+
+    def __init__(self, ncols: int, k: int = SKETCH_SIZE, exact_rows: Optional[int] = None):
+        self.ncols = ncols
+        self.k = k
+        self.exact_rows = exact_rows or max(k, min(4096, SKETCH_CELL_BUDGET // max(ncols, 1)))
+        self.values = np.empty((ncols, 0))
+        self.weights = np.empty((ncols, 0))
+        self.compressed = False
+        self._pending: List[Tuple[np.ndarray, np.ndarray]] = []
+        self._pending_size = 0
+
+    def update(self, block: np.ndarray) -> None:
+        raw = np.ascontiguousarray(np.asarray(block, dtype=np.float64).reshape(-1, self.ncols).T)
+        if raw.shape[1] > self.exact_rows:
+            # Big chunk: a plain sort is enough to cut it down to k centroids first.
+            raw = np.sort(raw, axis=1)
+            self.compressed = True
+            self._add(*self._bucket_raw(raw))
+        else:
+            self._add(raw, (~np.isnan(raw)).astype(np.float64))
+
+    def merge(self, other: "QuantileSketch") -> None:
+        other._consolidate(compress=False)
+        self.compressed |= other.compressed
+        self._add(other.values, other.weights)
+
+    def _add(self, values: np.ndarray, weights: np.ndarray) -> None:
+        if values.shape[1] == 0:
+            return
+        self._pending.append((values, weights))
+        self._pending_size += values.shape[1]
+        if self.values.shape[1] + self._pending_size > self.exact_rows:
+            self._consolidate(compress=True)
+
+    def _consolidate(self, compress: bool) -> None:
+        if not self._pending and not compress:
+            return
+        values = np.hstack([self.values] + [v for v, _ in self._pending])
+        weights = np.hstack([self.weights] + [w for _, w in self._pending])
+        self._pending, self._pending_size = [], 0
+        values, weights = _sort_rows(values, weights)
+        if compress and values.shape[1] > self.k:
+            values, weights = self._bucket(values, weights)
+            self.compressed = True
+        self.values, self.weights = values, weights
+
+    def _bucket(self, values: np.ndarray, weights: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Merge sorted entries into k equal-weight centroids per column."""
+        cols = values.shape[0]
+        cum = np.cumsum(weights, axis=1)
+        total = cum[:, -1:]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            bucket = np.floor((cum - weights) / total * self.k)
+        bucket = np.clip(np.nan_to_num(bucket), 0, self.k - 1).astype(np.intp)
+        flat = (bucket + (np.arange(cols) * self.k)[:, None]).ravel()
+        sum_w = np.bincount(flat, weights=weights.ravel(), minlength=cols * self.k)
+        sum_v = np.bincount(flat, weights=(np.where(weights > 0, values, 0.0) * weights).ravel(), minlength=cols * self.k)
+        weights = sum_w.reshape(cols, self.k)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            values = np.where(weights > 0, sum_v.reshape(cols, self.k) / weights, np.nan)
+        return _sort_rows(values, weights)
+
+    def _bucket_raw(self, raw: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """_bucket() for sorted unit-weight rows (NaN last), from prefix sums.
+
+        Entry i of a column with n values lands in bucket floor(i * k / n), so
+        bucket j spans [ceil(j * n / k), ceil((j + 1) * n / k)).
+        """
+        cols, rows = raw.shape
+        n = rows - np.isnan(raw).sum(axis=1)
+        bounds = -(-(np.arange(self.k + 1) * n[:, None]) // self.k)
+        cum = np.zeros((cols, rows + 1))
+        # NaN only poisons prefix sums past n, which no bound reaches.
+        np.cumsum(raw, axis=1, out=cum[:, 1:])
+        sums = np.diff(np.take_along_axis(cum, bounds, axis=1), axis=1)
+        weights = np.diff(bounds, axis=1).astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            values = np.where(weights > 0, sums / weights, np.nan)
+        return _sort_rows(values, weights)
+
+    def quantiles(self, qs: Sequence[float]) -> np.ndarray:
+        """(len(qs) x ncols); matches numpy's linear interpolation while uncompressed."""
+        self._consolidate(compress=False)
+        values, weights = self.values, self.weights
+        out = np.full((len(qs), self.ncols), np.nan)
+        if values.shape[1] == 0:
+            return out
+        cum = np.cumsum(weights, axis=1)
+        total = cum[:, -1]
+        # Rank of each entry's centre; raw values sit at 0, 1, 2, ...
+        pos = np.where(weights > 0, cum - weights + (weights - 1) / 2, np.inf)
+        last = np.maximum((weights > 0).sum(axis=1) - 1, 0)
+        cols = np.arange(self.ncols)
+        for i, q in enumerate(qs):
+            target = q * (total - 1)
+            j = (pos <= target[:, None]).sum(axis=1)
+            lo, hi = np.minimum(np.maximum(j - 1, 0), last), np.minimum(j, last)
+            p_lo, p_hi = pos[cols, lo], pos[cols, hi]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                frac = np.where(p_hi > p_lo, (target - p_lo) / (p_hi - p_lo), 0.0)
+            frac = np.clip(frac, 0.0, 1.0)
+            v_lo, v_hi = values[cols, lo], values[cols, hi]
+            out[i] = np.where(frac >= 0.5, v_hi - (v_hi - v_lo) * (1 - frac), v_lo + (v_hi - v_lo) * frac)
+        out[:, total == 0] = np.nan
+        return out
+
+
+def _sort_rows(values: np.ndarray, weights: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    order = np.argsort(np.where(weights > 0, values, np.inf), axis=1, kind="stable")
+    values = np.take_along_axis(values, order, axis=1)
+    weights = np.take_along_axis(weights, order, axis=1)
+    keep = int((weights > 0).sum(axis=1).max()) if weights.size else 0
+    return values[:, :keep], weights[:, :keep]
+
+
+def _bit_length(w: np.ndarray) -> np.ndarray:
+    # w >> 11 fits the float64 mantissa, so frexp's exponent is its exact bit length.
+    top = w >> np.uint64(11)
+    bits = np.frexp(top.astype(np.float64))[1].astype(np.int64)
+    low = top == 0
+    if low.any():
+        bits[low] = np.frexp(w[low].astype(np.float64))[1]
+        return np.where(low, bits, bits + 11)
+    return bits + 11
+
+
+class HyperLogLog:
+    """One HyperLogLog register row per column."""
+
+    def __init__(self, ncols: int, p: int = HLL_PRECISION):
+        self.p = p
+        self.m = 1 << p
+        self.registers = np.zeros((ncols, self.m), dtype=np.uint8)
+
+    def update(self, hashes: np.ndarray, cols: np.ndarray) -> None:
+        if len(hashes) == 0:
+            return
+        idx = (hashes >> np.uint64(64 - self.p)).astype(np.intp)
+        rest = hashes & np.uint64((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - _bit_length(rest) + 1
+        np.maximum.at(self.registers.reshape(-1), cols * self.m + idx, rank.astype(np.uint8))
+
+    def merge(self, other: "HyperLogLog") -> None:
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self) -> np.ndarray:
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        est = alpha * m * m / np.ldexp(1.0, -self.registers.astype(np.int64)).sum(axis=1)
+        zeros = (self.registers == 0).sum(axis=1)
+        small = (est <= 2.5 * m) & (zeros > 0)
+        est[small] = m * np.log(m / zeros[small])
+        return est
+
+
+class FrameStats:
+    def __init__(self, sketch_size: int = SKETCH_SIZE, hll_precision: int = HLL_PRECISION):
+        self.sketch_size = sketch_size
+        self.hll_precision = hll_precision
+        self.columns: List[object] = []
+        self.dtypes: List[str] = []
+        self.rows = 0
+        self.chunks = 0
+
+    def _init(self, chunk: pd.DataFrame) -> None:
+        self.columns = list(chunk.columns)
+        self.dtypes = [str(t) for t in chunk.dtypes]
+        ncols = len(self.columns)
+        self.numeric = np.array([is_numeric_kind(t) for t in chunk.dtypes], dtype=bool)
+        self.num_pos = np.flatnonzero(self.numeric)
+        k = len(self.num_pos)
+        self.missing_counts = np.zeros(ncols, dtype=np.int64)
+        self.n = np.zeros(k)
+        self.mean = np.zeros(k)
+        self.m2 = np.zeros(k)
+        self.min = np.full(k, np.inf)
+        self.max = np.full(k, -np.inf)
+        self.sketch = QuantileSketch(k, self.sketch_size)
+        self.hll = HyperLogLog(ncols, self.hll_precision)
+        self.sets: List[Optional[np.ndarray]] = [np.empty(0, dtype=np.uint64) for _ in range(ncols)]
+
+    # ---------------------------------------------------------------- updates
+
+    def update(self, chunk: pd.DataFrame) -> None:
+        if not self.columns:
+            self._init(chunk)
+        elif len(chunk.columns) != len(self.columns):
+            raise ValueError("chunk columns do not match the first chunk")
+        if len(chunk) == 0:
+            return
+        self.rows += len(chunk)
+        self.chunks += 1
+
+        kinds = chunk.dtypes.tolist()
+        for pos in self.num_pos:
+            if self.numeric[pos] and not is_numeric_kind(kinds[pos]):
+                # A later CSV chunk turned out not to be numeric after all.
+                self.numeric[pos] = False
+                self.dtypes[pos] = "object"
+        if len(self.num_pos):
+            live = self.numeric[self.num_pos]
+            if live.all():
+                block = chunk.iloc[:, self.num_pos].to_numpy(dtype=np.float64, na_value=np.nan)
+            else:
+                block = np.full((len(chunk), len(self.num_pos)), np.nan)
+                block[:, live] = chunk.iloc[:, self.num_pos[live]].to_numpy(dtype=np.float64, na_value=np.nan)
+            valid = ~np.isnan(block)
+            self.missing_counts[self.num_pos[live]] += len(block) - valid[:, live].sum(axis=0)
+            self._update_numeric(block, valid)
+            self._update_distinct(block, valid, self.num_pos[live], np.flatnonzero(live))
+
+        for pos in np.flatnonzero(~self.numeric):
+            # Missing values factorize to -1; both distinct counters only need the uniques.
+            codes, uniques = pd.factorize(chunk.iloc[:, pos].to_numpy())
+            self.missing_counts[pos] += int((codes < 0).sum())
+            self._add_exact(pos, pd.util.hash_array(np.asarray(uniques, dtype=object), categorize=False))
+
+    def _update_numeric(self, block: np.ndarray, valid: np.ndarray) -> None:
+        dense = bool(valid.all())
+        n_c = valid.sum(axis=0).astype(np.float64)
+        filled = block if dense else np.where(valid, block, 0.0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_c = np.where(n_c > 0, filled.sum(axis=0) / n_c, 0.0)
+        centred = block - mean_c
+        m2_c = ((centred if dense else np.where(valid, centred, 0.0)) ** 2).sum(axis=0)
+        n = self.n + n_c
+        delta = mean_c - self.mean
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.mean = np.where(n > 0, self.mean + delta * n_c / n, 0.0)
+            self.m2 = np.where(n > 0, self.m2 + m2_c + delta**2 * self.n * n_c / n, 0.0)
+        self.n = n
+        self.min = np.minimum(self.min, (block if dense else np.where(valid, block, np.inf)).min(axis=0))
+        self.max = np.maximum(self.max, (block if dense else np.where(valid, block, -np.inf)).max(axis=0))
+        self.sketch.update(block)
+
+    def _update_distinct(self, block: np.ndarray, valid: np.ndarray, positions: np.ndarray, slots: np.ndarray) -> None:
+        sub = block[:, slots]
+        valid = valid[:, slots]
+        dense = bool(valid.all())
+        hashes = pd.util.hash_array((sub if dense else np.where(valid, sub, 0.0)).ravel()).reshape(sub.shape)
+        spilled = np.array([self.sets[pos] is None for pos in positions], dtype=bool)
+        if spilled.any():
+            # Columns past the exact limit go to HyperLogLog in one batch.
+            if dense and spilled.all():
+                self.hll.update(hashes.ravel(), np.tile(positions, len(sub)))
+            else:
+                rows, cols = np.nonzero(valid & spilled)
+                self.hll.update(hashes[rows, cols], positions[cols])
+        for i in np.flatnonzero(~spilled):
+            self._add_exact(positions[i], hashes[:, i] if dense else hashes[valid[:, i], i])
+
+    def _add_exact(self, pos: int, hashes: np.ndarray) -> None:
+        current = self.sets[pos]
+        if current is None:
+            self.hll.update(hashes, np.full(len(hashes), pos, dtype=np.intp))
+            return
+        probe = 4 * DISTINCT_EXACT_LIMIT
+        if len(hashes) > probe and len(np.unique(hashes[:probe])) > DISTINCT_EXACT_LIMIT:
+            self._spill(pos, hashes)
+            return
+        merged = np.union1d(current, hashes)
+        if len(merged) <= DISTINCT_EXACT_LIMIT:
+            self.sets[pos] = merged
+        else:
+            self._spill(pos, merged)
+
+    def _spill(self, pos: int, hashes: np.ndarray) -> None:
+        """Move a column from its exact set to HyperLogLog (which skips exact columns)."""
+        hashes = np.concatenate([self.sets[pos], hashes])
+        self.sets[pos] = None
+        self.hll.update(hashes, np.full(len(hashes), pos, dtype=np.intp))
+
+    def merge(self, other: "FrameStats") -> None:
+        """Fold in stats built on another slice of the same table."""
+        if not other.columns:
+            return
+        if not self.columns:
+            self.__dict__.update({k: v for k, v in other.__dict__.items()})
+            return
+        self.rows += other.rows
+        self.chunks += other.chunks
+        self.missing_counts += other.missing_counts
+        self.numeric &= other.numeric
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.mean = np.where(n > 0, self.mean + delta * other.n / n, 0.0)
+            self.m2 = np.where(n > 0, self.m2 + other.m2 + delta**2 * self.n * other.n / n, 0.0)
+        self.n = n
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        self.sketch.merge(other.sketch)
+        self.hll.merge(other.hll)
+        for pos, extra in enumerate(other.sets):
+            if extra is None:
+                if self.sets[pos] is not None:
+                    self._spill(pos, np.empty(0, dtype=np.uint64))
+            else:
+                self._add_exact(pos, extra)
+
+    # ---------------------------------------------------------------- results
+
+    @property
+    def quantiles_exact(self) -> bool:
+        return not self.sketch.compressed if self.columns else True
+
+    def numeric_columns(self) -> List[object]:
+        return [self.columns[p] for p in self.num_pos if self.numeric[p]]
+
+    def missing(self) -> pd.Series:
+        return pd.Series(self.missing_counts, index=pd.Index(self.columns, dtype=object))
+
+    def nunique(self) -> pd.Series:
+        estimate = np.round(self.hll.estimate()).astype(np.int64)
+        exact = np.array([len(s) if s is not None else -1 for s in self.sets], dtype=np.int64)
+        return pd.Series(np.where(exact >= 0, exact, estimate), index=pd.Index(self.columns, dtype=object))
+
+    def distinct_exact(self) -> np.ndarray:
+        return np.array([s is not None for s in self.sets], dtype=bool)
+
+    def describe(self) -> pd.DataFrame:
+        """Same layout as df[numeric_cols].describe().T."""
+        live = self.numeric[self.num_pos]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            std = np.sqrt(self.m2 / (self.n - 1))
+        std[self.n < 2] = np.nan
+        has = self.n > 0
+        lo = np.where(has, self.min, np.nan)
+        hi = np.where(has, self.max, np.nan)
+        qs = np.clip(self.sketch.quantiles(QUANTILES), lo, hi)
+        out = pd.DataFrame(
+            {
+                "count": self.n,
+                "mean": np.where(has, self.mean, np.nan),
+                "std": std,
+                "min": lo,
+                "25%": qs[0],
+                "50%": qs[1],
+                "75%": qs[2],
+                "max": hi,
+            },
+            index=pd.Index([self.columns[p] for p in self.num_pos], dtype=object),
+        )
+        return out[live]
+
+    def categorical_columns(self) -> List[object]:
+        """Object/category columns plus low-cardinality ones (the rule summarize() used)."""
+        nunique = self.nunique().to_numpy()
+        limit = min(50, max(2, self.rows // 20))
+        out = []
+        for pos, col in enumerate(self.columns):
+            if str(col).lower().startswith("unnamed"):
+                continue
+            dtype = self.dtypes[pos]
+            if dtype == "object" or dtype.startswith("category") or nunique[pos] <= limit:
+                out.append(col)
+        first = self.columns[0] if self.columns else None
+        if first is not None and not str(first).lower().startswith("unnamed") and first not in out:
+            out.insert(0, first)
+        return out
+
+    def overview(self) -> pd.DataFrame:
+        exact = self.distinct_exact()
+        return pd.DataFrame(
+            {
+                "列": [str(c) for c in self.columns],
+                "类型": self.dtypes,
+                "非空": self.rows - self.missing_counts,
+                "缺失": self.missing_counts,
+                "缺失率": self.missing_counts / max(self.rows, 1),
+                "唯一值": self.nunique().to_numpy(),
+                "唯一值精确": np.where(exact, "是", "否（HLL 估计）"),
+            }
+        )
+
+
+def frame_stats(df: pd.DataFrame, chunk_rows: Optional[int] = None) -> FrameStats:
+    stats = FrameStats()
+    chunk_rows = chunk_rows or max(1024, CHUNK_CELLS // max(1, df.shape[1]))
+    if len(df) == 0:
+        stats.update(df)
+    for start in range(0, len(df), chunk_rows):
+        stats.update(df.iloc[start : start + chunk_rows])
+    return stats
+
+
+def chunks_stats(chunks: Iterable[pd.DataFrame]) -> FrameStats:
+    stats = FrameStats()
+    for chunk in chunks:
+        stats.update(chunk)
+    return stats
+
+
+def csv_stats(source, chunksize: int = CSV_CHUNK_ROWS, **read_csv_kwargs) -> FrameStats:
+    """Stats for a CSV path or buffer, read chunk by chunk."""
+    with pd.read_csv(source, chunksize=chunksize, **read_csv_kwargs) as reader:
+        return chunks_stats(reader)
@@ -0,0 +1,226 @@
+"""
+Pre-aggregated group-by cube
+预聚合分组立方体
+
+GroupCube scans a frame once and keeps, for every observed combination
+("cell") of a few low-cardinality dimension columns and every numeric
+measure column:
+
+    count   non-null values
+    sum / min / max
+    mean / m2   (sum of squared deviations, merged with Chan's formula)
+
+A group-by on any subset of the dimensions is then a roll-up of the cells
+(at most a few thousand rows) instead of a rescan of the data:
+
+    cube = build_cube(df, ["样本", "批次"], ["强度"])
+    cube.query(["批次"], "强度", "std")
+    # == df.groupby(["批次"], observed=True)["强度"].agg("std").reset_index()
+
+Medians come from a per-cell centroid sketch built on first use of a
+measure. Cells with up to SKETCH_SIZE values keep them raw, so medians are
+exact unless a group touches a larger cell.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from colstats import SKETCH_SIZE
+
+CUBE_FUNCS = ["sum", "mean", "median", "count", "min", "max", "std"]
+MAX_CELLS = 50_000
+MAX_DIM_CARDINALITY = 1_000
+
+
+@dataclass
+class CellSketch:
+    """Sorted (cell, value) centroids of one measure; weight 1 means a raw value."""
+
+    cell: np.ndarray
+    value: np.ndarray
+    weight: np.ndarray
+    compressed: np.ndarray  # per cell
+
+
+def _combine_codes(codes: List[np.ndarray], rows: int) -> np.ndarray:
+    if not codes:
+        return np.zeros(rows, dtype=np.int64)
+    cell = codes[0].astype(np.int64)
+    for c in codes[1:]:
+        cell, _ = pd.factorize(cell * (int(c.max()) + 1) + c)
+    cell, _ = pd.factorize(cell, sort=True)
+    return cell.astype(np.int64)
+
+
+def _grouped_quantile(gid: np.ndarray, value: np.ndarray, weight: np.ndarray, ngroups: int, q: float) -> np.ndarray:
+    """Weighted quantile per group; entries must be sorted by (gid, value).
+
+    Same interpolation as colstats.QuantileSketch, i.e. numpy's linear method
+    when every weight is 1.
+    """
+    out = np.full(ngroups, np.nan)
+    if len(gid) == 0:
+        return out
+    start = np.searchsorted(gid, np.arange(ngroups), side="left")
+    end = np.searchsorted(gid, np.arange(ngroups), side="right")
+    total = np.bincount(gid, weights=weight, minlength=ngroups)
+    cum = np.cumsum(weight)
+    before = np.concatenate([[0.0], cum])[start]
+    pos = cum - before[gid] - weight + (weight - 1) / 2
+    target = q * (total - 1)
+    # Rank positions rise within a group, so one search over (gid, pos) finds them all.
+    span = float(total.max()) + 2.0
+    key = gid * span + pos
+    j = np.searchsorted(key, np.arange(ngroups) * span + target, side="right")
+    has = end > start
+    lo = np.clip(j - 1, start, np.maximum(end - 1, start))
+    hi = np.clip(j, start, np.maximum(end - 1, start))
+    lo, hi = np.where(has, lo, 0), np.where(has, hi, 0)
+    p_lo, p_hi = pos[lo], pos[hi]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        frac = np.clip(np.where(p_hi > p_lo, (target - p_lo) / (p_hi - p_lo), 0.0), 0.0, 1.0)
+    v_lo, v_hi = value[lo], value[hi]
+    vals = np.where(frac >= 0.5, v_hi - (v_hi - v_lo) * (1 - frac), v_lo + (v_hi - v_lo) * frac)
+    out[has] = vals[has]
+    return out
+
+
+class GroupCube:
+    def __init__(self, df: pd.DataFrame, dims: Sequence[object], measures: Sequence[object], cell: np.ndarray):
+        self.dims = list(dims)
+        self.measures = list(measures)
+        self.rows = len(df)
+        self._source = df
+        # Cell ids are small, so a 16-bit stable sort (radix) is several times faster.
+        small = len(cell) and int(cell.max()) < 1 << 16
+        self._order = np.argsort(cell.astype(np.uint16) if small else cell, kind="stable")
+        self._cell_sorted = cell[self._order]
+        self.starts = np.flatnonzero(np.concatenate([[True], np.diff(self._cell_sorted) != 0])) if len(cell) else np.empty(0, dtype=np.intp)
+        self.cells = len(self.starts)
+        self.keys = df[self.dims].iloc[self._order[self.starts]].reset_index(drop=True)
+        self._sketches: Dict[object, CellSketch] = {}
+
+        block = df[self.measures].to_numpy(dtype=np.float64, na_value=np.nan)[self._order]
+        if self.cells == 0:
+            shape = (0, len(self.measures))
+            self.count, self.sum, self.mean, self.m2 = (np.zeros(shape) for _ in range(4))
+            self.min, self.max = np.full(shape, np.nan), np.full(shape, np.nan)
+            return
+        valid = ~np.isnan(block)
+        dense = bool(valid.all())
+        if dense:
+            sizes = np.diff(np.concatenate([self.starts, [len(block)]])).astype(np.float64)
+            self.count = np.repeat(sizes[:, None], block.shape[1], axis=1)
+        else:
+            self.count = np.add.reduceat(valid.astype(np.float64), self.starts, axis=0)
+        self.sum = np.add.reduceat(block if dense else np.where(valid, block, 0.0), self.starts, axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.mean = np.where(self.count > 0, self.sum / self.count, 0.0)
+        centred = block - self.mean[self._cell_sorted]
+        if not dense:
+            centred[~valid] = 0.0
+        np.multiply(centred, centred, out=centred)
+        self.m2 = np.add.reduceat(centred, self.starts, axis=0)
+        self.min = np.fmin.reduceat(block, self.starts, axis=0)
+        self.max = np.fmax.reduceat(block, self.starts, axis=0)
+
+    def covers(self, group_cols: Sequence[object]) -> bool:
+        return len(group_cols) > 0 and all(c in self.dims for c in group_cols)
+
+    def sketch(self, measure: object, k: int = SKETCH_SIZE) -> CellSketch:
+        """Per-cell sorted values of one measure, cells over k values cut to k centroids."""
+        if measure in self._sketches:
+            return self._sketches[measure]
+        values = self._source[measure].to_numpy(dtype=np.float64, na_value=np.nan)[self._order]
+        ok = ~np.isnan(values)
+        cell = np.searchsorted(self.starts, np.flatnonzero(ok), side="right") - 1
+        values = values[ok]
+        order = np.lexsort((values, cell))
+        values, cell = values[order], cell[order]
+        n = np.bincount(cell, minlength=self.cells)
+        rank = np.arange(len(values)) - (np.cumsum(n) - n)[cell]
+        big = n > k
+        bucket = np.where(big[cell], rank * k // np.maximum(n[cell], 1), rank)
+        brk = np.flatnonzero(np.concatenate([[True], (np.diff(cell) != 0) | (np.diff(bucket) != 0)])) if len(cell) else np.empty(0, dtype=np.intp)
+        weight = np.diff(np.concatenate([brk, [len(values)]])).astype(np.float64)
+        value = np.add.reduceat(values, brk) / weight if len(brk) else np.empty(0)
+        sk = CellSketch(cell[brk], value, weight, big)
+        self._sketches[measure] = sk
+        return sk
+
+    def query(self, group_cols: Sequence[object], measure: object, func: str) -> pd.DataFrame:
+        """df.groupby(group_cols, observed=True)[measure].agg(func).reset_index(), from the cells."""
+        group_cols = list(group_cols)
+        if not self.covers(group_cols):
+            raise KeyError(f"cube dimensions {self.dims} do not cover {group_cols}")
+        if func not in CUBE_FUNCS:
+            raise ValueError(f"unknown aggregation '{func}'")
+        j = self.measures.index(measure)
+        gid = self.keys.groupby(group_cols, sort=True, dropna=True, observed=True).ngroup()
+        gid = gid.fillna(-1).to_numpy(dtype=np.int64)  # NaN keys are dropped, as in pandas
+        live = np.flatnonzero(gid >= 0)
+        ngroups = int(gid.max()) + 1 if len(live) else 0
+        cells = live[np.argsort(gid[live], kind="stable")]
+        g = gid[cells]
+        starts = np.flatnonzero(np.concatenate([[True], np.diff(g) != 0])) if len(g) else np.empty(0, dtype=np.intp)
+        out = self.keys.loc[cells[starts], group_cols].reset_index(drop=True)
+        if ngroups == 0:
+            out[measure] = pd.Series(dtype=np.int64 if func == "count" else np.float64)
+            return out
+
+        n = np.add.reduceat(self.count[cells, j], starts)
+        s = np.add.reduceat(self.sum[cells, j], starts)
+        if func == "count":
+            vals = n.astype(np.int64)
+        elif func == "sum":
+            vals = s
+        elif func == "mean":
+            with np.errstate(invalid="ignore", divide="ignore"):
+                vals = np.where(n > 0, s / n, np.nan)
+        elif func in ("min", "max"):
+            reduce = np.fmin if func == "min" else np.fmax
+            vals = reduce.reduceat((self.min if func == "min" else self.max)[cells, j], starts)
+        elif func == "std":
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean = np.where(n > 0, s / n, 0.0)
+                dev = self.mean[cells, j] - mean[g]
+                m2 = np.add.reduceat(self.m2[cells, j] + self.count[cells, j] * dev * dev, starts)
+                vals = np.where(n > 1, np.sqrt(m2 / (n - 1)), np.nan)
+        else:
+            sk = self.sketch(measure)
+            entry_gid = gid[sk.cell]
+            keep = entry_gid >= 0
+            order = np.lexsort((sk.value[keep], entry_gid[keep]))
+            vals = _grouped_quantile(entry_gid[keep][order], sk.value[keep][order], sk.weight[keep][order], ngroups, 0.5)
+
+        dtype = self._source[measure].dtype
+        if func in ("sum", "min", "max") and pd.api.types.is_integer_dtype(dtype) and not np.isnan(vals).any():
+            vals = vals.astype(dtype)
+        out[measure] = vals
+        return out
+
+    def median_exact(self, measure: object) -> bool:
+        return not self.sketch(measure).compressed.any()
+
+
+def pick_dims(df: pd.DataFrame, candidates: Sequence[object], nunique: Optional[pd.Series] = None,
+              max_cardinality: int = MAX_DIM_CARDINALITY, max_cells: int = MAX_CELLS) -> Tuple[List[object], np.ndarray]:
+    """Low-cardinality candidates, dropping the widest until the cells fit in max_cells."""
+    if nunique is None:
+        nunique = df[list(candidates)].nunique(dropna=False)
+    dims = [c for c in candidates if c in df.columns and nunique.get(c, max_cardinality + 1) <= max_cardinality]
+    codes = {c: pd.factorize(df[c], use_na_sentinel=False)[0] for c in dims}
+    while True:
+        cell = _combine_codes([codes[c] for c in dims], len(df))
+        if not dims or (int(cell.max()) + 1 if len(cell) else 0) <= max_cells:
+            return dims, cell
+        dims.remove(max(dims, key=lambda c: int(codes[c].max())))
+
+
+def build_cube(df: pd.DataFrame, dims: Sequence[object], measures: Sequence[object],
+               nunique: Optional[pd.Series] = None, max_cells: int = MAX_CELLS) -> GroupCube:
+    dims, cell = pick_dims(df, dims, nunique, max_cells=max_cells)
+    return GroupCube(df, dims, measures, cell)
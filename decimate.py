@@ -0,0 +1,93 @@
+"""
+Peak-preserving decimation for line charts
+折线图降采样（保留峰值）
+
+All functions take a shared x axis and a (n_traces x n_points) matrix and
+return per-trace index arrays of equal length, so a whole selection is
+decimated in one call before any DataFrame is built.
+
+    minmax  - first/last point plus the min and max of every bucket
+    lttb    - largest-triangle-three-buckets
+    stride  - every k-th point (the old "每隔 N 个波数取点")
+"""
+
+from typing import Tuple
+
+import numpy as np
+
+METHODS = {
+    "min/max（保留峰谷）": "minmax",
+    "LTTB（保留形状）": "lttb",
+    "等间隔抽样": "stride",
+    "不降采样": "none",
+}
+
+
+def minmax_indices(values: np.ndarray, n_out: int) -> np.ndarray:
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    rows, n = values.shape
+    n_buckets = max(1, (n_out - 2) // 2)
+    if n <= n_out or n_buckets >= n:
+        return np.broadcast_to(np.arange(n), (rows, n))
+    size = -(-n // n_buckets)
+    pad = n_buckets * size - n
+    lo = np.pad(np.where(np.isnan(values), np.inf, values), ((0, 0), (0, pad)), constant_values=np.inf)
+    hi = np.pad(np.where(np.isnan(values), -np.inf, values), ((0, 0), (0, pad)), constant_values=-np.inf)
+    base = np.arange(n_buckets) * size
+    i_min = lo.reshape(rows, n_buckets, size).argmin(axis=2) + base
+    i_max = hi.reshape(rows, n_buckets, size).argmax(axis=2) + base
+    pairs = np.sort(np.stack([i_min, i_max], axis=2), axis=2).reshape(rows, -1)
+    pairs = np.minimum(pairs, n - 1)
+    first = np.zeros((rows, 1), dtype=pairs.dtype)
+    last = np.full((rows, 1), n - 1, dtype=pairs.dtype)
+    return np.hstack([first, pairs, last])
+
+
+def lttb_indices(x: np.ndarray, values: np.ndarray, n_out: int) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float64)
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    rows, n = values.shape
+    if n <= n_out or n_out < 3:
+        return np.broadcast_to(np.arange(n), (rows, n))
+    y = np.nan_to_num(values, nan=0.0)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.intp)
+    out = np.empty((rows, n_out), dtype=np.intp)
+    out[:, 0] = 0
+    out[:, -1] = n - 1
+    row_ids = np.arange(rows)
+    prev = np.zeros(rows, dtype=np.intp)
+    for b in range(n_out - 2):
+        start, stop = edges[b], max(edges[b + 1], edges[b] + 1)
+        nxt_start, nxt_stop = stop, (edges[b + 2] if b + 2 < len(edges) else n)
+        nxt_stop = max(nxt_stop, nxt_start + 1)
+        avg_x = x[nxt_start:nxt_stop].mean()
+        avg_y = y[:, nxt_start:nxt_stop].mean(axis=1)
+        px, py = x[prev], y[row_ids, prev]
+        area = np.abs(
+            (px - avg_x)[:, None] * (y[:, start:stop] - py[:, None])
+            - (px[:, None] - x[None, start:stop]) * (avg_y - py)[:, None]
+        )
+        prev = start + area.argmax(axis=1)
+        out[:, b + 1] = prev
+    return out
+
+
+def stride_indices(n: int, rows: int, n_out: int) -> np.ndarray:
+    step = max(1, -(-n // max(1, n_out)))
+    return np.broadcast_to(np.arange(0, n, step), (rows, len(range(0, n, step))))
+
+
+def decimate(x: np.ndarray, values: np.ndarray, n_out: int, method: str = "minmax") -> Tuple[np.ndarray, np.ndarray]:
+    """Return (x, y), each shaped (n_traces x k), with k <= about n_out points per trace."""
+    x = np.asarray(x)
+    values = np.atleast_2d(np.asarray(values))
+    rows, n = values.shape
+    if method == "minmax":
+        idx = minmax_indices(values, n_out)
+    elif method == "lttb":
+        idx = lttb_indices(x, values, n_out)
+    elif method == "stride":
+        idx = stride_indices(n, rows, n_out)
+    else:
+        idx = np.broadcast_to(np.arange(n), (rows, n))
+    return x[idx], np.take_along_axis(values, idx, axis=1)
@@ -0,0 +1,94 @@
+"""
+Content-hash keyed parse cache for uploaded files
+上传文件解析缓存（按内容哈希）
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Hashable, Tuple
+
+import pandas as pd
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    entries: int = 0
+    nbytes: int = 0
+
+
+def content_key(data: bytes, options: Tuple[Hashable, ...] = ()) -> str:
+    digest = hashlib.blake2b(data, digest_size=20)
+    digest.update(repr(options).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def frame_nbytes(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class ParseCache:
+    """Bounded LRU of parsed DataFrames, evicting by total in-memory size."""
+
+    def __init__(self, max_bytes: int = 512 * 1024 * 1024, max_entries: int = 16):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[pd.DataFrame, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = CacheStats()
+
+    def get_or_parse(self, data: bytes, options: Tuple[Hashable, ...], parser: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+        return self.get_or_parse_keyed(data, options, parser)[0]
+
+    def get_or_parse_keyed(
+        self, data: bytes, options: Tuple[Hashable, ...], parser: Callable[[], pd.DataFrame]
+    ) -> Tuple[pd.DataFrame, str]:
+        """get_or_parse that also returns the content key, so callers need not hash data again."""
+        key = content_key(data, options)
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is not None:
+                self._entries.move_to_end(key)
+                self._stats.hits += 1
+                return hit[0], key
+            self._stats.misses += 1
+
+        # Parse outside the lock so one slow workbook does not block other sessions.
+        df = parser()
+        self.put(key, df)
+        return df, key
+
+    def put(self, key: str, df: pd.DataFrame) -> None:
+        size = frame_nbytes(df)
+        with self._lock:
+            if key in self._entries:
+                self._stats.nbytes -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                self._stats.entries = len(self._entries)
+                return
+            self._entries[key] = (df, size)
+            self._stats.nbytes += size
+            while self._entries and (self._stats.nbytes > self.max_bytes or len(self._entries) > self.max_entries):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._stats.nbytes -= evicted_size
+                self._stats.evictions += 1
+            self._stats.entries = len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._stats.entries = 0
+            self._stats.nbytes = 0
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(**vars(self._stats))
+
+
+# Module-level instance: Streamlit re-executes app.py on every rerun, but imported
+# modules stay loaded, so the cache survives across reruns and sessions.
+PARSE_CACHE = ParseCache()
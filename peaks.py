@@ -0,0 +1,430 @@
+"""
+Vectorized FTIR peak detection
+FTIR 峰位检测（向量化）
+
+detect_peaks() keeps the exact semantics of the original per-point loop
+(strict local maximum of the smoothed curve, prominence against the minimum
+of `window` points on each side, top-N by prominence with ties kept in
+wavenumber order) but runs as whole-array NumPy operations.
+
+PeakIndex holds every peak of every sample of a dataset (built once with
+detect_peaks_batch and persisted as Parquet) so wavenumber-range queries
+across all spectra are a binary search instead of a recomputation.
+"""
+
+import hashlib
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+PEAK_COLUMNS = ["峰值", "透过率", "平滑强度", "峰突出度"]
+
+
+def smooth_series(values: np.ndarray, window: int) -> np.ndarray:
+    if window <= 1:
+        return values
+    return pd.Series(values).rolling(window=window, center=True, min_periods=1).mean().to_numpy()
+
+
+def smooth_matrix(values: np.ndarray, window: int) -> np.ndarray:
+    """Row-wise smooth_series; pandas rolls each column independently, so rows are transposed."""
+    if window <= 1:
+        return np.asarray(values)
+    rolled = pd.DataFrame(np.asarray(values).T).rolling(window=window, center=True, min_periods=1).mean()
+    return np.ascontiguousarray(rolled.to_numpy().T)
+
+
+def sliding_min(a: np.ndarray, window: int) -> np.ndarray:
+    """out[..., j] = min(a[..., j:j+window]) along the last axis, NaN-propagating.
+
+    Uses a sparse table (doubling) so the cost is O(n log window) regardless of
+    how many rows are processed at once.
+    """
+    a = np.asarray(a)
+    n = a.shape[-1]
+    if window > n:
+        return a[..., :0]
+    span = 1
+    table = a
+    while span * 2 <= window:
+        table = np.minimum(table[..., :-span], table[..., span:])
+        span *= 2
+    count = n - window + 1
+    return np.minimum(table[..., :count], table[..., window - span : window - span + count])
+
+
+def _prominence(y_s: np.ndarray, window: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Local-maximum mask and prominence for interior points 1..n-2 of each row."""
+    n = y_s.shape[-1]
+    centre = y_s[..., 1:-1]
+    is_max = (centre > y_s[..., :-2]) & (centre > y_s[..., 2:])
+
+    idx = np.arange(1, n - 1)
+    win_min = sliding_min(y_s, window) if window >= 1 else None
+
+    left = y_s[..., :-2].copy()
+    has_left = idx - window >= 0
+    if win_min is not None and has_left.any():
+        left[..., has_left] = win_min[..., idx[has_left] - window]
+
+    right = y_s[..., 2:].copy()
+    has_right = idx + window + 1 <= n
+    if win_min is not None and has_right.any():
+        right[..., has_right] = win_min[..., idx[has_right] + 1]
+
+    # Python's max(left, right) keeps `left` unless right is strictly greater (NaN-safe).
+    floor = np.where(right > left, right, left)
+    return is_max, centre - floor
+
+
+def _top_n(order_key: np.ndarray, top_n: int) -> np.ndarray:
+    """Indices of the top_n largest values, stable (earlier index wins ties)."""
+    if top_n <= 0:
+        return np.empty(0, dtype=np.intp)
+    if len(order_key) > top_n:
+        cut = len(order_key) - top_n
+        thresh = np.partition(order_key, cut)[cut]
+        keep = order_key > thresh
+        ties = np.flatnonzero(order_key == thresh)[: top_n - int(keep.sum())]
+        keep[ties] = True
+        picked = np.flatnonzero(keep)
+    else:
+        picked = np.arange(len(order_key))
+    return picked[np.argsort(-order_key[picked], kind="stable")]
+
+
+def detect_peaks(x: np.ndarray, y: np.ndarray, window: int, min_prom: float, top_n: int) -> pd.DataFrame:
+    x = np.asarray(x)
+    y = np.asarray(y)
+    y_s = np.asarray(smooth_series(y, window), dtype=np.float64)
+    if len(y_s) < 3:
+        return pd.DataFrame(columns=PEAK_COLUMNS)
+    is_max, prom = _prominence(y_s, window)
+    cand = np.flatnonzero(is_max & (prom >= min_prom))
+    if len(cand) == 0:
+        return pd.DataFrame(columns=PEAK_COLUMNS)
+    sel = cand[_top_n(prom[cand], top_n)]
+    if len(sel) == 0:
+        return pd.DataFrame(columns=PEAK_COLUMNS)
+    pos = sel + 1
+    return pd.DataFrame({"峰值": x[pos], "透过率": y[pos], "平滑强度": y_s[pos], "峰突出度": prom[sel]}, columns=PEAK_COLUMNS)
+
+
+def detect_peaks_batch(x: np.ndarray, values: np.ndarray, window: int, min_prom: float, top_n: int,
+                       block_rows: int = 512) -> pd.DataFrame:
+    """detect_peaks for every row of a (n_samples x n_points) matrix.
+
+    Returns one long table with a leading "row" column (matrix row index);
+    each row's peaks are identical to detect_peaks on that row alone.
+    """
+    x = np.asarray(x)
+    values = np.asarray(values)
+    n_rows, n = values.shape
+    parts: List[pd.DataFrame] = []
+    if n < 3 or top_n <= 0:
+        return pd.DataFrame(columns=["row"] + PEAK_COLUMNS)
+    for start in range(0, n_rows, block_rows):
+        y = np.asarray(values[start : start + block_rows], dtype=np.float64)
+        y_s = smooth_matrix(y, window)
+        is_max, prom = _prominence(y_s, window)
+        r, c = np.nonzero(is_max & (prom >= min_prom))
+        if len(r) == 0:
+            continue
+        p = prom[r, c]
+        # Row ascending, prominence descending, wavenumber index ascending.
+        order = np.lexsort((c, -p, r))
+        r, c, p = r[order], c[order], p[order]
+        first = np.r_[0, np.flatnonzero(np.diff(r)) + 1]
+        rank = np.arange(len(r)) - np.repeat(first, np.diff(np.r_[first, len(r)]))
+        keep = rank < top_n
+        r, c, p = r[keep], c[keep], p[keep]
+        pos = c + 1
+        parts.append(
+            pd.DataFrame(
+                {"row": r + start, "峰值": x[pos], "透过率": y[r, pos], "平滑强度": y_s[r, pos], "峰突出度": p}
+            )
+        )
+    if not parts:
+        return pd.DataFrame(columns=["row"] + PEAK_COLUMNS)
+    return pd.concat(parts, ignore_index=True)
+
+
+# ------------------------------------------------------------------------------------
+# Persistent peak index
+# ------------------------------------------------------------------------------------
+
+
+class BandIndex:
+    """Band library compiled for vectorized point lookup.
+
+    Bands are closed intervals [min(下限, 上限), max(下限, 上限)] and may overlap.
+    All endpoints split the axis into elementary atoms (each endpoint, and the
+    open gap between neighbouring endpoints); every atom stores the bands that
+    cover it in library order, so a lookup is one searchsorted per peak.
+    """
+
+    def __init__(self, band_df: pd.DataFrame):
+        self.bands = band_df.reset_index(drop=True)
+        low = self.bands["波段下限"].to_numpy(dtype=float) if len(self.bands) else np.empty(0)
+        high = self.bands["波段上限"].to_numpy(dtype=float) if len(self.bands) else np.empty(0)
+        self.low = np.minimum(low, high)
+        self.high = np.maximum(low, high)
+        self.labels = np.array(
+            [f"{lo}-{hi}" for lo, hi in zip(self.bands.get("波段下限", []), self.bands.get("波段上限", []))], dtype=object
+        )
+        self.edges = np.unique(np.concatenate([self.low, self.high]))
+        self.edges = self.edges[~np.isnan(self.edges)]
+
+        # Atom 2i+1 is the point edges[i]; atom 2i is the open gap just below it.
+        k = len(self.edges)
+        probe = np.empty(2 * k + 1)
+        probe[1::2] = self.edges
+        probe[0] = -np.inf
+        probe[-1] = np.inf
+        if k > 1:
+            probe[2:-1:2] = (self.edges[:-1] + self.edges[1:]) / 2
+        covers = (probe[:, None] >= self.low[None, :]) & (probe[:, None] <= self.high[None, :])
+        self.atom_ptr = np.r_[0, np.cumsum(covers.sum(axis=1))]
+        self.atom_bands = np.nonzero(covers)[1]
+        has_band = np.diff(self.atom_ptr) > 0
+        self.first_band = np.full(len(probe), -1, dtype=np.intp)
+        self.first_band[has_band] = self.atom_bands[self.atom_ptr[:-1][has_band]]
+
+    def __len__(self) -> int:
+        return len(self.bands)
+
+    def _atoms(self, peaks: np.ndarray) -> np.ndarray:
+        peaks = np.asarray(peaks, dtype=float)
+        if len(self.edges) == 0:
+            return np.where(np.isnan(peaks), -1, 0)
+        pos = np.searchsorted(self.edges, peaks, side="left")
+        on_edge = self.edges[np.minimum(pos, len(self.edges) - 1)] == peaks
+        atoms = np.where(on_edge, 2 * pos + 1, 2 * pos)
+        atoms[np.isnan(peaks)] = -1
+        return atoms
+
+    def first_match(self, peaks: np.ndarray) -> np.ndarray:
+        """Index of the first band (library order) containing each peak, or -1."""
+        atoms = self._atoms(peaks)
+        out = np.full(len(atoms), -1, dtype=np.intp)
+        valid = atoms >= 0
+        out[valid] = self.first_band[atoms[valid]]
+        return out
+
+    def all_matches(self, peaks: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(peak position, band index) pairs for every band containing each peak."""
+        atoms = self._atoms(peaks)
+        valid = atoms >= 0
+        atoms = np.where(valid, atoms, 0)
+        starts = self.atom_ptr[atoms]
+        counts = np.where(valid, self.atom_ptr[atoms + 1] - starts, 0)
+        peak_pos = np.repeat(np.arange(len(atoms)), counts)
+        offsets = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+        return peak_pos, self.atom_bands[np.repeat(starts, counts) + offsets]
+
+    def annotate(self, peaks_df: pd.DataFrame) -> pd.DataFrame:
+        """Add 波段/对应基团/对应成分 for the first band containing each 峰值."""
+        out = peaks_df.copy()
+        match = self.first_match(out["峰值"].to_numpy(dtype=float))
+        hit = match >= 0
+        for col, values in (
+            ("波段", self.labels),
+            ("对应基团", self.bands["对应基团"].to_numpy(dtype=object) if len(self) else np.empty(0, dtype=object)),
+            ("对应成分", self.bands["对应成分"].to_numpy(dtype=object) if len(self) else np.empty(0, dtype=object)),
+        ):
+            column = np.full(len(out), "未知", dtype=object)
+            column[hit] = values[match[hit]]
+            out[col] = column
+        return out
+
+    def explode(self, peaks_df: pd.DataFrame) -> pd.DataFrame:
+        """One row per (peak, matching band); unmatched peaks are dropped."""
+        peak_pos, band = self.all_matches(peaks_df["峰值"].to_numpy(dtype=float))
+        out = peaks_df.iloc[peak_pos].reset_index(drop=True)
+        out["波段"] = self.labels[band]
+        out["对应基团"] = self.bands["对应基团"].to_numpy(dtype=object)[band]
+        out["对应成分"] = self.bands["对应成分"].to_numpy(dtype=object)[band]
+        return out
+
+
+def default_band_mapping() -> pd.DataFrame:
+    return pd.DataFrame(
+        [
+            {"波段下限": 3600, "波段上限": 3200, "对应基团": "O-H 伸缩", "对应成分": "纤维素/水分"},
+            {"波段下限": 2960, "波段上限": 2850, "对应基团": "C-H 伸缩", "对应成分": "蜡质/有机物"},
+            {"波段下限": 1750, "波段上限": 1715, "对应基团": "C=O 伸缩", "对应成分": "果胶/半纤维素"},
+            {"波段下限": 1605, "波段上限": 1585, "对应基团": "芳香环 C=C", "对应成分": "木质素"},
+            {"波段下限": 1510, "波段上限": 1495, "对应基团": "芳香环 C=C", "对应成分": "木质素"},
+            {"波段下限": 1435, "波段上限": 1415, "对应基团": "芳香环振动", "对应成分": "木质素"},
+            {"波段下限": 1260, "波段上限": 1230, "对应基团": "C-O 伸缩", "对应成分": "木质素/半纤维素"},
+            {"波段下限": 1040, "波段上限": 1005, "对应基团": "C-O-C 伸缩", "对应成分": "纤维素骨架"},
+            {"波段下限": 905, "波段上限": 885, "对应基团": "β-糖苷键", "对应成分": "纤维素"},
+        ]
+    )
+
+
+_BAND_CACHE: "OrderedDict[str, BandIndex]" = OrderedDict()
+
+
+def compile_bands(band_df: pd.DataFrame) -> BandIndex:
+    """BandIndex memoized by band-library content (it changes only on user edits)."""
+    key = str(pd.util.hash_pandas_object(band_df.astype(str), index=False).sum()) + str(list(band_df.columns))
+    with _INDEX_LOCK:
+        if key in _BAND_CACHE:
+            _BAND_CACHE.move_to_end(key)
+            return _BAND_CACHE[key]
+    index = BandIndex(band_df)
+    with _INDEX_LOCK:
+        _BAND_CACHE[key] = index
+        while len(_BAND_CACHE) > 16:
+            _BAND_CACHE.popitem(last=False)
+    return index
+
+
+def annotate_bands(peaks_df: pd.DataFrame, band_df: pd.DataFrame) -> pd.DataFrame:
+    return compile_bands(band_df).annotate(peaks_df)
+
+
+@dataclass
+class PeakIndex:
+    """All peaks of all samples, sorted by wavenumber for range queries."""
+
+    by_wavenumber: pd.DataFrame
+    by_sample: pd.DataFrame
+    window: int
+    min_prom: float
+
+    @classmethod
+    def from_table(cls, table: pd.DataFrame, window: int, min_prom: float) -> "PeakIndex":
+        by_sample = table.reset_index(drop=True)
+        order = np.argsort(by_sample["峰值"].to_numpy(), kind="stable")
+        by_wavenumber = by_sample.iloc[order].reset_index(drop=True)
+        return cls(by_wavenumber, by_sample, int(window), float(min_prom))
+
+    @classmethod
+    def build(cls, sm, window: int, min_prom: float) -> "PeakIndex":
+        batch = detect_peaks_batch(sm.wavenumbers, sm.values, window, min_prom, top_n=sm.n_wavenumbers)
+        rows = batch["row"].to_numpy(dtype=np.intp)
+        # detect_peaks_batch emits each row's peaks in detect_peaks order, so the
+        # running position within a row is its rank.
+        first = np.r_[0, np.flatnonzero(np.diff(rows)) + 1] if len(rows) else np.empty(0, dtype=np.intp)
+        rank = np.arange(len(rows)) - np.repeat(first, np.diff(np.r_[first, len(rows)]))
+        table = pd.DataFrame(
+            {
+                "样本": sm.sample_ids[rows].astype(str),
+                "row": rows,
+                "rank": rank,
+                "峰值": batch["峰值"].to_numpy(dtype=float),
+                "峰突出度": batch["峰突出度"].to_numpy(dtype=float),
+                "平滑强度": batch["平滑强度"].to_numpy(dtype=float),
+                "透过率": batch["透过率"].to_numpy(dtype=float),
+            }
+        )
+        return cls.from_table(table, window, min_prom)
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp-{uuid.uuid4().hex}"
+        try:
+            self.by_sample.to_parquet(tmp, index=False)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    @classmethod
+    def load(cls, path: str, window: int, min_prom: float) -> "PeakIndex":
+        return cls.from_table(pd.read_parquet(path), window, min_prom)
+
+    def __len__(self) -> int:
+        return len(self.by_sample)
+
+    def in_range(self, low: float, high: float) -> pd.DataFrame:
+        low, high = min(low, high), max(low, high)
+        w = self.by_wavenumber["峰值"].to_numpy()
+        start, stop = np.searchsorted(w, low, side="left"), np.searchsorted(w, high, side="right")
+        return self.by_wavenumber.iloc[start:stop]
+
+    def samples_with_peak(self, low: float, high: float) -> pd.DataFrame:
+        hits = self.in_range(low, high)
+        if hits.empty:
+            return pd.DataFrame(columns=["样本", "峰数", "最大峰突出度", "峰值"])
+        best = hits.sort_values("峰突出度", ascending=False, kind="stable").drop_duplicates("样本")
+        counts = hits.groupby("样本", sort=False).size().rename("峰数")
+        out = best.set_index("样本")[["峰突出度", "峰值"]].rename(columns={"峰突出度": "最大峰突出度"})
+        return out.join(counts).reset_index()[["样本", "峰数", "最大峰突出度", "峰值"]]
+
+    def for_row(self, row: int, top_n: Optional[int] = None) -> pd.DataFrame:
+        rows = self.by_sample["row"].to_numpy()
+        start, stop = np.searchsorted(rows, row, side="left"), np.searchsorted(rows, row, side="right")
+        part = self.by_sample.iloc[start:stop]
+        if top_n is not None:
+            part = part.iloc[:top_n]
+        return part[PEAK_COLUMNS].reset_index(drop=True)
+
+
+_INDEX_CACHE: "OrderedDict[Tuple, PeakIndex]" = OrderedDict()
+_INDEX_LOCK = threading.Lock()
+MAX_STORED_INDEXES = 64
+
+
+def _prune_store(store_dir: str, keep: int) -> None:
+    """Delete all but the `keep` most recently used index files (mtime is bumped on load)."""
+    try:
+        entries = [e for e in os.scandir(store_dir) if e.is_file() and e.name.endswith(".parquet")]
+    except OSError:
+        return
+    entries.sort(key=lambda e: e.stat().st_mtime_ns, reverse=True)
+    for entry in entries[keep:]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def peak_index_for(sm, dataset_key: str, window: int, min_prom: float,
+                   store_dir: Optional[str] = None, max_cached: int = 8,
+                   max_stored: int = MAX_STORED_INDEXES) -> PeakIndex:
+    """Memoized (and optionally disk-persisted) PeakIndex per dataset and parameters.
+
+    Dataset keys may be file paths, so the file name is a hash of the key;
+    store_dir keeps at most max_stored indexes.
+    """
+    key = (dataset_key, int(window), float(min_prom))
+    with _INDEX_LOCK:
+        if key in _INDEX_CACHE:
+            _INDEX_CACHE.move_to_end(key)
+            return _INDEX_CACHE[key]
+
+    path = None
+    if store_dir and dataset_key:
+        name = hashlib.blake2b(repr(key).encode("utf-8"), digest_size=20).hexdigest()
+        path = os.path.join(store_dir, f"peaks-{name}.parquet")
+    index = None
+    if path and os.path.exists(path):
+        try:
+            index = PeakIndex.load(path, window, min_prom)
+            os.utime(path)
+        except (OSError, ValueError):
+            index = None
+    if index is None:
+        index = PeakIndex.build(sm, window, min_prom)
+        if path:
+            try:
+                index.save(path)
+            except OSError:
+                pass  # the store is only a cache; the index is still returned
+            else:
+                _prune_store(store_dir, max_stored)
+
+    with _INDEX_LOCK:
+        _INDEX_CACHE[key] = index
+        while len(_INDEX_CACHE) > max_cached:
+            _INDEX_CACHE.popitem(last=False)
+    return index
@@ -0,0 +1,333 @@
+"""
+FTIR spectra preprocessing
+FTIR 光谱预处理
+
+A Preprocessing is a frozen parameter set applied to a whole SpectraMatrix
+at once, in a fixed order:
+
+    baseline      asymmetric least squares (ALS) or rubber band (lower convex hull), subtracted
+    normalize     vector (unit L2 norm), min-max (0..1) or area (unit integral of |y|)
+    Savitzky-Golay  polynomial smoothing or derivative (dy/dx in wavenumber units)
+
+Every step works on the (n_samples x n_wavenumbers) matrix: the ALS
+penalised system is a pentadiagonal solve vectorised across spectra, the
+rubber band is a monotone-chain hull run in lockstep over all rows, and
+Savitzky-Golay is a sum of shifted slices with polynomial fits at both
+ends (scipy's mode="interp"). Baselines assume peaks point up, as in the
+peak detector. NaN gaps are bridged linearly for the computation and kept
+as NaN in the result.
+
+preprocess_for() memoizes the result per (matrix, parameter set), so the
+app's peak detection, averages, difference spectra and group means can all
+run on the preprocessed matrix without recomputing it on every rerun.
+"""
+
+import threading
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+from math import factorial
+from typing import Optional, Tuple
+
+import numpy as np
+
+from spectra import SpectraMatrix
+
+BASELINES = {"none": "不校正", "als": "非对称最小二乘 (ALS)", "rubberband": "橡皮筋 (凸包)"}
+NORMALIZATIONS = {"none": "不归一化", "vector": "向量 (L2)", "minmax": "最小-最大", "area": "面积"}
+
+
+@dataclass(frozen=True)
+class Preprocessing:
+    baseline: str = "none"
+    lam: float = 1e5
+    p: float = 0.01
+    iterations: int = 10
+    normalize: str = "none"
+    sg_window: int = 0
+    sg_order: int = 2
+    derivative: int = 0
+
+    def __post_init__(self) -> None:
+        if self.baseline not in BASELINES:
+            raise ValueError(f"unknown baseline '{self.baseline}'")
+        if self.normalize not in NORMALIZATIONS:
+            raise ValueError(f"unknown normalization '{self.normalize}'")
+        if self.sg_window > 1 and (self.sg_window % 2 == 0 or self.sg_order >= self.sg_window):
+            raise ValueError("Savitzky-Golay window must be odd and larger than the polynomial order")
+        if self.derivative > max(self.sg_order, 0):
+            raise ValueError("derivative order cannot exceed the polynomial order")
+
+    @property
+    def smoothing(self) -> bool:
+        return self.sg_window > 1
+
+    @property
+    def is_identity(self) -> bool:
+        return self.baseline == "none" and self.normalize == "none" and not self.smoothing
+
+    @property
+    def key(self) -> str:
+        """Filename-safe identifier of the parameter set."""
+        parts = [self.baseline]
+        if self.baseline == "als":
+            parts.append(f"l{self.lam:g}-p{self.p:g}-i{self.iterations}")
+        parts.append(f"n{self.normalize}")
+        if self.smoothing:
+            parts.append(f"sg{self.sg_window}-{self.sg_order}-d{self.derivative}")
+        return "_".join(parts)
+
+    def label(self) -> str:
+        steps = []
+        if self.baseline != "none":
+            steps.append(f"基线：{BASELINES[self.baseline]}")
+        if self.normalize != "none":
+            steps.append(f"归一化：{NORMALIZATIONS[self.normalize]}")
+        if self.smoothing:
+            what = f"{self.derivative} 阶导数" if self.derivative else "平滑"
+            steps.append(f"Savitzky–Golay {what}（窗口 {self.sg_window}，{self.sg_order} 次）")
+        return "；".join(steps) or "原始光谱"
+
+
+# ---------------------------------------------------------------- gaps
+
+
+def _fill_gaps(values: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Rows with NaN gaps bridged by linear interpolation (edges held); all-NaN rows become 0."""
+    missing = np.isnan(values)
+    if not missing.any():
+        return np.array(values, dtype=np.float64), None
+    n = values.shape[1]
+    pos = np.arange(n)
+    prev = np.maximum.accumulate(np.where(missing, -1, pos), axis=1)
+    nxt = np.minimum.accumulate(np.where(missing, n, pos)[:, ::-1], axis=1)[:, ::-1]
+    lo = np.where(prev < 0, nxt, prev)
+    hi = np.where(nxt >= n, prev, nxt)
+    empty = lo >= n
+    lo, hi = np.where(empty, 0, lo), np.where(empty, 0, hi)
+    rows = np.arange(values.shape[0])[:, None]
+    y_lo, y_hi = values[rows, lo], values[rows, hi]
+    span = np.where(hi > lo, hi - lo, 1)
+    filled = np.where(missing, y_lo + (y_hi - y_lo) * (pos - lo) / span, values)
+    return np.where(empty, 0.0, filled), missing
+
+
+# ---------------------------------------------------------------- baselines
+
+
+def _penalty_bands(n: int, lam: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Diagonal, first and second off-diagonal of lam * D'D, D the (n-2 x n) second-difference matrix."""
+    i = np.arange(n, dtype=np.float64)
+    d0 = (i <= n - 3) * 1.0 + ((i >= 1) & (i <= n - 2)) * 4.0 + (i >= 2) * 1.0
+    j = np.arange(n - 1)
+    d1 = -2.0 * (j >= 1) - 2.0 * (j <= n - 3)
+    d2 = np.ones(max(n - 2, 0))
+    return lam * d0, lam * d1, lam * d2
+
+
+def _solve_pentadiagonal(d: np.ndarray, e: np.ndarray, f: np.ndarray, rhs: np.ndarray) -> np.ndarray:
+    """Solve A x = rhs for symmetric positive definite pentadiagonal A, one system per column.
+
+    d and rhs are (n x m): the diagonal and right-hand side of every system;
+    the off-diagonals e (n-1) and f (n-2) are shared. The LDL' factorisation
+    loops over the n points and is vectorised across the m columns; arrays
+    carry two leading zero rows so the recurrences need no edge cases.
+    """
+    n, m = d.shape
+    e = np.r_[e, 0.0].tolist()
+    f = np.r_[f, 0.0, 0.0].tolist()
+    D = np.ones((n + 2, m))
+    a = np.zeros((n + 2, m))  # L[i+1, i]
+    b = np.zeros((n + 2, m))  # L[i+2, i]
+    z = np.zeros((n + 2, m))
+    for i in range(n):
+        k = i + 2
+        a1, b1, b2 = a[k - 1], b[k - 1], b[k - 2]
+        t = a1 * D[k - 1]
+        di = d[i] - a1 * t - f[i - 2] * b2 if i >= 2 else d[i] - a1 * t
+        D[k] = di
+        z[k] = rhs[i] - a1 * z[k - 1] - b2 * z[k - 2]
+        np.divide(e[i] - b1 * t, di, out=a[k])
+        np.divide(f[i], di, out=b[k])
+    x = np.zeros((n + 4, m))
+    np.divide(z, D, out=x[: n + 2])
+    for k in range(n + 1, 1, -1):
+        x[k] -= a[k] * x[k + 1] + b[k] * x[k + 2]
+    return x[2 : n + 2]
+
+
+def als_baseline(values: np.ndarray, lam: float = 1e5, p: float = 0.01, iterations: int = 10) -> np.ndarray:
+    """Asymmetric least squares baseline (Eilers & Boelens) of every row.
+
+    Minimises sum w (y - z)^2 + lam * sum (second difference of z)^2 with
+    w = p above the baseline and 1 - p below, re-weighting up to `iterations`
+    times or until no weight changes.
+    """
+    y = np.ascontiguousarray(np.asarray(values, dtype=np.float64).T)  # points x spectra
+    n, m = y.shape
+    if n < 3 or m == 0:
+        return np.array(values, dtype=np.float64)
+    d0, d1, d2 = _penalty_bands(n, lam)
+    w = np.ones_like(y)
+    z = y
+    for _ in range(max(1, int(iterations))):
+        z = _solve_pentadiagonal(d0[:, None] + w, d1, d2, w * y)
+        new_w = np.where(y > z, p, 1.0 - p)
+        if np.array_equal(new_w, w):
+            break
+        w = new_w
+    return np.ascontiguousarray(z.T)
+
+
+def rubberband_baseline(x: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Lower convex hull of every row, linearly interpolated at each x.
+
+    Andrew's monotone chain run in lockstep over all rows: each row keeps its
+    own stack of hull indices, and the pop loop only continues while some row
+    still has a right turn to remove.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(values, dtype=np.float64)
+    m, n = y.shape
+    if n < 3 or m == 0:
+        return y.copy()
+    order = np.argsort(x, kind="stable")
+    xs, ys = x[order], y[:, order]
+    stack = np.zeros((m, n), dtype=np.intp)
+    top = np.zeros(m, dtype=np.intp)
+    rows = np.arange(m)
+    for i in range(n):
+        # Pop while (p0, p1, p) is not a strict left turn; only rows that just popped can pop again.
+        live = rows if i >= 2 else rows[:0]
+        while len(live):
+            i0 = stack[live, top[live] - 2]
+            i1 = stack[live, top[live] - 1]
+            x0 = xs[i0]
+            y0 = ys[live, i0]
+            turn = (xs[i1] - x0) * (ys[live, i] - y0) - (ys[live, i1] - y0) * (xs[i] - x0)
+            live = live[turn <= 0]
+            top[live] -= 1
+            live = live[top[live] >= 2]
+        stack[rows, top] = i
+        top += 1
+    vertex = np.zeros((m, n), dtype=bool)
+    vertex[np.repeat(rows, top), stack[np.arange(n) < top[:, None]]] = True
+    pos = np.arange(n)
+    left = np.maximum.accumulate(np.where(vertex, pos, 0), axis=1)
+    right = np.minimum.accumulate(np.where(vertex, pos, n - 1)[:, ::-1], axis=1)[:, ::-1]
+    r = rows[:, None]
+    span = xs[right] - xs[left]
+    t = np.divide(xs - xs[left], span, out=np.zeros_like(span), where=span != 0)
+    base = ys[r, left] + (ys[r, right] - ys[r, left]) * t
+    out = np.empty_like(base)
+    out[:, order] = base
+    return out
+
+
+# ---------------------------------------------------------------- normalization
+
+
+def normalize_rows(x: np.ndarray, values: np.ndarray, method: str) -> np.ndarray:
+    y = np.asarray(values, dtype=np.float64)
+    if method == "none":
+        return y
+    if method == "vector":
+        offset, scale = 0.0, np.sqrt(np.sum(y * y, axis=1))
+    elif method == "minmax":
+        offset = y.min(axis=1)
+        scale = y.max(axis=1) - offset
+        offset = offset[:, None]
+    elif method == "area":
+        offset = 0.0
+        a = np.abs(y)
+        scale = np.sum(0.5 * (a[:, 1:] + a[:, :-1]) * np.abs(np.diff(np.asarray(x, dtype=np.float64))), axis=1)
+    else:
+        raise ValueError(f"unknown normalization '{method}'")
+    scale = np.where(scale > 0, scale, 1.0)
+    return (y - offset) / scale[:, None]
+
+
+# ---------------------------------------------------------------- Savitzky-Golay
+
+
+def savgol_coefficients(window: int, order: int, derivative: int = 0) -> np.ndarray:
+    """(window x window) matrix: row t evaluates the derivative of the least-squares polynomial
+    through `window` equally spaced samples at sample t (unit spacing)."""
+    t = np.arange(window, dtype=np.float64)
+    powers = np.arange(order + 1)
+    fit = np.linalg.pinv(t[:, None] ** powers)  # (order+1) x window
+    coef = np.array([factorial(k) / factorial(k - derivative) if k >= derivative else 0.0 for k in powers])
+    evaluate = coef * t[:, None] ** np.maximum(powers - derivative, 0) * (powers >= derivative)
+    return evaluate @ fit
+
+
+def savgol_rows(x: np.ndarray, values: np.ndarray, window: int, order: int, derivative: int = 0) -> np.ndarray:
+    """Savitzky-Golay filter of every row; derivatives are dy/dx for the (evenly spaced) x axis."""
+    y = np.asarray(values, dtype=np.float64)
+    n = y.shape[1]
+    if window <= 1:
+        return y.copy()
+    if window > n:
+        raise ValueError(f"Savitzky-Golay window {window} is longer than the {n} points of a spectrum")
+    half = window // 2
+    matrix = savgol_coefficients(window, order, derivative)
+    centre = matrix[half]
+    out = np.empty_like(y)
+    interior = out[:, half : n - half]
+    interior[:] = centre[0] * y[:, : n - window + 1]
+    for j in range(1, window):
+        interior += centre[j] * y[:, j : j + n - window + 1]
+    # Edges: evaluate the polynomial fitted to the first / last window (scipy's mode="interp").
+    out[:, :half] = y[:, :window] @ matrix[:half].T
+    out[:, n - half :] = y[:, n - window :] @ matrix[window - half :].T
+    if derivative:
+        x = np.asarray(x, dtype=np.float64)
+        out /= ((x[-1] - x[0]) / (n - 1)) ** derivative
+    return out
+
+
+# ---------------------------------------------------------------- pipeline
+
+
+def preprocess_values(x: np.ndarray, values: np.ndarray, params: Preprocessing) -> np.ndarray:
+    y, missing = _fill_gaps(np.asarray(values, dtype=np.float64))
+    if params.baseline == "als":
+        y = y - als_baseline(y, params.lam, params.p, params.iterations)
+    elif params.baseline == "rubberband":
+        y = y - rubberband_baseline(x, y)
+    y = normalize_rows(x, y, params.normalize)
+    if params.smoothing:
+        y = savgol_rows(x, y, params.sg_window, params.sg_order, params.derivative)
+    if missing is not None:
+        y[missing] = np.nan
+    return y
+
+
+def preprocess(sm: SpectraMatrix, params: Preprocessing) -> SpectraMatrix:
+    if params.is_identity:
+        return sm
+    return sm.with_values(preprocess_values(sm.wavenumbers, np.asarray(sm.values), params))
+
+
+_PRE_CACHE: "OrderedDict[Tuple[int, Preprocessing], Tuple[weakref.ref, SpectraMatrix]]" = OrderedDict()
+_PRE_LOCK = threading.Lock()
+
+
+def preprocess_for(sm: SpectraMatrix, params: Preprocessing, max_cached: int = 8) -> SpectraMatrix:
+    """preprocess() memoized per (matrix identity, parameter set), least recently used evicted first."""
+    if params.is_identity:
+        return sm
+    key = (id(sm), params)
+    with _PRE_LOCK:
+        hit = _PRE_CACHE.get(key)
+        if hit is not None and hit[0]() is sm:
+            _PRE_CACHE.move_to_end(key)
+            return hit[1]
+    out = preprocess(sm, params)
+    with _PRE_LOCK:
+        for stale in [k for k, v in _PRE_CACHE.items() if v[0]() is None]:
+            del _PRE_CACHE[stale]
+        _PRE_CACHE[key] = (weakref.ref(sm), out)
+        while len(_PRE_CACHE) > max_cached:
+            _PRE_CACHE.popitem(last=False)
+    return out
@@ -0,0 +1,310 @@
+"""
+Process-parameter model
+工艺参数与响应的联合分析
+
+build_sample_table() joins every per-sample measurement of the experiment on
+the canonical sample ID (sample_ids.parse_sample_ids) and attaches the
+treatment parameters of Sample.xlsx (sample_metadata):
+
+    断裂强度(MPa)   mean of the replicates in Break_force.xlsx
+    提取率          Extraction Rate in 纤维提取率.xlsx
+    FTIR <band>    mean intensity of each FTIR.xlsx spectrum inside each band
+                   of the band library (one masked matrix product)
+
+batch_regression() then fits y = a + b·x for every response against every
+process variable, optionally within groups (fibre type, series), from a
+handful of masked matrix products: each pair uses the rows where both values
+are present, exactly like a per-pair np.polyfit loop, but the cost no longer
+grows with a Python loop over responses x variables x groups.
+"""
+
+import math
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from peaks import default_band_mapping
+from sample_ids import parse_sample_ids
+from sample_metadata import PROCESS_VARIABLES, find_data_file, load_sample_metadata
+from spectra import SpectraMatrix, detect_ftir_structure
+from sidecar import read_table
+
+BREAK_FORCE_FILE = "Break_force.xlsx"
+EXTRACTION_FILE = "纤维提取率.xlsx"
+FTIR_FILE = "FTIR.xlsx"
+STRENGTH = "断裂强度(MPa)"
+EXTRACTION_RATE = "提取率"
+KEY_COLUMNS = ["样本", "纤维类型", "系列", "重复"]
+FIT_COLUMNS = ["分组", "响应", "过程变量", "n", "斜率", "截距", "r", "R²", "t", "p值"]
+ALL_GROUPS = "全部"
+
+
+@dataclass
+class SampleTable:
+    frame: pd.DataFrame = field(default_factory=lambda: pd.DataFrame(columns=KEY_COLUMNS))
+    responses: List[str] = field(default_factory=list)
+    variables: List[str] = field(default_factory=list)
+    sources: Dict[str, str] = field(default_factory=dict)
+
+    def __bool__(self) -> bool:
+        return bool(self.responses)
+
+
+# ---------------------------------------------------------------- per-dataset loaders
+
+
+def _per_sample(ids: pd.Series, values: pd.DataFrame) -> pd.DataFrame:
+    """values averaged per canonical sample ID (rows without an ID dropped)."""
+    sample = parse_sample_ids(ids)["sample"].astype(object)
+    keep = sample.notna().to_numpy() & (ids.astype(str).str.strip() != "").to_numpy()
+    out = values[keep].groupby(sample[keep].to_numpy(), sort=False).mean()
+    out.index.name = "样本"
+    return out
+
+
+def load_break_force(path: str) -> pd.DataFrame:
+    """Break_force.xlsx: sample column, replicate columns, Average; the first data row is LB0."""
+    raw = read_table(path)
+    ids = raw.iloc[:, 0]
+    numeric = raw.iloc[:, 1:].apply(pd.to_numeric, errors="coerce")
+    replicates = [c for c in numeric.columns if str(c).strip().lower().startswith("sample")]
+    if replicates:
+        strength = numeric[replicates].mean(axis=1)
+    else:
+        strength = numeric[[c for c in numeric.columns if str(c).strip().lower() == "average"]].mean(axis=1)
+    frame = pd.DataFrame({STRENGTH: strength})
+    return _per_sample(ids[ids.notna()], frame[ids.notna().to_numpy()])
+
+
+def load_extraction_rate(path: str) -> pd.DataFrame:
+    raw = read_table(path)
+    ids = raw.iloc[:, 0]
+    rate_cols = [c for c in raw.columns if "rate" in str(c).lower() or "提取率" in str(c)]
+    rate = pd.to_numeric(raw[rate_cols[0] if rate_cols else raw.columns[-1]], errors="coerce")
+    frame = pd.DataFrame({EXTRACTION_RATE: rate})
+    return _per_sample(ids[ids.notna()], frame[ids.notna().to_numpy()])
+
+
+def band_labels(band_df: pd.DataFrame) -> List[str]:
+    return [f"FTIR {comp} {lo}-{hi}" for lo, hi, comp in zip(band_df["波段下限"], band_df["波段上限"], band_df["对应成分"])]
+
+
+def band_intensities(sm: SpectraMatrix, band_df: pd.DataFrame) -> np.ndarray:
+    """(n_samples x n_bands) NaN-aware mean of each spectrum inside each band."""
+    low = band_df["波段下限"].to_numpy(dtype=float)
+    high = band_df["波段上限"].to_numpy(dtype=float)
+    lo, hi = np.minimum(low, high), np.maximum(low, high)
+    w = sm.wavenumbers
+    in_band = ((w[None, :] >= lo[:, None]) & (w[None, :] <= hi[:, None])).astype(np.float64)
+    values = np.asarray(sm.values, dtype=np.float64)
+    finite = ~np.isnan(values)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = (np.where(finite, values, 0.0) @ in_band.T) / (finite.astype(np.float64) @ in_band.T)
+    return out
+
+
+def load_ftir_bands(path: str, band_df: pd.DataFrame) -> pd.DataFrame:
+    raw = read_table(path)
+    ftir = detect_ftir_structure(raw)
+    if ftir is None or band_df.empty:
+        return pd.DataFrame(index=pd.Index([], name="样本"))
+    sm = SpectraMatrix.from_frame(raw, ftir)
+    frame = pd.DataFrame(band_intensities(sm, band_df), columns=band_labels(band_df))
+    ids = raw[ftir["sample_col"]]
+    return _per_sample(ids[ids.notna()], frame[ids.notna().to_numpy()])
+
+
+# ---------------------------------------------------------------- joined table
+
+LOADERS = {
+    BREAK_FORCE_FILE: lambda path, band_df: load_break_force(path),
+    EXTRACTION_FILE: lambda path, band_df: load_extraction_rate(path),
+    FTIR_FILE: load_ftir_bands,
+}
+
+_TABLE_CACHE: Dict[str, Tuple[Tuple, SampleTable]] = {}
+_TABLE_LOCK = threading.Lock()
+
+
+def _stamp(path: str) -> Tuple[int, int]:
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def join_samples(parts: Sequence[pd.DataFrame], meta=None) -> pd.DataFrame:
+    """Outer join of per-sample frames on 样本 plus the parsed keys and, given meta, the process variables."""
+    joined = pd.concat([p for p in parts if len(p.columns)], axis=1, join="outer", sort=False)
+    joined = joined.reset_index().rename(columns={"index": "样本"})
+    keys = parse_sample_ids(joined["样本"])
+    joined.insert(1, "纤维类型", keys["prefix"].astype(object))
+    joined.insert(2, "系列", keys["series"])
+    joined.insert(3, "重复", keys["replicate"])
+    order = np.lexsort((keys["replicate"].fillna(-1).to_numpy(), keys["series"].fillna(-1).to_numpy(),
+                        joined["纤维类型"].fillna("").to_numpy(dtype=str)))
+    joined = joined.iloc[order].reset_index(drop=True)
+    if meta:
+        joined = meta.join(joined, "样本")
+        responses = [c for c in joined.columns if c not in KEY_COLUMNS + PROCESS_VARIABLES + ["样本前缀描述"]]
+        joined = joined[KEY_COLUMNS + ["样本前缀描述"] + PROCESS_VARIABLES + responses]
+    return joined
+
+
+def build_sample_table(base_dir: str, band_df: Optional[pd.DataFrame] = None) -> SampleTable:
+    """Cached SampleTable for the data files found under base_dir (empty if none)."""
+    band_df = default_band_mapping() if band_df is None else band_df
+    sources = {name: find_data_file(base_dir, name) for name in LOADERS}
+    sources = {name: path for name, path in sources.items() if path is not None}
+    if not sources:
+        return SampleTable()
+    meta = load_sample_metadata(base_dir)
+    bands_key = str(pd.util.hash_pandas_object(band_df.astype(str), index=False).sum())
+    stamp = (tuple((p, _stamp(p)) for p in sources.values()), meta.path and _stamp(meta.path), bands_key)
+    with _TABLE_LOCK:
+        hit = _TABLE_CACHE.get(base_dir)
+    if hit is not None and hit[0] == stamp:
+        return hit[1]
+
+    parts = [LOADERS[name](path, band_df) for name, path in sources.items()]
+    frame = join_samples(parts, meta)
+    responses = [c for p in parts for c in p.columns]
+    variables = [c for c in PROCESS_VARIABLES if c in frame and frame[c].notna().any()]
+    table = SampleTable(frame=frame, responses=responses, variables=variables, sources=sources)
+    with _TABLE_LOCK:
+        _TABLE_CACHE[base_dir] = (stamp, table)
+    return table
+
+
+# ---------------------------------------------------------------- batched fits
+
+
+def _betainc(a: np.ndarray, b: np.ndarray, x: np.ndarray) -> np.ndarray:
+    """Regularized incomplete beta I_x(a, b), continued fraction evaluated for all entries at once."""
+    a, b, x = np.broadcast_arrays(*(np.asarray(v, dtype=np.float64) for v in (a, b, x)))
+    flip = x > (a + 1.0) / (a + b + 2.0)
+    a, b, x = np.where(flip, b, a), np.where(flip, a, b), np.where(flip, 1.0 - x, x)
+    lgamma = np.vectorize(math.lgamma, otypes=[np.float64])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        front = np.exp(a * np.log(x) + b * np.log1p(-x) - (lgamma(a) + lgamma(b) - lgamma(a + b))) / a
+        tiny = 1e-300
+        c = np.ones_like(x)
+        d = 1.0 - (a + b) * x / (a + 1.0)
+        d = 1.0 / np.where(np.abs(d) < tiny, tiny, d)
+        frac = d.copy()
+        for m in range(1, 300):
+            for num in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                        -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+                d = 1.0 + num * d
+                d = 1.0 / np.where(np.abs(d) < tiny, tiny, d)
+                c = 1.0 + num / c
+                c = np.where(np.abs(c) < tiny, tiny, c)
+                frac *= c * d
+            if np.nanmax(np.abs(c * d - 1.0), initial=0.0) < 1e-14:
+                break
+        out = front * frac
+    out = np.where(flip, 1.0 - out, out)
+    return np.where(x <= 0.0, np.where(flip, 1.0, 0.0), out)
+
+
+def t_pvalue(t: np.ndarray, dof: np.ndarray) -> np.ndarray:
+    """Two-sided p-value of Student's t with dof degrees of freedom."""
+    t, dof = np.broadcast_arrays(np.asarray(t, dtype=np.float64), np.asarray(dof, dtype=np.float64))
+    valid = np.isfinite(t) & (dof > 0)
+    out = np.full(t.shape, np.nan)
+    if valid.any():
+        tv, nu = t[valid], dof[valid]
+        out[valid] = _betainc(nu / 2.0, np.full_like(nu, 0.5), nu / (nu + tv * tv))
+    out[np.isinf(t) & (dof > 0)] = 0.0
+    return out
+
+
+def _group_codes(frame: pd.DataFrame, by: Optional[Sequence[str]]) -> Tuple[np.ndarray, List[str]]:
+    if not by:
+        return np.zeros(len(frame), dtype=np.intp), [ALL_GROUPS]
+    keys = frame[list(by)].astype(object).where(frame[list(by)].notna(), None)
+    labels = keys.apply(lambda row: " / ".join("—" if v is None else str(v) for v in row), axis=1)
+    codes, uniques = pd.factorize(labels, sort=True)
+    return codes.astype(np.intp), [str(u) for u in uniques]
+
+
+def regression_arrays(x: np.ndarray, y: np.ndarray, groups: Optional[np.ndarray] = None,
+                      n_groups: Optional[int] = None) -> Dict[str, np.ndarray]:
+    """Simple regressions of every y column on every x column within every group.
+
+    x is (n, p), y is (n, r), groups (n,) integer codes (negative = dropped).
+    Returns (g, p, r) arrays n, slope, intercept, r, t, p; NaN where a fit is
+    undefined (fewer than 3 complete pairs or a constant x or y).
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    groups = np.zeros(len(x), dtype=np.intp) if groups is None else np.asarray(groups, dtype=np.intp)
+    g = int(groups.max(initial=-1)) + 1 if n_groups is None else n_groups
+    mx, my = ~np.isnan(x), ~np.isnan(y)
+    # Centre on the column means: r and the slope do not change, the sums stay small.
+    with np.errstate(invalid="ignore"):
+        cx = np.nanmean(np.where(mx.any(axis=0), x, 0.0), axis=0)
+        cy = np.nanmean(np.where(my.any(axis=0), y, 0.0), axis=0)
+    x0 = np.where(mx, x - cx, 0.0)
+    y0 = np.where(my, y - cy, 0.0)
+    member = np.zeros((len(x), g))
+    rows = np.flatnonzero(groups >= 0)
+    member[rows, groups[rows]] = 1.0
+
+    def gsum(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        # sum over rows k of member[k, g] * a[k, i] * b[k, j] as one matrix product
+        left = (member[:, :, None] * a[:, None, :]).reshape(len(a), -1)
+        return (left.T @ b).reshape(g, a.shape[1], b.shape[1])
+
+    mxf, myf = mx.astype(np.float64), my.astype(np.float64)
+    n = gsum(mxf, myf)
+    sx, sy = gsum(x0, myf), gsum(mxf, y0)
+    sxx, syy, sxy = gsum(x0 * x0, myf), gsum(mxf, y0 * y0), gsum(x0, y0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        vx = sxx - sx * sx / n
+        vy = syy - sy * sy / n
+        cov = sxy - sx * sy / n
+        ok = (n >= 3) & (vx > 1e-12 * sxx) & (vy > 1e-12 * syy)
+        slope = np.where(ok, cov / vx, np.nan)
+        intercept = np.where(ok, (cy + sy / n) - slope * (cx[None, :, None] + sx / n), np.nan)
+        r = np.where(ok, np.clip(cov / np.sqrt(vx * vy), -1.0, 1.0), np.nan)
+        dof = n - 2
+        t = np.where(ok, r * np.sqrt(dof / (1.0 - r * r)), np.nan)
+    return {"n": n, "slope": slope, "intercept": intercept, "r": r, "t": t, "p": t_pvalue(t, np.where(ok, dof, 0))}
+
+
+def batch_regression(frame: pd.DataFrame, responses: Sequence[str], variables: Sequence[str],
+                     by: Optional[Sequence[str]] = None, min_n: int = 3) -> pd.DataFrame:
+    """FIT_COLUMNS for every (group, response, process variable) with a defined fit."""
+    responses, variables = list(responses), list(variables)
+    if not responses or not variables or frame.empty:
+        return pd.DataFrame(columns=FIT_COLUMNS)
+    codes, labels = _group_codes(frame, by)
+    x = frame[variables].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+    y = frame[responses].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+    fit = regression_arrays(x, y, codes, len(labels))
+    gi, vi, ri = np.nonzero(~np.isnan(fit["r"]) & (fit["n"] >= min_n))
+    r = fit["r"][gi, vi, ri]
+    out = pd.DataFrame(
+        {
+            "分组": np.asarray(labels, dtype=object)[gi],
+            "响应": np.asarray(responses, dtype=object)[ri],
+            "过程变量": np.asarray(variables, dtype=object)[vi],
+            "n": fit["n"][gi, vi, ri].astype(np.int64),
+            "斜率": fit["slope"][gi, vi, ri],
+            "截距": fit["intercept"][gi, vi, ri],
+            "r": r,
+            "R²": r * r,
+            "t": fit["t"][gi, vi, ri],
+            "p值": fit["p"][gi, vi, ri],
+        }
+    )
+    return out.reset_index(drop=True)
+
+
+def strongest_fits(fits: pd.DataFrame, alpha: float = 0.05, top: int = 10) -> pd.DataFrame:
+    """Significant fits ordered by |r|."""
+    hits = fits[fits["p值"] < alpha]
+    return hits.iloc[np.argsort(-hits["r"].abs().to_numpy(), kind="stable")].head(top).reset_index(drop=True)
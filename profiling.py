@@ -0,0 +1,179 @@
+"""
+Opt-in per-rerun section profiler
+按页面分区的性能剖析（可选开启）
+
+    profiler = Profiler(enabled=True, log_path=".sidecar/profile.jsonl")
+    profiler.mark("统计概览")          # closes the previous mark, opens a new one
+    with profiler.section("相关性"):
+        ...
+    profiler.flush(tab="通用数据分析")
+
+mark() suits a top-level script where sections are consecutive blocks and
+st.stop() may end the run early; section() nests inside it. Each section
+records wall-clock time and the tracemalloc peak above the memory in use
+when it started (numpy buffers are traced too). Nested paths are joined
+with " / ". When disabled, section() hands back a shared no-op context
+manager, mark() returns immediately and nothing is traced.
+
+tracemalloc is process-wide: its peak counter cannot be split between
+threads, so only one profiler at a time records memory. An enabled profiler
+try-acquires a module lock when it is created; if another session already
+holds it, this rerun records wall time only (peak_mb is None and
+memory_traced is False) instead of reporting figures mixed with the other
+session's. flush() or close() releases the lock and stops tracing if this
+profiler started it. A disabled profiler never touches either.
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+import weakref
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterator, List, Optional
+
+import pandas as pd
+
+ENV_FLAG = "APP_PROFILE"
+
+_NULL_SECTION = contextlib.nullcontext()
+_memory_lock = threading.Lock()
+
+
+@dataclass
+class SectionRecord:
+    section: str
+    depth: int
+    wall_ms: float
+    peak_mb: Optional[float]
+
+
+def enabled_from_env() -> bool:
+    return os.environ.get(ENV_FLAG, "").strip().lower() in {"1", "true", "yes", "on"}
+
+
+def _acquire_tracing() -> Optional[bool]:
+    """Claim tracemalloc for one profiler; None if another one holds it, else whether we started it."""
+    if not _memory_lock.acquire(blocking=False):
+        return None
+    # Tracing started outside this module (python -X tracemalloc) is left running.
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    return started
+
+
+def _release_tracing(started: bool) -> None:
+    if started:
+        tracemalloc.stop()
+    _memory_lock.release()
+
+
+class Profiler:
+    def __init__(self, enabled: bool = False, log_path: Optional[str] = None, trace_memory: bool = True):
+        self.enabled = enabled
+        self.log_path = log_path
+        self.trace_memory = enabled and trace_memory
+        self.run_id = uuid.uuid4().hex[:12]
+        self.records: List[SectionRecord] = []
+        self._stack: List[List[Any]] = []  # [name, start_current, child_peak]
+        self._started = time.perf_counter()
+        self._flushed = False
+        self._mark: Optional[contextlib.AbstractContextManager] = None
+        self._release = None
+        if self.trace_memory:
+            started = _acquire_tracing()
+            if started is None:
+                self.trace_memory = False
+            else:
+                # Fallback for a rerun that dies before flush().
+                self._release = weakref.finalize(self, _release_tracing, started)
+        self.memory_traced = self.trace_memory
+
+    def section(self, name: str):
+        if not self.enabled:
+            return _NULL_SECTION
+        return self._section(name)
+
+    @contextlib.contextmanager
+    def _section(self, name: str) -> Iterator[None]:
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                # Fold the peak reached so far into the parent before resetting it.
+                self._stack[-1][2] = max(self._stack[-1][2], peak)
+            tracemalloc.reset_peak()
+        else:
+            current = 0
+        self._stack.append([name, current, 0])
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall_ms = (time.perf_counter() - start) * 1000
+            frame = self._stack.pop()
+            path = " / ".join([f[0] for f in self._stack] + [name])
+            peak_mb = None
+            if self.trace_memory:
+                peak = max(tracemalloc.get_traced_memory()[1], frame[2])
+                peak_mb = round(max(0, peak - frame[1]) / 1e6, 3)
+                if self._stack:
+                    self._stack[-1][2] = max(self._stack[-1][2], peak)
+            self.records.append(SectionRecord(path, len(self._stack), round(wall_ms, 2), peak_mb))
+
+    def mark(self, name: str) -> None:
+        if not self.enabled:
+            return
+        self.end_mark()
+        self._mark = self._section(name)
+        self._mark.__enter__()
+
+    def end_mark(self) -> None:
+        if self._mark is not None:
+            mark, self._mark = self._mark, None
+            mark.__exit__(None, None, None)
+
+    def frame(self) -> pd.DataFrame:
+        rows = [
+            {"分区": r.section, "耗时(ms)": r.wall_ms, "峰值内存(MB)": r.peak_mb}
+            for r in self.records
+        ]
+        return pd.DataFrame(rows, columns=["分区", "耗时(ms)", "峰值内存(MB)"])
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self._started) * 1000
+
+    def close(self) -> None:
+        """Hand tracemalloc back to other sessions; later sections record time only."""
+        self.end_mark()
+        if self._release is not None:
+            self._release()
+            self._release = None
+        self.trace_memory = False
+
+    def flush(self, **context: Any) -> None:
+        """Append this rerun's records to the JSON-lines log (once per rerun)."""
+        if not self.enabled or self._flushed:
+            return
+        self._flushed = True
+        self.close()
+        if not self.log_path:
+            return
+        os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+        ts = time.strftime("%Y-%m-%dT%H:%M:%S")
+        with open(self.log_path, "a", encoding="utf-8") as fh:
+            for rec in self.records:
+                line: Dict[str, Any] = {"run_id": self.run_id, "ts": ts, **context, **asdict(rec)}
+                fh.write(json.dumps(line, ensure_ascii=False, default=str) + "\n")
+            total = {"run_id": self.run_id, "ts": ts, **context, "section": "__total__", "wall_ms": round(self.total_ms(), 2)}
+            fh.write(json.dumps(total, ensure_ascii=False, default=str) + "\n")
+
+
+def load_log(path: str) -> pd.DataFrame:
+    """Read a profile log back for offline analysis."""
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    return pd.read_json(path, lines=True)
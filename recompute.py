@@ -0,0 +1,254 @@
+"""
+Dependency-tracked recompute graph for the Streamlit script
+Streamlit 脚本的增量重算图
+
+Streamlit re-executes app.py top to bottom on every widget change. Derived
+artifacts are declared as nodes with the inputs and upstream nodes they
+depend on; each rerun opens an Evaluation with the current input values and
+a node is only recomputed when its token (a hash of its input fingerprints
+and upstream tokens) differs from a cached version.
+
+The graph is shared by every session, so cached versions are bounded twice:
+at most max_versions per node, and at most max_bytes in total (estimated with
+value_nbytes), evicting the least recently used version across all nodes.
+
+    @GRAPH.node("summary", inputs=["dataset"])
+    def node_summary(dataset):
+        return summarize(dataset)
+
+    run = GRAPH.evaluation(dataset=Input(df, dataset_key))
+    summary = run["summary"]
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass(frozen=True)
+class Input:
+    """An input value with an explicit fingerprint (for unhashable values such as DataFrames)."""
+
+    value: Any
+    fingerprint: Hashable
+
+
+@dataclass
+class NodeStats:
+    calls: int = 0
+    recomputes: int = 0
+    total_ms: float = 0.0
+    last_ms: float = 0.0
+
+
+@dataclass
+class _Node:
+    name: str
+    fn: Callable[..., Any]
+    inputs: Tuple[str, ...]
+    deps: Tuple[str, ...]
+
+
+@dataclass
+class RunRecord:
+    node: str
+    recomputed: bool
+    ms: float
+
+
+def value_nbytes(value: Any, _seen: Optional[Set[int]] = None, _depth: int = 0) -> int:
+    """Rough in-memory size of a node value; memmapped arrays count as free."""
+    seen = _seen if _seen is not None else set()
+    if id(value) in seen or _depth > 4:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum() if isinstance(usage, pd.Series) else usage)
+    if isinstance(value, np.ndarray):
+        if isinstance(value, np.memmap) or isinstance(value.base, np.memmap):
+            return 0
+        if value.dtype == object:
+            return int(value.nbytes) + sum(value_nbytes(v, seen, _depth + 1) for v in value.flat)
+        return int(value.nbytes)
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sum(value_nbytes(v, seen, _depth + 1) for v in value)
+    if isinstance(value, dict):
+        return sum(value_nbytes(v, seen, _depth + 1) for v in value.values())
+    if hasattr(value, "__dict__"):
+        # Dataclass results (SpectraMatrix, FrameStats, GroupCube, ...) hold their arrays as attributes.
+        return sum(value_nbytes(v, seen, _depth + 1) for v in vars(value).values())
+    return 0
+
+
+class ComputeGraph:
+    def __init__(self, max_versions: int = 4, max_bytes: int = 512 * 1024 * 1024):
+        self.max_versions = max_versions
+        self.max_bytes = max_bytes
+        self._nodes: Dict[str, _Node] = {}
+        self._cache: Dict[str, "OrderedDict[str, Any]"] = {}
+        self._sizes: "OrderedDict[Tuple[str, str], int]" = OrderedDict()  # LRU across all nodes
+        self._nbytes = 0
+        self._stats: Dict[str, NodeStats] = {}
+        self._lock = threading.Lock()
+
+    def node(self, name: str, inputs: Sequence[str] = (), deps: Sequence[str] = ()):
+        """Register fn(**inputs, **deps) as node `name` (re-registering replaces it)."""
+
+        def register(fn: Callable[..., Any]) -> Callable[..., Any]:
+            self._nodes[name] = _Node(name, fn, tuple(inputs), tuple(deps))
+            return fn
+
+        return register
+
+    def evaluation(self, **inputs: Any) -> "Evaluation":
+        return Evaluation(self, inputs)
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        with self._lock:
+            if name is None:
+                self._cache.clear()
+                self._sizes.clear()
+                self._nbytes = 0
+            else:
+                for token in self._cache.pop(name, {}):
+                    self._nbytes -= self._sizes.pop((name, token))
+
+    def nbytes(self) -> int:
+        """Estimated size of every cached version."""
+        with self._lock:
+            return self._nbytes
+
+    def stats(self) -> Dict[str, NodeStats]:
+        with self._lock:
+            return {k: NodeStats(**vars(v)) for k, v in self._stats.items()}
+
+    def _lookup(self, name: str, token: str) -> Tuple[bool, Any]:
+        with self._lock:
+            versions = self._cache.get(name)
+            if versions is not None and token in versions:
+                versions.move_to_end(token)
+                self._sizes.move_to_end((name, token))
+                return True, versions[token]
+        return False, None
+
+    def _store(self, name: str, token: str, value: Any, ms: float, recomputed: bool) -> None:
+        size = value_nbytes(value) if recomputed else 0
+        with self._lock:
+            stats = self._stats.setdefault(name, NodeStats())
+            stats.calls += 1
+            if not recomputed:
+                return
+            stats.recomputes += 1
+            stats.total_ms += ms
+            stats.last_ms = ms
+            versions = self._cache.setdefault(name, OrderedDict())
+            if token in versions:
+                del versions[token]
+                self._nbytes -= self._sizes.pop((name, token))
+            if size > self.max_bytes:
+                return  # too large to keep for other reruns; this evaluation still holds it
+            versions[token] = value
+            self._sizes[(name, token)] = size
+            self._nbytes += size
+            while len(versions) > self.max_versions:
+                stale, _ = versions.popitem(last=False)
+                self._nbytes -= self._sizes.pop((name, stale))
+            while self._nbytes > self.max_bytes:
+                (stale_name, stale), stale_size = self._sizes.popitem(last=False)
+                del self._cache[stale_name][stale]
+                self._nbytes -= stale_size
+
+
+def _fingerprint(value: Any) -> str:
+    if isinstance(value, Input):
+        return repr(value.fingerprint)
+    if isinstance(value, list):
+        value = tuple(value)
+    hash(value)  # unhashable inputs must be wrapped in Input(value, fingerprint)
+    return repr(value)
+
+
+class Evaluation:
+    """One rerun's view of the graph: fixed inputs, per-node tokens memoized."""
+
+    def __init__(self, graph: ComputeGraph, inputs: Dict[str, Any]):
+        self.graph = graph
+        self.inputs = inputs
+        self._tokens: Dict[str, str] = {}
+        self._values: Dict[str, Any] = {}
+        self.records: List[RunRecord] = []
+
+    def bind(self, **inputs: Any) -> None:
+        """Add inputs that only become known later in the script (e.g. widget values)."""
+        for name, value in inputs.items():
+            if name in self.inputs and _fingerprint(self.inputs[name]) != _fingerprint(value):
+                raise ValueError(f"input '{name}' is already bound to a different value")
+            self.inputs[name] = value
+
+    def _fingerprint(self, name: str) -> str:
+        if name not in self.inputs:
+            raise KeyError(f"missing input '{name}'")
+        return _fingerprint(self.inputs[name])
+
+    def _input_value(self, name: str) -> Any:
+        value = self.inputs[name]
+        return value.value if isinstance(value, Input) else value
+
+    def token(self, name: str) -> str:
+        if name not in self._tokens:
+            node = self.graph._nodes[name]
+            digest = hashlib.blake2b(name.encode("utf-8"), digest_size=16)
+            for inp in node.inputs:
+                digest.update(f"|{inp}={self._fingerprint(inp)}".encode("utf-8"))
+            for dep in node.deps:
+                digest.update(f"|{dep}@{self.token(dep)}".encode("utf-8"))
+            self._tokens[name] = digest.hexdigest()
+        return self._tokens[name]
+
+    def __getitem__(self, name: str) -> Any:
+        if name in self._values:
+            return self._values[name]
+        node = self.graph._nodes[name]
+        token = self.token(name)
+        hit, value = self.graph._lookup(name, token)
+        if hit:
+            self.graph._store(name, token, value, 0.0, recomputed=False)
+            self.records.append(RunRecord(name, False, 0.0))
+        else:
+            kwargs = {inp: self._input_value(inp) for inp in node.inputs}
+            kwargs.update({dep: self[dep] for dep in node.deps})
+            start = time.perf_counter()
+            value = node.fn(**kwargs)
+            ms = (time.perf_counter() - start) * 1000
+            self.graph._store(name, token, value, ms, recomputed=True)
+            self.records.append(RunRecord(name, True, ms))
+        self._values[name] = value
+        return value
+
+    def timings(self) -> pd.DataFrame:
+        stats = self.graph.stats()
+        rows = []
+        for rec in self.records:
+            s = stats.get(rec.node, NodeStats())
+            rows.append(
+                {
+                    "节点": rec.node,
+                    "本次": "重算" if rec.recomputed else "缓存",
+                    "本次耗时(ms)": round(rec.ms, 2),
+                    "累计重算次数": s.recomputes,
+                    "上次重算耗时(ms)": round(s.last_ms, 2),
+                }
+            )
+        return pd.DataFrame(rows, columns=["节点", "本次", "本次耗时(ms)", "累计重算次数", "上次重算耗时(ms)"])
+
+
+GRAPH = ComputeGraph()
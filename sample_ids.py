@@ -0,0 +1,93 @@
+"""
+Shared sample-ID parser
+样本编号解析
+
+Sample IDs look like LB0, LD1, SS2-3 or "SR 2-1": a letter prefix (fibre /
+treatment family), a series number (0 is the untreated control) and an
+optional replicate. Whitespace inside an ID is ignored, so "SR 2-1" and
+"SR2-1" are the same sample.
+
+    keys = parse_sample_ids(df["Sample"])
+    keys["sample"]      category  canonical ID (SR2-1); other IDs kept as-is
+    keys["prefix"]      category  LB / LD / SS / SR, <NA> when the ID does not parse
+    keys["series"]      Int16     <NA> when absent
+    keys["replicate"]   Int16     <NA> when absent
+    keys["is_control"]  bool      series == 0
+
+IDs are factorized first and only the distinct ones never seen before are
+parsed (one vectorized str.extract); results are memoized per process, so
+the app, its reruns and the report scripts all pay once per distinct ID.
+"""
+
+import threading
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+SAMPLE_ID_PATTERN = r"^([A-Za-z]+)(\d+)(?:-(\d+))?$"
+KEY_COLUMNS = ["sample", "prefix", "series", "replicate", "is_control"]
+
+_Parsed = Tuple[str, str, Optional[int], Optional[int]]
+_PARSED: Dict[str, _Parsed] = {}
+_PARSED_LOCK = threading.Lock()
+
+
+def normalize_ids(ids: pd.Series) -> pd.Series:
+    return ids.astype(str).str.replace(r"\s+", "", regex=True)
+
+
+def _parse_new(names: Sequence[str]) -> Dict[str, _Parsed]:
+    raw = pd.Series(list(names), dtype=object)
+    norm = normalize_ids(raw)
+    parts = norm.str.extract(SAMPLE_ID_PATTERN)
+    matched = parts[0].notna().to_numpy()
+    prefix = parts[0].str.upper().to_numpy(dtype=object)
+    series = pd.to_numeric(parts[1]).to_numpy()
+    replicate = pd.to_numeric(parts[2]).to_numpy()
+    out: Dict[str, _Parsed] = {}
+    for i, name in enumerate(raw):
+        s = None if np.isnan(series[i]) else int(series[i])
+        r = None if np.isnan(replicate[i]) else int(replicate[i])
+        if matched[i]:
+            out[name] = (f"{prefix[i]}{s}" + ("" if r is None else f"-{r}"), prefix[i], s, r)
+        else:
+            out[name] = (name.strip(), None, None, None)
+    return out
+
+
+def _categorical(per_unique: Sequence[str], take: np.ndarray) -> pd.Categorical:
+    # Categories come from the distinct IDs only; rows just pick codes.
+    level_codes, categories = pd.factorize(pd.Series(list(per_unique), dtype=object), sort=True)
+    level_codes = np.append(level_codes, -1)
+    return pd.Categorical.from_codes(level_codes[take], categories=categories)
+
+
+def parse_sample_ids(ids) -> pd.DataFrame:
+    """KEY_COLUMNS for every entry of ids, aligned with its index; NaN IDs give NA keys."""
+    ids = ids if isinstance(ids, pd.Series) else pd.Series(list(ids), dtype=object)
+    codes, uniques = pd.factorize(ids)
+    names = [str(u) for u in uniques]
+    with _PARSED_LOCK:
+        missing = [n for n in names if n not in _PARSED]
+    if missing:
+        parsed = _parse_new(missing)
+        with _PARSED_LOCK:
+            _PARSED.update(parsed)
+    with _PARSED_LOCK:
+        rows = [_PARSED[n] for n in names]
+
+    series = pd.array([r[2] for r in rows] + [None], dtype="Int16")
+    replicate = pd.array([r[3] for r in rows] + [None], dtype="Int16")
+    take = np.where(codes >= 0, codes, len(rows))  # the trailing slot holds the NA keys
+    series_col = series[take]
+    return pd.DataFrame(
+        {
+            "sample": _categorical([r[0] for r in rows], take),
+            "prefix": _categorical([r[1] for r in rows], take),
+            "series": series_col,
+            "replicate": replicate[take],
+            "is_control": (series_col == 0).fillna(False).to_numpy(dtype=bool),
+        },
+        index=ids.index,
+    )
@@ -0,0 +1,160 @@
+"""
+Sample.xlsx metadata
+样本信息表（Sample.xlsx）解析与缓存
+
+Sample.xlsx holds three things in one free-form sheet:
+
+    - the experiment description (header of the second column)
+    - a code table: LB1 | Blade ball machine long fiber | LB1-1 ... LB1-5
+    - a parameter grid under 字母部分 / 数字部分 / Time / Liquid-to-solid
+      ratios / Alkali concentration / Temperature, one row per series-
+      replicate code ("0", "1-1" ... "4-5"); a blank cell repeats the value
+      above it
+
+load_sample_metadata() turns that into a SampleMetadata with a prefix ->
+description map and a numeric treatment table keyed by (series, replicate).
+Results are cached per path and re-read only when the file's size or mtime
+changes. SampleMetadata.join() attaches the treatment columns to any table
+with a sample-ID column through one indexed lookup on the parsed IDs.
+"""
+
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from sample_ids import parse_sample_ids
+
+SAMPLE_FILE = "Sample.xlsx"
+SEARCH_DIRS = ("", os.path.join("数据整理归档", "data"))
+PARAM_COLUMNS = {
+    "time": "时间(min)",
+    "liquid-to-solid ratios": "液固比(g/100ml)",
+    "alkali concentration": "NaOH(g/L)",
+    "temperature": "温度(°C)",
+}
+PROCESS_VARIABLES = list(PARAM_COLUMNS.values())
+
+
+@dataclass
+class SampleMetadata:
+    path: Optional[str] = None
+    experiment_text: str = ""
+    prefix_desc: Dict[str, str] = field(default_factory=dict)
+    params: pd.DataFrame = field(default_factory=lambda: pd.DataFrame(columns=["series", "replicate"] + PROCESS_VARIABLES))
+
+    def __bool__(self) -> bool:
+        return self.path is not None
+
+    def join(self, df: pd.DataFrame, sample_col: object) -> pd.DataFrame:
+        """df plus 样本前缀描述 and the process-variable columns, matched on the parsed ID."""
+        keys = parse_sample_ids(df[sample_col])
+        right = self.params.set_index(["series", "replicate"])
+        index = pd.MultiIndex.from_arrays([keys["series"], keys["replicate"]])
+        values = right.reindex(index)
+        out = df.copy()
+        out["样本前缀描述"] = keys["prefix"].astype(object).map(self.prefix_desc)
+        for col in PROCESS_VARIABLES:
+            out[col] = values[col].to_numpy() if col in values else np.nan
+        return out
+
+
+_META_CACHE: Dict[str, Tuple[Tuple[int, int], SampleMetadata]] = {}
+_META_LOCK = threading.Lock()
+
+
+def find_data_file(base_dir: str, name: str) -> Optional[str]:
+    for sub in SEARCH_DIRS:
+        path = os.path.join(base_dir, sub, name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def find_sample_file(base_dir: str) -> Optional[str]:
+    return find_data_file(base_dir, SAMPLE_FILE)
+
+
+def _clean(values: pd.Series) -> pd.Series:
+    return values.astype(str).str.replace("\xa0", " ").str.strip()
+
+
+def _first_number(values: pd.Series) -> np.ndarray:
+    """'60 min' -> 60, '2g/100ml' -> 2, 'pure water' -> 0; blanks stay NaN."""
+    text = _clean(values).where(values.notna())
+    number = pd.to_numeric(text.str.extract(r"(-?\d+(?:\.\d+)?)", expand=False), errors="coerce")
+    number = number.where(~text.str.lower().str.contains("water", na=False), 0.0)
+    return number.to_numpy(dtype=np.float64)
+
+
+def _parse_params(raw: pd.DataFrame) -> pd.DataFrame:
+    cells = raw.apply(lambda col: _clean(col).str.lower().where(col.notna()))
+    found = cells.isin(PARAM_COLUMNS.keys()).to_numpy()
+    per_row = found.sum(axis=1)
+    if per_row.max(initial=0) < 2:
+        return SampleMetadata().params
+    # The code table above repeats single names as row labels; the grid header has them all.
+    header_row = int(np.argmax(per_row))
+    header = cells.iloc[header_row]
+    body = raw.iloc[header_row + 1 :]
+    code_col = int(np.flatnonzero(found[header_row]).min()) - 1  # 数字部分 sits just left of Time
+    codes = _clean(body.iloc[:, code_col]).where(body.iloc[:, code_col].notna())
+    valid = codes.str.fullmatch(r"\d+(?:-\d+)?", na=False).to_numpy()
+    body, codes = body[valid], codes[valid]
+    parts = codes.str.extract(r"^(\d+)(?:-(\d+))?$")
+    out = pd.DataFrame(
+        {
+            "series": pd.array(pd.to_numeric(parts[0]), dtype="Int16"),
+            "replicate": pd.array(pd.to_numeric(parts[1]), dtype="Int16"),
+        }
+    )
+    for pos, name in header.items():
+        if name in PARAM_COLUMNS:
+            # A blank cell means "same as the row above" in this sheet.
+            out[PARAM_COLUMNS[name]] = pd.Series(_first_number(body[pos])).ffill().to_numpy(dtype=np.float32)
+    for col in PROCESS_VARIABLES:
+        if col not in out:
+            out[col] = np.float32(np.nan)
+    return out[["series", "replicate"] + PROCESS_VARIABLES]
+
+
+def _parse_prefixes(raw: pd.DataFrame) -> Dict[str, str]:
+    if raw.shape[1] < 3:
+        return {}
+    codes = _clean(raw.iloc[:, 1]).where(raw.iloc[:, 1].notna())
+    desc = _clean(raw.iloc[:, 2]).where(raw.iloc[:, 2].notna())
+    prefix = codes.str.extract(r"^([A-Za-z]{2})\d+", expand=False).str.upper()
+    table = pd.DataFrame({"prefix": prefix, "desc": desc}).dropna()
+    table = table[table["desc"] != ""].drop_duplicates("prefix")
+    return dict(zip(table["prefix"], table["desc"]))
+
+
+def parse_sample_file(path: str) -> SampleMetadata:
+    raw = pd.read_excel(path, sheet_name=0, header=None)
+    text = raw.iloc[0, 1] if raw.shape[0] and raw.shape[1] > 1 else None
+    return SampleMetadata(
+        path=path,
+        experiment_text="" if pd.isna(text) else str(text),
+        prefix_desc=_parse_prefixes(raw),
+        params=_parse_params(raw),
+    )
+
+
+def load_sample_metadata(base_dir: str) -> SampleMetadata:
+    """Cached SampleMetadata for the Sample.xlsx found under base_dir (empty if none)."""
+    path = find_sample_file(base_dir)
+    if path is None:
+        return SampleMetadata()
+    st = os.stat(path)
+    stamp = (st.st_size, st.st_mtime_ns)
+    with _META_LOCK:
+        hit = _META_CACHE.get(path)
+    if hit is not None and hit[0] == stamp:
+        return hit[1]
+    meta = parse_sample_file(path)
+    with _META_LOCK:
+        _META_CACHE[path] = (stamp, meta)
+    return meta
@@ -0,0 +1,109 @@
+"""
+Row sampling for charts
+图表抽样
+
+Reservoir keeps a uniform fixed-size sample of a stream of DataFrame chunks
+in one pass: every row gets a random key and the rows with the k smallest
+keys are kept (bottom-k sampling, equivalent to Algorithm R). Kept rows are
+returned in their original order, indexed by their global row number.
+
+stratified_sample draws from an in-memory frame per group of one column:
+each group first gets min(size, min_per_stratum) rows, the rest of the
+budget is shared in proportion to group size. Small groups (control
+samples, rare categories) therefore always make it into the charts.
+"""
+
+from typing import Hashable, Optional
+
+import numpy as np
+import pandas as pd
+
+
+class Reservoir:
+    def __init__(self, size: int, seed: int = 42):
+        self.size = int(size)
+        self.seen = 0
+        self._rng = np.random.default_rng(seed)
+        self._rows: Optional[pd.DataFrame] = None
+        self._keys = np.empty(0)
+        self._positions = np.empty(0, dtype=np.int64)
+
+    def update(self, chunk: pd.DataFrame) -> None:
+        n = len(chunk)
+        if n == 0:
+            return
+        keys = self._rng.random(n)
+        positions = np.arange(self.seen, self.seen + n, dtype=np.int64)
+        self.seen += n
+        if len(self._keys) >= self.size:
+            # Only rows that beat the current k-th key can enter.
+            take = keys < self._keys.max()
+            chunk, keys, positions = chunk[take], keys[take], positions[take]
+            if len(keys) == 0:
+                return
+        rows = chunk if self._rows is None else pd.concat([self._rows, chunk], ignore_index=True)
+        keys = np.concatenate([self._keys, keys])
+        positions = np.concatenate([self._positions, positions])
+        if len(keys) > self.size:
+            keep = np.sort(np.argpartition(keys, self.size - 1)[: self.size])
+            rows, keys, positions = rows.iloc[keep], keys[keep], positions[keep]
+        self._rows = rows.reset_index(drop=True)
+        self._keys, self._positions = keys, positions
+
+    @property
+    def frame(self) -> pd.DataFrame:
+        if self._rows is None:
+            return pd.DataFrame()
+        order = np.argsort(self._positions, kind="stable")
+        out = self._rows.iloc[order]
+        out.index = pd.Index(self._positions[order], name=None)
+        return out
+
+
+def uniform_sample(df: pd.DataFrame, size: int, seed: int = 42) -> pd.DataFrame:
+    if len(df) <= size:
+        return df
+    return df.sample(n=int(size), random_state=seed)
+
+
+def allocate(counts: np.ndarray, size: int, min_per_stratum: int) -> np.ndarray:
+    """Rows to draw per stratum: a floor for every group, the rest proportional."""
+    counts = np.asarray(counts, dtype=np.int64)
+    alloc = np.minimum(counts, min_per_stratum)
+    spare = int(size) - int(alloc.sum())
+    room = counts - alloc
+    if spare <= 0 or room.sum() == 0:
+        # The floors alone use up the budget; keep them so no group is lost.
+        return alloc
+    share = spare * room / room.sum()
+    extra = np.minimum(np.floor(share).astype(np.int64), room)
+    left = min(spare - int(extra.sum()), int((room - extra).sum()))
+    if left > 0:
+        # Largest remainders first, only where there are rows left to take.
+        frac = np.where(room > extra, share - np.floor(share), -1.0)
+        extra[np.argsort(-frac, kind="stable")[:left]] += 1
+    return alloc + extra
+
+
+def stratified_sample(df: pd.DataFrame, size: int, by: Hashable, min_per_stratum: int = 50,
+                      seed: int = 42) -> pd.DataFrame:
+    """Sample about `size` rows keeping every group of df[by]; NaN is its own group."""
+    if len(df) <= size:
+        return df
+    codes, _ = pd.factorize(df[by], use_na_sentinel=False)
+    counts = np.bincount(codes)
+    alloc = allocate(counts, size, min_per_stratum)
+    rng = np.random.default_rng(seed)
+    # Shuffle within each group, then take the first alloc[g] rows of group g.
+    order = np.lexsort((rng.random(len(df)), codes))
+    sorted_codes = codes[order]
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    rank = np.arange(len(df)) - starts[sorted_codes]
+    keep = np.sort(order[rank < alloc[sorted_codes]])
+    return df.iloc[keep]
+
+
+def sample_frame(df: pd.DataFrame, size: int, by: Optional[Hashable] = None, seed: int = 42) -> pd.DataFrame:
+    if by is None or by not in df.columns:
+        return uniform_sample(df, size, seed)
+    return stratified_sample(df, size, by, seed=seed)
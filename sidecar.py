@@ -0,0 +1,380 @@
+"""
+Columnar binary sidecars for the Excel workbooks
+Excel 工作簿的列式二进制旁路文件
+
+Each workbook is converted once into a sidecar directory next to it:
+
+    data/.sidecar/FTIR.xlsx/<options-key>/
+        manifest.json            source fingerprint, column labels and dtypes
+        numeric-<token>.npy      all numeric columns as one C-contiguous float64 matrix
+                                 (for FTIR: samples x wavenumbers)
+        objects-<token>.parquet  text / mixed / datetime columns (e.g. sample IDs)
+
+Data files are never rewritten in place: a rebuild writes files under a new
+token and then atomically replaces manifest.json, so a reader that already
+holds a manifest still finds the files it names (the previous version is
+kept until the next rebuild).
+
+Loaders call read_table() instead of pd.read_excel(); it returns the same
+DataFrame and only falls back to openpyxl when the sidecar is missing or stale.
+Uploaded workbooks are only written to disk (read_bytes) when the
+APP_PERSIST_UPLOADS setting is on.
+
+Usage:
+    python sidecar.py ingest [path ...] [--header N] [--force]
+"""
+
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import sys
+import uuid
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+SIDECAR_VERSION = 2
+SIDECAR_DIRNAME = ".sidecar"
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "数据整理归档", "data")
+UPLOAD_ROOT = os.path.join(BASE_DIR, SIDECAR_DIRNAME, "uploads")
+PERSIST_UPLOADS_ENV = "APP_PERSIST_UPLOADS"
+EXCEL_SUFFIXES = (".xlsx", ".xls")
+
+
+def options_key(options: Dict[str, Hashable]) -> str:
+    text = json.dumps(options, sort_keys=True, default=str)
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_fingerprint(path: str) -> Dict[str, object]:
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": file_sha256(path)}
+
+
+def sidecar_dir(path: str, options: Dict[str, Hashable]) -> str:
+    folder, name = os.path.split(os.path.abspath(path))
+    return os.path.join(folder, SIDECAR_DIRNAME, name, options_key(options))
+
+
+# ------------------------------------------------------------------------------------
+# Encoding
+# ------------------------------------------------------------------------------------
+
+
+def _label_to_json(label) -> Dict[str, object]:
+    if isinstance(label, (bool, np.bool_)):
+        return {"v": str(label), "t": "str"}
+    if isinstance(label, (int, np.integer)):
+        return {"v": int(label), "t": "int"}
+    if isinstance(label, (float, np.floating)):
+        return {"v": float(label), "t": "float"}
+    return {"v": str(label), "t": "str"}
+
+
+def _label_from_json(item: Dict[str, object]):
+    if item["t"] == "int":
+        return int(item["v"])
+    if item["t"] == "float":
+        return float(item["v"])
+    return item["v"]
+
+
+def _column_kind(series: pd.Series) -> str:
+    dtype = series.dtype
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_datetime64_any_dtype(dtype):
+        return "native"
+    if pd.api.types.is_numeric_dtype(dtype) and not isinstance(dtype, pd.CategoricalDtype):
+        return "numeric"
+    return "object"
+
+
+def _split_object(values: np.ndarray) -> Tuple[List[Optional[str]], np.ndarray]:
+    # Excel columns mix text cells and numbers (e.g. the sample-name row on top of
+    # ultrasonic signal values); keep both halves so the round trip is lossless.
+    strs: List[Optional[str]] = []
+    nums = np.full(len(values), np.nan)
+    for i, v in enumerate(values):
+        if isinstance(v, str):
+            strs.append(v)
+        else:
+            strs.append(None)
+            if v is not None and not (isinstance(v, float) and np.isnan(v)):
+                try:
+                    nums[i] = float(v)
+                except (TypeError, ValueError):
+                    strs[i] = str(v)
+    return strs, nums
+
+
+def write_frame(target: str, df: pd.DataFrame, source: Optional[Dict[str, object]] = None,
+                options: Optional[Dict[str, Hashable]] = None) -> None:
+    os.makedirs(target, exist_ok=True)
+    previous = read_manifest(target)
+    token = uuid.uuid4().hex[:12]
+    written: List[str] = []
+    try:
+        columns = []
+        numeric_pos: List[int] = []
+        obj_data: Dict[str, object] = {}
+        for pos in range(df.shape[1]):
+            series = df.iloc[:, pos]
+            kind = _column_kind(series)
+            entry = {"label": _label_to_json(df.columns[pos]), "kind": kind, "dtype": str(series.dtype)}
+            if kind == "numeric":
+                entry["slot"] = len(numeric_pos)
+                numeric_pos.append(pos)
+            elif kind == "native":
+                obj_data[f"c{pos}"] = series.to_numpy()
+            else:
+                strs, nums = _split_object(series.to_numpy(dtype=object))
+                obj_data[f"c{pos}__str"] = pd.array(strs, dtype="string")
+                if not np.isnan(nums).all():
+                    obj_data[f"c{pos}__num"] = nums
+                    entry["mixed"] = True
+            columns.append(entry)
+
+        files: Dict[str, Optional[str]] = {"numeric": None, "objects": None}
+        if numeric_pos:
+            files["numeric"] = f"numeric-{token}.npy"
+            written.append(files["numeric"])
+            block = np.ascontiguousarray(df.iloc[:, numeric_pos].to_numpy(dtype=np.float64))
+            np.save(os.path.join(target, files["numeric"]), block)
+        if obj_data:
+            files["objects"] = f"objects-{token}.parquet"
+            written.append(files["objects"])
+            pd.DataFrame(obj_data).to_parquet(os.path.join(target, files["objects"]), index=False)
+
+        manifest = {
+            "version": SIDECAR_VERSION,
+            "rows": int(len(df)),
+            "columns": columns,
+            "files": files,
+            "source": source,
+            "options": options or {},
+        }
+        tmp = os.path.join(target, f".manifest-{token}.json")
+        written.append(os.path.basename(tmp))
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(manifest, fh, ensure_ascii=False)
+        os.replace(tmp, os.path.join(target, "manifest.json"))
+    except BaseException:
+        for name in written:
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(target, name))
+        raise
+    _remove_stale_files(target, [manifest, previous, read_manifest(target)])
+
+
+def _remove_stale_files(target: str, keep: List[Optional[Dict[str, object]]]) -> None:
+    """Drop data files no kept manifest names (the new, the previous and whatever is current now)."""
+    names = {"manifest.json"}
+    for manifest in keep:
+        if manifest:
+            names.update(name for name in manifest.get("files", {}).values() if name)
+            if manifest.get("files", {}).get("numeric"):
+                names.add(f"sorted-{manifest['files']['numeric']}")  # spectra.from_sidecar copy
+    for name in os.listdir(target):
+        if name not in names and not name.startswith(".manifest-") and ".tmp-" not in name:
+            path = os.path.join(target, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+
+
+def read_manifest(target: str) -> Optional[Dict[str, object]]:
+    path = os.path.join(target, "manifest.json")
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding="utf-8") as fh:
+            manifest = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != SIDECAR_VERSION:
+        return None
+    return manifest
+
+
+def load_numeric(target: str, manifest: Optional[Dict[str, object]] = None,
+                 mmap: bool = False) -> Optional[np.ndarray]:
+    manifest = manifest or read_manifest(target)
+    name = manifest["files"].get("numeric") if manifest else None
+    if not name:
+        return None
+    return np.load(os.path.join(target, name), mmap_mode="r" if mmap else None)
+
+
+def read_frame(target: str, manifest: Optional[Dict[str, object]] = None) -> pd.DataFrame:
+    manifest = manifest or read_manifest(target)
+    if manifest is None:
+        raise FileNotFoundError(target)
+    block = load_numeric(target, manifest)
+    obj_name = manifest["files"].get("objects")
+    objects = pd.read_parquet(os.path.join(target, obj_name)) if obj_name else None
+
+    labels = [_label_from_json(c["label"]) for c in manifest["columns"]]
+    kinds = [c["kind"] for c in manifest["columns"]]
+    lead = 0 if kinds and kinds[0] == "numeric" else 1
+    wide = block is not None and all(k == "numeric" for k in kinds[lead:]) and all(
+        c["dtype"] == "float64" for c in manifest["columns"] if c["kind"] == "numeric"
+    )
+
+    data: Dict[int, object] = {}
+    for pos, col in enumerate(manifest["columns"]):
+        if col["kind"] == "numeric":
+            if not wide:
+                data[pos] = block[:, col["slot"]].astype(col["dtype"], copy=False)
+        elif col["kind"] == "native":
+            data[pos] = objects[f"c{pos}"].to_numpy()
+        else:
+            strs = objects[f"c{pos}__str"].to_numpy(dtype=object, na_value=np.nan)
+            if col.get("mixed"):
+                nums = objects[f"c{pos}__num"].to_numpy()
+                strs = np.where(pd.isna(strs), nums, strs).astype(object)
+            data[pos] = strs
+
+    if wide:
+        # Wide spectral layout (ID column + float matrix): keep the matrix as one block.
+        num_df = pd.DataFrame(block, columns=labels[lead:], copy=False)
+        if lead == 0:
+            return num_df
+        return pd.concat([pd.DataFrame({labels[0]: data[0]}), num_df], axis=1)
+
+    df = pd.DataFrame({pos: data[pos] for pos in range(len(labels))})
+    df.columns = labels
+    return df
+
+
+# ------------------------------------------------------------------------------------
+# Loaders
+# ------------------------------------------------------------------------------------
+
+
+def is_fresh(path: str, manifest: Optional[Dict[str, object]]) -> bool:
+    if manifest is None or not manifest.get("source"):
+        return False
+    source = manifest["source"]
+    st = os.stat(path)
+    if st.st_size != source.get("size"):
+        return False
+    if st.st_mtime_ns == source.get("mtime_ns"):
+        return True
+    # Touched but possibly unchanged (copied, re-saved without edits): compare content.
+    return file_sha256(path) == source.get("sha256")
+
+
+def ingest(path: str, force: bool = False, **read_kwargs) -> Tuple[str, bool]:
+    """Convert one workbook into its sidecar; returns (sidecar dir, rebuilt)."""
+    target = sidecar_dir(path, read_kwargs)
+    if not force and is_fresh(path, read_manifest(target)):
+        return target, False
+    source = file_fingerprint(path)
+    df = pd.read_excel(path, **read_kwargs)
+    write_frame(target, df, source=source, options=read_kwargs)
+    return target, True
+
+
+def read_table(path: str, **read_kwargs) -> pd.DataFrame:
+    """Drop-in for pd.read_excel(path, ...) that prefers a fresh sidecar."""
+    if not str(path).lower().endswith(EXCEL_SUFFIXES):
+        return pd.read_excel(path, **read_kwargs)
+    target = sidecar_dir(path, read_kwargs)
+    manifest = read_manifest(target)
+    if is_fresh(path, manifest):
+        try:
+            return read_frame(target, manifest)
+        except OSError:
+            pass  # superseded by two rebuilds since the manifest was read: parse again
+    source = file_fingerprint(path)
+    df = pd.read_excel(path, **read_kwargs)
+    try:
+        write_frame(target, df, source=source, options=read_kwargs)
+    except OSError:
+        pass  # read-only data directory: still return the parsed frame
+    return df
+
+
+def persist_uploads_enabled() -> bool:
+    """Uploads stay in memory unless APP_PERSIST_UPLOADS opts into the on-disk cache."""
+    return os.environ.get(PERSIST_UPLOADS_ENV, "").strip().lower() in {"1", "true", "yes", "on"}
+
+
+def read_bytes(data: bytes, options: Tuple[Hashable, ...], parser: Callable[[], pd.DataFrame],
+               root: str = UPLOAD_ROOT, max_entries: int = 32) -> pd.DataFrame:
+    """Content-addressed sidecar for uploaded workbooks (no source path to check).
+
+    Writes under root on every new upload; callers gate it on persist_uploads_enabled().
+    """
+    key = hashlib.blake2b(data, digest_size=20)
+    key.update(repr(options).encode("utf-8"))
+    target = os.path.join(root, key.hexdigest())
+    manifest = read_manifest(target)
+    if manifest is not None:
+        try:
+            os.utime(target)
+            return read_frame(target, manifest)
+        except OSError:
+            pass
+    df = parser()
+    try:
+        write_frame(target, df, source={"size": len(data)}, options={"upload": list(options)})
+        prune(root, max_entries)
+    except OSError:
+        pass
+    return df
+
+
+def prune(root: str, max_entries: int) -> None:
+    if not os.path.isdir(root):
+        return
+    entries = [os.path.join(root, d) for d in os.listdir(root) if not d.startswith(".")]
+    entries.sort(key=lambda d: os.stat(d).st_mtime, reverse=True)
+    for stale in entries[max_entries:]:
+        shutil.rmtree(stale, ignore_errors=True)
+
+
+def find_workbooks(paths: List[str]) -> List[str]:
+    found: List[str] = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(EXCEL_SUFFIXES) and not name.startswith("~$"):
+                    found.append(os.path.join(path, name))
+        else:
+            found.append(path)
+    return found
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Convert Excel workbooks into columnar sidecars")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_ingest = sub.add_parser("ingest", help="build or refresh sidecars")
+    p_ingest.add_argument("paths", nargs="*", default=[DATA_DIR])
+    p_ingest.add_argument("--header", type=int, default=0)
+    p_ingest.add_argument("--force", action="store_true")
+    args = parser.parse_args(argv)
+
+    for path in find_workbooks(args.paths):
+        kwargs = {} if args.header == 0 else {"header": args.header}
+        target, rebuilt = ingest(path, force=args.force, **kwargs)
+        print(f"{'built ' if rebuilt else 'fresh '} {os.path.relpath(path)} -> {os.path.relpath(target)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
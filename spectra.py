@@ -0,0 +1,309 @@
+"""
+FTIR spectra matrix engine
+FTIR 光谱矩阵引擎
+
+A dataset in the wide FTIR layout (first column = sample name, remaining
+columns = wavenumbers) is converted once into a SpectraMatrix: a contiguous
+(n_samples x n_wavenumbers) float array with the wavenumber axis sorted high
+to low and a sample-ID -> row index, optionally backed by np.memmap.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+import weakref
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+MEMMAP_THRESHOLD_BYTES = 256 * 1024 * 1024
+MEMMAP_CHUNK_BYTES = 32 * 1024 * 1024
+MAX_SPILLED = 8
+
+
+def detect_ftir_structure(df: pd.DataFrame) -> Optional[Dict[str, object]]:
+    if df.shape[1] < 5:
+        return None
+    sample_col = df.columns[0]
+    w_cols: List[str] = []
+    w_values: List[float] = []
+    for col in df.columns[1:]:
+        try:
+            w_val = float(col)
+            w_cols.append(col)
+            w_values.append(w_val)
+        except (TypeError, ValueError):
+            if pd.api.types.is_numeric_dtype(df[col]):
+                w_cols.append(col)
+                w_values.append(float(len(w_values)))
+    if len(w_cols) < 20:
+        return None
+    order = np.argsort(w_values)[::-1]
+    ordered_cols = [w_cols[i] for i in order]
+    ordered_vals = [w_values[i] for i in order]
+    return {
+        "sample_col": sample_col,
+        "w_cols": ordered_cols,
+        "w_vals": ordered_vals,
+    }
+
+
+@dataclass
+class SpectraMatrix:
+    values: np.ndarray
+    wavenumbers: np.ndarray
+    sample_ids: np.ndarray
+    sample_col: str = "Sample"
+    _rows: Dict[str, np.ndarray] = field(default_factory=dict, repr=False)
+
+    def __post_init__(self) -> None:
+        if not self._rows:
+            ids, inverse = np.unique(self.sample_ids, return_inverse=True)
+            order = np.argsort(inverse, kind="stable")
+            splits = np.cumsum(np.bincount(inverse, minlength=len(ids)))[:-1]
+            self._rows = dict(zip(ids.tolist(), np.split(order, splits)))
+
+    @property
+    def n_samples(self) -> int:
+        return self.values.shape[0]
+
+    @property
+    def n_wavenumbers(self) -> int:
+        return self.values.shape[1]
+
+    @property
+    def is_memmap(self) -> bool:
+        return isinstance(self.values, np.memmap) or isinstance(getattr(self.values, "base", None), np.memmap)
+
+    def unique_samples(self) -> List[str]:
+        # First-appearance order, like df[sample_col].unique()
+        return list(dict.fromkeys(self.sample_ids.tolist()))
+
+    def positions(self, samples: Sequence[str]) -> np.ndarray:
+        """Row indices of every row whose ID is in samples, in dataset order."""
+        found = [self._rows[s] for s in dict.fromkeys(samples) if s in self._rows]
+        if not found:
+            return np.empty(0, dtype=np.intp)
+        return np.sort(np.concatenate(found))
+
+    def with_values(self, values: np.ndarray) -> "SpectraMatrix":
+        """Same samples and wavenumber axis, different intensities (e.g. preprocessed)."""
+        return SpectraMatrix(values, self.wavenumbers, self.sample_ids, self.sample_col, _rows=self._rows)
+
+    def row(self, sample: str) -> np.ndarray:
+        return np.asarray(self.values[self._rows[sample][0]])
+
+    def rows(self, samples: Sequence[str]) -> np.ndarray:
+        return np.asarray(self.values[self.positions(samples)])
+
+    def mean(self, samples: Sequence[str]) -> np.ndarray:
+        block = self.rows(samples)
+        return nanmean_rows(block)
+
+    def group_mean(self, keys: Sequence[object]) -> Tuple[List[object], np.ndarray]:
+        """NaN-aware mean spectrum per key (None/NaN keys dropped, keys sorted)."""
+        keys = pd.Series(list(keys), dtype=object)
+        valid = keys.notna().to_numpy()
+        if not valid.any():
+            return [], np.empty((0, self.n_wavenumbers))
+        codes, labels = pd.factorize(keys[valid], sort=True)
+        rows = np.flatnonzero(valid)
+        order = np.argsort(codes, kind="stable")
+        starts = np.r_[0, np.flatnonzero(np.diff(codes[order])) + 1]
+        block = np.asarray(self.values[rows[order]], dtype=np.float64)
+        finite = ~np.isnan(block)
+        sums = np.add.reduceat(np.where(finite, block, 0.0), starts, axis=0)
+        counts = np.add.reduceat(finite, starts, axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = sums / counts
+        means[counts == 0] = np.nan
+        return list(labels), means
+
+    # ---------------------------------------------------------------- construction
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, ftir: Dict[str, object], dtype=np.float64) -> "SpectraMatrix":
+        w_cols = ftir["w_cols"]
+        positions = df.columns.get_indexer(w_cols)
+        if (positions < 0).any():
+            values = df[w_cols].to_numpy(dtype=dtype)
+        else:
+            values = df.iloc[:, positions].to_numpy(dtype=dtype)
+        return cls(
+            values=np.ascontiguousarray(values),
+            wavenumbers=np.asarray(ftir["w_vals"], dtype=np.float64),
+            sample_ids=df[ftir["sample_col"]].astype(str).to_numpy(dtype=object),
+            sample_col=ftir["sample_col"],
+        )
+
+    def save(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "spectra.npy"), np.ascontiguousarray(self.values))
+        np.save(os.path.join(path, "wavenumbers.npy"), self.wavenumbers)
+        with open(os.path.join(path, "samples.json"), "w", encoding="utf-8") as fh:
+            json.dump({"sample_col": str(self.sample_col), "ids": self.sample_ids.tolist()}, fh, ensure_ascii=False)
+
+    @classmethod
+    def open(cls, path: str, mmap: bool = True) -> "SpectraMatrix":
+        values = np.load(os.path.join(path, "spectra.npy"), mmap_mode="r" if mmap else None)
+        wavenumbers = np.load(os.path.join(path, "wavenumbers.npy"))
+        with open(os.path.join(path, "samples.json"), encoding="utf-8") as fh:
+            meta = json.load(fh)
+        return cls(values, wavenumbers, np.asarray(meta["ids"], dtype=object), meta["sample_col"])
+
+    @classmethod
+    def from_sidecar(cls, target: str, mmap: bool = True) -> "SpectraMatrix":
+        """Map a workbook sidecar (see sidecar.py) without loading it into RAM."""
+        import sidecar
+
+        manifest = sidecar.read_manifest(target)
+        if manifest is None:
+            raise FileNotFoundError(target)
+        columns = manifest["columns"]
+        numeric = [c for c in columns if c["kind"] == "numeric"]
+        wavenumbers = np.array([float(c["label"]["v"]) if c["label"]["t"] != "str" else np.nan for c in numeric])
+        if np.isnan(wavenumbers).any():
+            wavenumbers = np.arange(len(numeric), dtype=np.float64)
+        slots = np.array([c["slot"] for c in numeric])
+        block = sidecar.load_numeric(target, manifest, mmap=mmap)
+        if columns[0]["kind"] == "object":
+            objects = os.path.join(target, manifest["files"]["objects"])
+            ids = pd.read_parquet(objects, columns=["c0__str"])["c0__str"]
+            ids = ids.astype(str).to_numpy(dtype=object)
+        else:
+            ids = np.arange(block.shape[0]).astype(str).astype(object)
+
+        order = np.argsort(wavenumbers, kind="stable")[::-1]
+        if np.array_equal(slots[order], np.arange(block.shape[1])):
+            values = block
+        else:
+            # Columns not stored high-to-low: write a sorted copy once and map that.
+            sorted_path = os.path.join(target, f"sorted-{manifest['files']['numeric']}")
+            if not os.path.exists(sorted_path):
+                tmp = f"{sorted_path}.tmp-{uuid.uuid4().hex}.npy"
+                out = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float64, shape=(block.shape[0], len(order)))
+                for start in range(0, block.shape[0], 1024):
+                    out[start : start + 1024] = block[start : start + 1024][:, slots[order]]
+                out.flush()
+                del out
+                os.replace(tmp, sorted_path)
+            values = np.load(sorted_path, mmap_mode="r" if mmap else None)
+        return cls(values, wavenumbers[order], ids, columns[0]["label"]["v"])
+
+
+def nanmean_rows(block: np.ndarray) -> np.ndarray:
+    block = np.asarray(block, dtype=np.float64)
+    if block.shape[0] == 0:
+        return np.full(block.shape[1], np.nan)
+    finite = ~np.isnan(block)
+    counts = finite.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = np.where(finite, block, 0.0).sum(axis=0) / counts
+    out[counts == 0] = np.nan
+    return out
+
+
+# Streamlit reruns keep handing back the same DataFrame object (session_state and
+# the parse cache both hold it), so the matrix is memoized by frame identity.
+_MATRIX_CACHE: Dict[int, Tuple[weakref.ref, Tuple, SpectraMatrix]] = {}
+_MATRIX_LOCK = threading.Lock()
+
+
+def _save_atomic(write: Callable[[str], None], path: str) -> None:
+    """Run write(tmp) into a private temp directory, then rename it into place.
+
+    A live mapping of an existing directory is never overwritten; when two
+    writers race, the loser drops its copy and both open the winner's.
+    """
+    tmp = f"{path}.tmp-{uuid.uuid4().hex}"
+    try:
+        write(tmp)
+        os.rename(tmp, path)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not os.path.isdir(path):
+            raise
+
+
+def _write_memmap(df: pd.DataFrame, ftir: Dict[str, object], path: str) -> None:
+    """Same files as SpectraMatrix.save, but filled straight from df in row chunks.
+
+    The full float matrix never exists in RAM; only one chunk of rows does.
+    """
+    w_cols = ftir["w_cols"]
+    positions = df.columns.get_indexer(w_cols)
+    os.makedirs(path, exist_ok=True)
+    out = np.lib.format.open_memmap(
+        os.path.join(path, "spectra.npy"), mode="w+", dtype=np.float64, shape=(len(df), len(w_cols))
+    )
+    step = max(1, MEMMAP_CHUNK_BYTES // max(1, len(w_cols) * 8))
+    for start in range(0, len(df), step):
+        chunk = df.iloc[start : start + step]
+        if (positions < 0).any():
+            out[start : start + step] = chunk[w_cols].to_numpy(dtype=np.float64)
+        else:
+            out[start : start + step] = chunk.iloc[:, positions].to_numpy(dtype=np.float64)
+    out.flush()
+    del out
+    np.save(os.path.join(path, "wavenumbers.npy"), np.asarray(ftir["w_vals"], dtype=np.float64))
+    ids = df[ftir["sample_col"]].astype(str).tolist()
+    with open(os.path.join(path, "samples.json"), "w", encoding="utf-8") as fh:
+        json.dump({"sample_col": str(ftir["sample_col"]), "ids": ids}, fh, ensure_ascii=False)
+
+
+def _prune_spilled(memmap_dir: str, keep: int) -> None:
+    """Keep the keep most recently used spectra-* directories (open mappings survive removal)."""
+    entries = [
+        os.path.join(memmap_dir, d) for d in os.listdir(memmap_dir) if d.startswith("spectra-") and ".tmp-" not in d
+    ]
+    entries.sort(key=lambda d: os.stat(d).st_mtime, reverse=True)
+    for stale in entries[keep:]:
+        shutil.rmtree(stale, ignore_errors=True)
+
+
+def spectra_for(
+    df: pd.DataFrame,
+    ftir: Dict[str, object],
+    memmap_dir: Optional[str] = None,
+    key: Optional[str] = None,
+    max_spilled: int = MAX_SPILLED,
+) -> SpectraMatrix:
+    """SpectraMatrix for df, memoized on the frame's identity.
+
+    Large matrices are written straight into a memmap under memmap_dir without
+    first being built in RAM. With a content key the directory is reused by
+    later reruns on the same data; without one it is unique. At most
+    max_spilled directories are kept.
+    """
+    signature = (ftir["sample_col"], len(ftir["w_cols"]), df.shape)
+    with _MATRIX_LOCK:
+        cached = _MATRIX_CACHE.get(id(df))
+        if cached is not None and cached[0]() is df and cached[1] == signature:
+            return cached[2]
+
+    if memmap_dir and len(df) * len(ftir["w_cols"]) * 8 >= MEMMAP_THRESHOLD_BYTES:
+        if key:
+            name = hashlib.blake2b(repr((key, signature)).encode("utf-8"), digest_size=20).hexdigest()
+        else:
+            name = uuid.uuid4().hex
+        path = os.path.join(memmap_dir, f"spectra-{name}")
+        if os.path.isdir(path):
+            os.utime(path)
+        else:
+            os.makedirs(memmap_dir, exist_ok=True)
+            _save_atomic(lambda tmp: _write_memmap(df, ftir, tmp), path)
+            _prune_spilled(memmap_dir, max_spilled)
+        sm = SpectraMatrix.open(path, mmap=True)
+    else:
+        sm = SpectraMatrix.from_frame(df, ftir)
+
+    with _MATRIX_LOCK:
+        for stale in [k for k, v in _MATRIX_CACHE.items() if v[0]() is None]:
+            del _MATRIX_CACHE[stale]
+        _MATRIX_CACHE[id(df)] = (weakref.ref(df), signature, sm)
+    return sm
@@ -0,0 +1,342 @@
+"""
+Chunked CSV streaming with out-of-core aggregation
+大 CSV 分块流式读取与聚合
+
+For CSV exports too large to hold as a DataFrame, stream_csv() reads the
+file in chunks and feeds every chunk to
+
+    FrameStats (colstats.py)   counts, missing, moments, quantiles, distinct
+    GrowingHistogram           exact histogram per numeric column
+    ValueCounter               exact value counts while a column stays small
+    Reservoir (sampling.py)    bounded uniform sample used for charts
+
+Column kinds are inferred on a prefix. Numeric columns are coerced with
+pd.to_numeric per chunk, so a stray text cell becomes NaN (and is counted)
+instead of turning the whole column into object; the kept sample is
+downcast where that is lossless. stream_groupby() answers a group-by with a
+second streamed pass, merging per-chunk partial aggregates.
+"""
+
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from colstats import FrameStats, is_numeric_kind
+from sampling import Reservoir
+
+# Below server.maxUploadSize (.streamlit/config.toml) so large uploads can reach it.
+STREAM_THRESHOLD_BYTES = 100 * 1024 * 1024
+PREFIX_ROWS = 10_000
+CHUNK_ROWS = 100_000
+HIST_BINS = 1024
+VALUE_COUNTS_CAP = 10_000
+# Server-side paths are only read when this names a data directory; off by default.
+STREAM_DIR_ENV = "APP_STREAM_DIR"
+
+Source = Union[str, io.IOBase]
+
+
+def open_source(source: Source):
+    """A path is returned as is; file-like objects (uploads) are rewound."""
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return source
+
+
+def server_data_dir() -> Optional[str]:
+    """Real path of the opted-in server data directory, or None when unset."""
+    root = os.environ.get(STREAM_DIR_ENV, "").strip()
+    return os.path.realpath(root) if root and os.path.isdir(root) else None
+
+
+def resolve_server_path(path: str, root: str) -> Optional[str]:
+    """Real path of a CSV under root; None for anything that resolves outside it.
+
+    Symlinks and '..' are resolved before the check, so neither can escape root.
+    """
+    real = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([real, root]) != root or not os.path.isfile(real):
+        return None
+    return real
+
+
+def source_key(source: Source) -> str:
+    if isinstance(source, str):
+        st = os.stat(source)
+        return f"{os.path.abspath(source)}:{st.st_size}:{st.st_mtime_ns}"
+    from parse_cache import content_key
+
+    return content_key(source.getvalue(), ("csv-stream",))
+
+
+# ------------------------------------------------------------------------------------
+# Column plan
+# ------------------------------------------------------------------------------------
+
+
+def infer_plan(prefix: pd.DataFrame) -> Dict[object, str]:
+    """'numeric' or 'text' per column, decided on the first PREFIX_ROWS rows."""
+    plan = {}
+    for col in prefix.columns:
+        series = prefix[col]
+        if is_numeric_kind(series.dtype):
+            plan[col] = "numeric"
+        elif series.dtype == object:
+            present = int(series.notna().sum())
+            parsed = int(pd.to_numeric(series, errors="coerce").notna().sum())
+            plan[col] = "numeric" if present and parsed >= 0.98 * present else "text"
+        else:
+            plan[col] = "text"
+    return plan
+
+
+def coerce_chunk(chunk: pd.DataFrame, plan: Dict[object, str], coerced: Dict[object, int]) -> pd.DataFrame:
+    for col, kind in plan.items():
+        if kind == "numeric" and not is_numeric_kind(chunk[col].dtype):
+            series = chunk[col]
+            parsed = pd.to_numeric(series, errors="coerce")
+            bad = int((parsed.isna() & series.notna()).sum())
+            if bad:
+                coerced[col] = coerced.get(col, 0) + bad
+            chunk[col] = parsed
+    return chunk
+
+
+def downcast_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Smallest int dtype per column; float32 only where the round trip is exact."""
+    out = df.copy()
+    for col in out.columns:
+        series = out[col]
+        if pd.api.types.is_integer_dtype(series.dtype):
+            out[col] = pd.to_numeric(series, downcast="integer")
+        elif pd.api.types.is_float_dtype(series.dtype) and series.dtype != np.float32:
+            values = series.to_numpy()
+            small = values.astype(np.float32)
+            if np.array_equal(small.astype(np.float64), values, equal_nan=True):
+                out[col] = small
+    return out
+
+
+# ------------------------------------------------------------------------------------
+# Incremental aggregates
+# ------------------------------------------------------------------------------------
+
+
+class GrowingHistogram:
+    """Exact counts in HIST_BINS equal bins; the range doubles (merging bin pairs) when needed."""
+
+    def __init__(self, bins: int = HIST_BINS):
+        self.bins = bins
+        self.lo: Optional[float] = None
+        self.width = 1.0
+        self.counts = np.zeros(bins, dtype=np.int64)
+
+    def update(self, values: np.ndarray) -> None:
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+        vmin, vmax = float(values.min()), float(values.max())
+        if self.lo is None:
+            span = vmax - vmin if vmax > vmin else max(abs(vmin), 1.0) * 1e-6
+            self.lo, self.width = vmin, span / self.bins * (1 + 1e-9)
+        half = self.bins // 2
+        while vmin < self.lo:
+            merged = self.counts.reshape(half, 2).sum(axis=1)
+            self.counts = np.concatenate([np.zeros(half, dtype=np.int64), merged])
+            self.lo -= self.width * self.bins
+            self.width *= 2
+        while vmax >= self.lo + self.width * self.bins:
+            merged = self.counts.reshape(half, 2).sum(axis=1)
+            self.counts = np.concatenate([merged, np.zeros(half, dtype=np.int64)])
+            self.width *= 2
+        idx = np.clip(((values - self.lo) / self.width).astype(np.intp), 0, self.bins - 1)
+        self.counts += np.bincount(idx, minlength=self.bins)
+
+    def table(self, target_bins: int = 30) -> pd.DataFrame:
+        """Merge fine bins over the occupied range into about target_bins bars."""
+        used = np.flatnonzero(self.counts)
+        if len(used) == 0:
+            return pd.DataFrame(columns=["下限", "上限", "数量"])
+        first, last = used[0], used[-1] + 1
+        group = max(1, -(-(last - first) // target_bins))
+        counts = self.counts[first:last]
+        counts = np.pad(counts, (0, (-len(counts)) % group)).reshape(-1, group).sum(axis=1)
+        lows = self.lo + (first + np.arange(len(counts)) * group) * self.width
+        return pd.DataFrame({"下限": lows, "上限": lows + group * self.width, "数量": counts})
+
+
+class ValueCounter:
+    """Exact value counts until a column exceeds `cap` distinct values."""
+
+    def __init__(self, cap: int = VALUE_COUNTS_CAP):
+        self.cap = cap
+        self.counts: Optional[pd.Series] = None
+        self.overflow = False
+
+    def update(self, series: pd.Series) -> None:
+        if self.overflow:
+            return
+        vc = series.value_counts(dropna=True)
+        self.counts = vc if self.counts is None else self.counts.add(vc, fill_value=0).astype(np.int64)
+        if len(self.counts) > self.cap:
+            self.counts, self.overflow = None, True
+
+    def top(self) -> Optional[pd.Series]:
+        if self.overflow or self.counts is None:
+            return None
+        return self.counts.sort_values(ascending=False, kind="stable")
+
+
+@dataclass
+class StreamSummary:
+    source: str
+    plan: Dict[object, str]
+    stats: FrameStats
+    sample: pd.DataFrame
+    hists: Dict[object, GrowingHistogram] = field(default_factory=dict)
+    counts: Dict[object, ValueCounter] = field(default_factory=dict)
+    coerced: Dict[object, int] = field(default_factory=dict)
+    chunks: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rows(self) -> int:
+        return self.stats.rows
+
+
+def read_prefix(source: Source, prefix_rows: int = PREFIX_ROWS, **read_csv_kwargs) -> pd.DataFrame:
+    return pd.read_csv(open_source(source), nrows=prefix_rows, **read_csv_kwargs)
+
+
+def stream_csv(source: Source, reservoir_rows: int = 20_000, chunksize: int = CHUNK_ROWS,
+               prefix_rows: int = PREFIX_ROWS, progress: Optional[Callable[[int], None]] = None,
+               **read_csv_kwargs) -> StreamSummary:
+    start = time.perf_counter()
+    plan = infer_plan(read_prefix(source, prefix_rows, **read_csv_kwargs))
+    stats = FrameStats()
+    reservoir = Reservoir(reservoir_rows)
+    hists = {col: GrowingHistogram() for col, kind in plan.items() if kind == "numeric"}
+    counts = {col: ValueCounter() for col in plan}
+    coerced: Dict[object, int] = {}
+    chunks = 0
+    with pd.read_csv(open_source(source), chunksize=chunksize, **read_csv_kwargs) as reader:
+        for chunk in reader:
+            chunk = coerce_chunk(chunk, plan, coerced)
+            stats.update(chunk)
+            for col, hist in hists.items():
+                hist.update(chunk[col].to_numpy(dtype=np.float64, na_value=np.nan))
+            for col, counter in counts.items():
+                counter.update(chunk[col])
+            reservoir.update(chunk)
+            chunks += 1
+            if progress is not None:
+                progress(stats.rows)
+    label = source if isinstance(source, str) else getattr(source, "name", "upload")
+    return StreamSummary(
+        source=str(label),
+        plan=plan,
+        stats=stats,
+        sample=downcast_frame(reservoir.frame),
+        hists=hists,
+        counts=counts,
+        coerced=coerced,
+        chunks=chunks,
+        seconds=time.perf_counter() - start,
+    )
+
+
+# ------------------------------------------------------------------------------------
+# Streamed group-by
+# ------------------------------------------------------------------------------------
+
+GROUP_STATS = ["count", "sum", "mean", "min", "max", "std"]
+
+
+def _partial(chunk: pd.DataFrame, group_cols: List[object], agg_col: object) -> pd.DataFrame:
+    grouped = chunk.groupby(group_cols)[agg_col]
+    part = grouped.agg(["count", "sum", "min", "max", "mean", "var"])
+    part["m2"] = (part.pop("var") * (part["count"] - 1)).fillna(0.0)
+    return part
+
+
+def _combine(parts: List[pd.DataFrame]) -> pd.DataFrame:
+    stacked = pd.concat(parts)
+    levels = list(range(stacked.index.nlevels))
+    grouped = stacked.groupby(level=levels)
+    count = grouped["count"].transform("sum")
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = grouped["sum"].transform("sum") / count
+    # Chan et al.: M2 = sum(M2_i + n_i * (mean_i - mean)^2)
+    spread = stacked["m2"] + stacked["count"] * (stacked["mean"].fillna(0.0) - mean.fillna(0.0)) ** 2
+    out = pd.DataFrame(
+        {
+            "count": grouped["count"].sum(),
+            "sum": grouped["sum"].sum(),
+            "min": grouped["min"].min(),
+            "max": grouped["max"].max(),
+            "m2": spread.groupby(level=levels).sum(),
+        }
+    )
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out["mean"] = (out["sum"] / out["count"]).where(out["count"] > 0)
+    return out
+
+
+def stream_groupby(source: Source, plan: Dict[object, str], group_cols: Sequence[object], agg_col: object,
+                   chunksize: int = CHUNK_ROWS, **read_csv_kwargs) -> pd.DataFrame:
+    """Exact count/sum/mean/min/max/std of agg_col per group, in one streamed pass."""
+    group_cols = list(group_cols)
+    usecols = list(dict.fromkeys(group_cols + [agg_col]))
+    parts: List[pd.DataFrame] = []
+    coerced: Dict[object, int] = {}
+    with pd.read_csv(open_source(source), chunksize=chunksize, usecols=usecols, **read_csv_kwargs) as reader:
+        for chunk in reader:
+            chunk = coerce_chunk(chunk, {c: plan.get(c, "text") for c in usecols}, coerced)
+            parts.append(_partial(chunk, group_cols, agg_col))
+            if len(parts) >= 16:
+                parts = [_combine(parts)]
+    if not parts:
+        return pd.DataFrame(columns=group_cols + GROUP_STATS)
+    out = _combine(parts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out["std"] = np.sqrt(out["m2"] / (out["count"] - 1)).where(out["count"] > 1)
+    return out[GROUP_STATS].reset_index()
+
+
+# ------------------------------------------------------------------------------------
+# Per-source memoization (reruns keep asking for the same stream)
+# ------------------------------------------------------------------------------------
+
+_STREAM_CACHE: "OrderedDict[Tuple, object]" = OrderedDict()
+_STREAM_LOCK = threading.Lock()
+
+
+def _memo(key: Tuple, build: Callable[[], object], max_cached: int = 16):
+    with _STREAM_LOCK:
+        if key in _STREAM_CACHE:
+            _STREAM_CACHE.move_to_end(key)
+            return _STREAM_CACHE[key]
+    value = build()
+    with _STREAM_LOCK:
+        _STREAM_CACHE[key] = value
+        while len(_STREAM_CACHE) > max_cached:
+            _STREAM_CACHE.popitem(last=False)
+    return value
+
+
+def stream_for(key: str, source: Source, reservoir_rows: int,
+               progress: Optional[Callable[[int], None]] = None) -> StreamSummary:
+    return _memo(("stream", key, int(reservoir_rows)), lambda: stream_csv(source, int(reservoir_rows), progress=progress))
+
+
+def groupby_for(key: str, source: Source, plan: Dict[object, str], group_cols: Sequence[object],
+                agg_col: object) -> pd.DataFrame:
+    return _memo(("groupby", key, tuple(group_cols), agg_col), lambda: stream_groupby(source, plan, group_cols, agg_col))
@@ -0,0 +1,306 @@
+"""
+Loop reference implementations for the vectorized engines
+向量化引擎的逐点参考实现
+
+Each function here is the straightforward per-row / per-column version a
+vectorized engine replaced (or the pandas call it must agree with), plus
+the synthetic data generators shared by the tests and bench/benchmarks.py.
+"""
+
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from colstats import FrameStats
+from peaks import PEAK_COLUMNS, smooth_series
+from ultrasonic import ECHO_COLUMNS, PERCENTILES, SignalMatrix, envelope, name_columns
+
+
+# ---------------------------------------------------------------- peaks
+
+
+def detect_peaks_reference(x: np.ndarray, y: np.ndarray, window: int, min_prom: float, top_n: int) -> pd.DataFrame:
+    """The original per-point implementation, kept as the ground truth."""
+    y_s = smooth_series(y, window)
+    peaks: List[Tuple[float, float, float, float]] = []
+    for i in range(1, len(y_s) - 1):
+        if y_s[i] > y_s[i - 1] and y_s[i] > y_s[i + 1]:
+            left = np.min(y_s[max(0, i - window) : i]) if i - window >= 0 else y_s[i - 1]
+            right = np.min(y_s[i + 1 : i + window + 1]) if i + window + 1 <= len(y_s) else y_s[i + 1]
+            prominence = y_s[i] - max(left, right)
+            if prominence >= min_prom:
+                peaks.append((x[i], y[i], y_s[i], prominence))
+    if not peaks:
+        return pd.DataFrame(columns=PEAK_COLUMNS)
+    peaks = sorted(peaks, key=lambda t: t[3], reverse=True)[:top_n]
+    return pd.DataFrame(peaks, columns=PEAK_COLUMNS)
+
+
+def synthetic_spectrum(n: int, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+    x = np.linspace(4000.0, 400.0, n)
+    y = np.full(n, 0.5)
+    for centre in rng.uniform(500, 3900, 40):
+        y -= rng.uniform(0.01, 0.2) * np.exp(-((x - centre) / rng.uniform(5, 40)) ** 2)
+    y += rng.normal(0, 0.002, n)
+    y = np.round(y, 4)  # quantised like instrument exports, so plateaus and ties occur
+    return x, y
+
+
+# ---------------------------------------------------------------- distances
+
+
+def pairwise_reference(block: np.ndarray, metric: str) -> np.ndarray:
+    m = block.shape[0]
+    out = np.full((m, m), np.nan)
+    for i in range(m):
+        for j in range(m):
+            a, b = block[i], block[j]
+            ok = ~np.isnan(a) & ~np.isnan(b)
+            if not ok.any():
+                continue
+            a, b = a[ok], b[ok]
+            if metric == "mean_abs":
+                out[i, j] = float(np.nanmean(np.abs(a - b)))
+            elif metric == "euclidean":
+                out[i, j] = float(np.sqrt(np.sum((a - b) ** 2)))
+            else:
+                cos = float(np.clip(a @ b / np.sqrt((a @ a) * (b @ b)), -1.0, 1.0))
+                out[i, j] = 1.0 - cos if metric == "cosine" else float(np.arccos(cos))
+    return out
+
+
+# ---------------------------------------------------------------- correlation
+
+
+def top_abs_pairs(ref: np.ndarray, k: int) -> np.ndarray:
+    i, j = np.triu_indices(len(ref), 1)
+    vals = ref[i, j]
+    vals = vals[~np.isnan(vals)]
+    return np.sort(np.abs(vals))[::-1][:k]
+
+
+# ---------------------------------------------------------------- cube
+
+
+def groupby_reference(df: pd.DataFrame, group_cols: List[object], measure: object, func: str) -> pd.DataFrame:
+    return df.groupby(group_cols, observed=True)[measure].agg(func).reset_index()
+
+
+# ---------------------------------------------------------------- colstats
+
+
+def categorical_columns_reference(df: pd.DataFrame) -> List[object]:
+    out = []
+    cols = df.columns.tolist()
+    for col in cols:
+        series = df[col]
+        if str(col).lower().startswith("unnamed"):
+            continue
+        if series.dtype == "object" or str(series.dtype).startswith("category"):
+            out.append(col)
+            continue
+        if series.nunique(dropna=True) <= min(50, max(2, len(series) // 20)):
+            out.append(col)
+    if cols and not str(cols[0]).lower().startswith("unnamed") and cols[0] not in out:
+        out.insert(0, cols[0])
+    return out
+
+
+def nunique_close(stats: FrameStats, df: pd.DataFrame) -> bool:
+    ref = df.nunique(dropna=True).to_numpy()
+    new = stats.nunique().to_numpy()
+    exact = stats.distinct_exact()
+    return bool((new[exact] == ref[exact]).all() and (np.abs(new[~exact] / ref[~exact] - 1) < 0.1).all())
+
+
+def stats_frame(rows: int, rng: np.random.Generator) -> pd.DataFrame:
+    df = pd.DataFrame(
+        {
+            "样本": rng.choice(["LB", "LD", "SS", "SR"], rows),
+            "批次": rng.integers(0, 6, rows),
+            "强度": rng.normal(50, 12, rows),
+            "计数": rng.integers(0, 10_000, rows).astype(np.int64),
+            "日期": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 90, rows), unit="D"),
+            "合格": rng.random(rows) > 0.3,
+            "Unnamed: 6": rng.random(rows),
+        }
+    )
+    df.loc[rng.random(rows) < 0.05, "强度"] = np.nan
+    df.loc[rng.random(rows) < 0.02, "样本"] = None
+    df["类别"] = df["样本"].astype("category")
+    return df
+
+
+# ---------------------------------------------------------------- process_model
+
+
+def regression_reference(x: np.ndarray, y: np.ndarray, groups: np.ndarray, g: int) -> Dict[str, np.ndarray]:
+    out = {k: np.full((g, x.shape[1], y.shape[1]), np.nan) for k in ("slope", "intercept", "r")}
+    for k in range(g):
+        for i in range(x.shape[1]):
+            for j in range(y.shape[1]):
+                keep = (groups == k) & ~np.isnan(x[:, i]) & ~np.isnan(y[:, j])
+                xs, ys = x[keep, i], y[keep, j]
+                if len(xs) < 3 or np.ptp(xs) == 0 or np.ptp(ys) == 0:
+                    continue
+                out["slope"][k, i, j], out["intercept"][k, i, j] = np.polyfit(xs, ys, 1)
+                out["r"][k, i, j] = np.corrcoef(xs, ys)[0, 1]
+    return out
+
+
+def regression_data(n: int, p: int, r: int, g: int, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    x = rng.normal(size=(n, p)) * rng.uniform(1, 100, size=p) + rng.uniform(0, 200, size=p)
+    y = x @ rng.normal(size=(p, r)) * 0.1 + rng.normal(size=(n, r))
+    x[rng.random(x.shape) < 0.1] = np.nan
+    y[rng.random(y.shape) < 0.1] = np.nan
+    groups = rng.integers(0, g, size=n)
+    return x, y, groups
+
+
+# ---------------------------------------------------------------- preprocess
+
+
+def als_reference(y: np.ndarray, lam: float, p: float, iterations: int) -> np.ndarray:
+    n = len(y)
+    D = np.diff(np.eye(n), 2, axis=0)
+    P = lam * D.T @ D
+    w = np.ones(n)
+    for _ in range(iterations):
+        z = np.linalg.solve(np.diag(w) + P, w * y)
+        new_w = np.where(y > z, p, 1.0 - p)
+        if np.array_equal(new_w, w):
+            break
+        w = new_w
+    return z
+
+
+def rubberband_reference(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    order = np.argsort(x, kind="stable")
+    hull: List[int] = []
+    for i in order:
+        while len(hull) >= 2:
+            i0, i1 = hull[-2], hull[-1]
+            if (x[i1] - x[i0]) * (y[i] - y[i0]) - (y[i1] - y[i0]) * (x[i] - x[i0]) <= 0:
+                hull.pop()
+            else:
+                break
+        hull.append(i)
+    return np.interp(x, x[hull], y[hull])
+
+
+def savgol_reference(x: np.ndarray, y: np.ndarray, window: int, order: int, derivative: int) -> np.ndarray:
+    n, half = len(y), window // 2
+    step = (x[-1] - x[0]) / (n - 1)
+    out = np.empty(n)
+    for i in range(n):
+        start = min(max(i - half, 0), n - window)
+        poly = np.polynomial.Polynomial.fit(np.arange(window), y[start : start + window], order, domain=[0, window - 1])
+        out[i] = poly.deriv(derivative)(i - start) if derivative else poly(i - start)
+    return out / step ** derivative
+
+
+def synthetic_spectra(m: int, n: int, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+    x = np.linspace(4000.0, 400.0, n)
+    t = (x - 400.0) / 3600.0
+    y = rng.uniform(0.0, 0.02, (m, 1)) + rng.uniform(-0.02, 0.02, (m, 1)) * t + rng.uniform(0, 0.02, (m, 1)) * t ** 2
+    for centre in np.linspace(600, 3800, 25):
+        y += rng.uniform(0.0, 0.05, (m, 1)) * np.exp(-((x - centre) / rng.uniform(8, 40)) ** 2)
+    return x, y + rng.normal(0, 2e-4, (m, n))
+
+
+# ---------------------------------------------------------------- ultrasonic
+
+
+def trace_stats_reference(df: pd.DataFrame) -> pd.DataFrame:
+    """The two per-column loops of the original report script (named columns only)."""
+    named = name_columns(df.iloc[0])
+    pooled = []
+    for pos in named:
+        vals = pd.to_numeric(df.iloc[1:, pos].values, errors="coerce")
+        pooled.extend(vals[~np.isnan(vals)].tolist())
+    pooled = np.array(pooled)
+    np.percentile(pooled, list(PERCENTILES))
+    rows = []
+    for pos in named:
+        vals = pd.to_numeric(df.iloc[1:, pos].values, errors="coerce")
+        vals = vals[~np.isnan(vals)]
+        if len(vals) == 0:
+            continue
+        rows.append({
+            "Points": len(vals), "Mean": np.mean(vals), "Std": np.std(vals), "Min": np.min(vals),
+            "Max": np.max(vals), "RMS": np.sqrt(np.mean(vals ** 2)),
+            "Peak2Peak": np.max(vals) - np.min(vals), "Energy": np.sum(vals ** 2),
+        })
+    return pd.DataFrame(rows)
+
+
+def spectral_reference(sm: SignalMatrix, bands: Sequence[Tuple[float, float]]) -> np.ndarray:
+    rows = []
+    freq = np.fft.rfftfreq(sm.n_timepoints)
+    for i in range(sm.n_traces):
+        x = np.where(sm.valid[i], sm.values[i] - np.nanmean(sm.values[i]), 0.0) * np.hanning(sm.n_timepoints)
+        p = np.abs(np.fft.rfft(x)) ** 2
+        p[1 : (sm.n_timepoints + 1) // 2] *= 2
+        powers = [p[(freq >= lo) & ((freq < hi) | (hi >= freq[-1]))].sum() for lo, hi in bands]
+        rows.append([freq[np.argmax(p)], (p * freq).sum() / p.sum()] + powers)
+    return np.array(rows)
+
+
+def echoes_reference(sm: SignalMatrix, window: int = 15, k: float = 6.0, relative: float = 0.2,
+                 min_gap: int = 10, min_width: int = 3) -> pd.DataFrame:
+    """Trace-by-trace reference for detect_echoes(method="rms")."""
+    rows = []
+    for t in range(sm.n_traces):
+        x = sm.values[t]
+        x = np.where(sm.valid[t], x - np.nanmedian(x), 0.0)
+        half = window // 2
+        env = np.array([np.sqrt(np.mean(x[max(0, i - half) : i - half + window] ** 2)) for i in range(len(x))])
+        sub = env[:: max(1, window // 2)]
+        med = np.median(sub)
+        thr = max(med + k * 1.4826 * np.median(np.abs(sub - med)), relative * env.max())
+        runs, i = [], 0
+        while i < len(env):
+            if env[i] > thr:
+                j = i
+                while j < len(env) and env[j] > thr:
+                    j += 1
+                if runs and i - runs[-1][1] < min_gap:
+                    runs[-1][1] = j
+                else:
+                    runs.append([i, j])
+                i = j
+            else:
+                i += 1
+        echo = 0
+        for a, b in runs:
+            if b - a < min_width:
+                continue
+            echo += 1
+            seg = env[a:b]
+            rows.append([t, echo, a, a + int(np.argmax(seg)), b, seg.max(), float((x[a:b] ** 2).sum())])
+    return pd.DataFrame(rows, columns=ECHO_COLUMNS)
+
+
+def same_echoes(sm: SignalMatrix, ref: pd.DataFrame, got: pd.DataFrame) -> bool:
+    if ref.shape != got.shape:
+        return False
+    other = [c for c in ECHO_COLUMNS if c != "Peak"]
+    if not np.allclose(ref[other].to_numpy(float), got[other].to_numpy(float), rtol=1e-9, atol=1e-12):
+        return False
+    # Quantised traces give flat envelope tops; a peak index may differ only between equal maxima.
+    env = envelope(sm)
+    trace = got["Trace"].to_numpy(dtype=np.intp)
+    return np.allclose(env[trace, ref["Peak"].to_numpy(dtype=np.intp)], env[trace, got["Peak"].to_numpy(dtype=np.intp)])
+
+
+def signal_frame(n_samples: int, n_time: int, repeats: int, rng: np.random.Generator) -> pd.DataFrame:
+    t = np.arange(n_time)
+    cols = {}
+    for i in range(n_samples * repeats):
+        echo = np.exp(-((t - rng.uniform(100, n_time - 100)) / 15.0) ** 2) * np.sin(t * 0.4)
+        col = (echo + rng.normal(0, 0.05, n_time) - 1.0).astype(object)
+        col[rng.random(n_time) < 0.01] = np.nan
+        name = f"LB{i // repeats}-1" if i % repeats == 0 else np.nan
+        cols[f"c{i}"] = np.r_[np.array([name], dtype=object), col]
+    return pd.DataFrame(cols)
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from colstats import QUANTILES, frame_stats
+from reference import categorical_columns_reference, nunique_close, stats_frame
+
+
+@pytest.mark.parametrize("rows, chunk_rows", [(7, 3), (500, 64), (3_000, 1_000)])
+def test_matches_pandas(rows, chunk_rows):
+    df = stats_frame(rows, np.random.default_rng(rows))
+    stats = frame_stats(df, chunk_rows)
+    numeric = df.select_dtypes(include="number").columns.tolist()
+    assert stats.numeric_columns() == numeric
+    ref = df[numeric].describe().T
+    assert np.allclose(ref.to_numpy(dtype=float), stats.describe().to_numpy(dtype=float), rtol=1e-9, equal_nan=True)
+    assert stats.missing().tolist() == df.isna().sum().tolist()
+    assert nunique_close(stats, df)
+    assert stats.categorical_columns() == categorical_columns_reference(df)
+
+
+def test_merge_equals_single_pass():
+    df = stats_frame(5_000, np.random.default_rng(1))
+    merged = frame_stats(df.iloc[:1_700], 500)
+    merged.merge(frame_stats(df.iloc[1_700:], 900))
+    whole = frame_stats(df)
+    assert merged.missing().tolist() == whole.missing().tolist()
+    assert merged.nunique().tolist() == whole.nunique().tolist()
+    cols = ["count", "mean", "std", "min", "max"]
+    assert np.allclose(merged.describe()[cols].to_numpy(float), whole.describe()[cols].to_numpy(float), equal_nan=True)
+
+
+def test_sketch_and_hyperloglog_accuracy():
+    rng = np.random.default_rng(0)
+    big = pd.DataFrame({"x": rng.lognormal(0, 1, 1_000_000), "id": rng.integers(0, 200_000, 1_000_000)})
+    stats = frame_stats(big, 100_000)
+    assert not stats.quantiles_exact
+    approx = stats.describe().loc["x", ["25%", "50%", "75%"]].to_numpy(dtype=float)
+    ranks = np.searchsorted(np.sort(big["x"].to_numpy()), approx) / len(big)
+    assert np.abs(ranks - np.array(QUANTILES)).max() < 0.005
+    assert abs(stats.nunique()["id"] / big["id"].nunique() - 1) < 0.05
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from correlation import METHODS, _bin_edges, correlate
+from reference import top_abs_pairs
+
+
+def _cases():
+    rng = np.random.default_rng(0)
+    base = rng.normal(size=(120, 40)).cumsum(axis=1)
+    holes = base.copy()
+    holes[rng.random(holes.shape) < 0.1] = np.nan
+    holes[:, 7] = 3.0
+    return {"dense": base, "missing": holes}
+
+
+CASES = _cases()
+
+
+@pytest.mark.parametrize("dtype, tol", [(np.float64, 1e-9), (np.float32, 1e-4)])
+@pytest.mark.parametrize("method", list(METHODS.values()))
+@pytest.mark.parametrize("name", list(CASES))
+def test_matches_pandas(name, method, dtype, tol):
+    if method == "spearman" and name == "missing":
+        pytest.skip("ranks are per column, pandas re-ranks per pair")
+    data = CASES[name]
+    df = pd.DataFrame(data)
+    ref = df.corr(method=method).to_numpy()
+
+    res = correlate(data, df.columns, method, dtype, top_k=15, max_block_bytes=8 * 8 * 40 * 7)
+    assert np.allclose(ref, res.matrix.to_numpy(), atol=tol, equal_nan=True)
+    assert np.allclose(top_abs_pairs(ref, 15), np.abs(res.top_pairs["相关系数"].to_numpy()), atol=tol)
+
+    binned = correlate(data, df.columns, method, dtype, full_limit=10, bins=6)
+    edges = _bin_edges(40, 6)
+    means = np.array([[np.nanmean(ref[a:b, c:d]) for c, d in zip(edges[:-1], edges[1:])]
+                      for a, b in zip(edges[:-1], edges[1:])])
+    assert np.allclose(means, binned.heatmap.to_numpy(), atol=tol, equal_nan=True)
@@ -0,0 +1,42 @@
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from cube import CUBE_FUNCS, build_cube
+from reference import groupby_reference
+
+
+@pytest.mark.parametrize("rows", [9, 2_000, 200_000])
+def test_matches_groupby(rows):
+    rng = np.random.default_rng(rows)
+    df = pd.DataFrame(
+        {
+            "前缀": rng.choice(["LB", "LD", "SS", "SR"], rows),
+            "系列": rng.integers(0, 7, rows),
+            "重复": rng.choice(["a", "b", None], rows),
+            "强度": rng.normal(50, 12, rows),
+            "计数": rng.integers(0, 1_000, rows),
+        }
+    )
+    df.loc[rng.random(rows) < 0.05, "强度"] = np.nan
+    df["类别"] = pd.Categorical(df["前缀"])
+    dims = ["前缀", "系列", "重复", "类别"]
+    cube = build_cube(df, dims, ["强度", "计数"])
+    bad = []
+    for r in range(1, len(dims) + 1):
+        for group_cols in combinations(dims, r):
+            keys = list(group_cols)
+            for measure in ("强度", "计数"):
+                for func in CUBE_FUNCS:
+                    ref = groupby_reference(df, keys, measure, func)
+                    new = cube.query(group_cols, measure, func)
+                    if func == "median" and not cube.median_exact(measure):
+                        close = np.allclose(ref[measure], new[measure], rtol=0.02, atol=0.5, equal_nan=True)
+                    else:
+                        close = np.allclose(ref[measure], new[measure], rtol=1e-9, equal_nan=True)
+                    same_keys = ref[keys].astype(str).equals(new[keys].astype(str))
+                    if not (same_keys and close and ref[measure].dtype == new[measure].dtype):
+                        bad.append(f"{group_cols}/{measure}/{func}")
+    assert not bad
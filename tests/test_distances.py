@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from distances import MAX_BLOCK_BYTES, METRICS, pairwise_distances
+from reference import pairwise_reference
+
+
+def _blocks():
+    rng = np.random.default_rng(0)
+    gappy = rng.normal(size=(23, 300)).cumsum(axis=1)
+    gappy[rng.integers(0, 23, 40), rng.integers(0, 300, 40)] = np.nan
+    gappy[5, :] = np.nan
+    return {"gappy": gappy, "dense": rng.normal(size=(17, 300)).cumsum(axis=1)}
+
+
+BLOCKS = _blocks()
+
+
+@pytest.mark.parametrize("budget", [MAX_BLOCK_BYTES, 4096])
+@pytest.mark.parametrize("metric", list(METRICS.values()))
+@pytest.mark.parametrize("name", list(BLOCKS))
+def test_matches_loop(name, metric, budget):
+    data = BLOCKS[name]
+    ref = pairwise_reference(data, metric)
+    new = pairwise_distances(data, metric, budget)
+    np.fill_diagonal(ref, np.nan)
+    np.fill_diagonal(new, np.nan)
+    assert np.allclose(ref, new, rtol=1e-7, atol=1e-7, equal_nan=True)
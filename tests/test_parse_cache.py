@@ -0,0 +1,21 @@
+import pandas as pd
+
+from parse_cache import ParseCache, content_key
+
+
+def test_keyed_lookup_returns_content_key():
+    cache = ParseCache()
+    calls = []
+
+    def parse():
+        calls.append(1)
+        return pd.DataFrame({"a": [1, 2, 3]})
+
+    df, key = cache.get_or_parse_keyed(b"a\n1\n2\n3\n", ("csv",), parse)
+    assert key == content_key(b"a\n1\n2\n3\n", ("csv",))
+    again, same = cache.get_or_parse_keyed(b"a\n1\n2\n3\n", ("csv",), parse)
+    assert again is df and same == key
+    assert cache.get_or_parse(b"a\n1\n2\n3\n", ("csv",), parse) is df
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.entries) == (2, 1, 1)
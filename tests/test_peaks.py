@@ -0,0 +1,70 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from peaks import compile_bands, detect_peaks, detect_peaks_batch
+from reference import detect_peaks_reference, synthetic_spectrum
+
+
+@pytest.mark.parametrize("n", [3, 4, 10, 257, 1000])
+def test_matches_loop(n):
+    rng = np.random.default_rng(n)
+    for window, min_prom, top_n in itertools.product((1, 2, 5, 8, 31), (0.0, 0.001, 0.01), (1, 5, 15, 50)):
+        x, y = synthetic_spectrum(n, rng)
+        if n >= 10:
+            y[rng.integers(0, n, 3)] = np.nan
+        ref = detect_peaks_reference(x, y, window, min_prom, top_n)
+        new = detect_peaks(x, y, window, min_prom, top_n)
+        if not (ref.empty and new.empty):
+            pd.testing.assert_frame_equal(ref.reset_index(drop=True), new.reset_index(drop=True))
+
+
+def test_batch_matches_rows():
+    rng = np.random.default_rng(0)
+    x = np.linspace(4000.0, 400.0, 2_000)
+    matrix = np.stack([synthetic_spectrum(2_000, rng)[1] for _ in range(50)])
+    batch = detect_peaks_batch(x, matrix, 5, 0.001, 15)
+    for i in range(len(matrix)):
+        got = batch[batch["row"] == i].drop(columns="row").reset_index(drop=True)
+        pd.testing.assert_frame_equal(got, detect_peaks(x, matrix[i], 5, 0.001, 15))
+
+
+def test_band_lookup_matches_scan():
+    rng = np.random.default_rng(0)
+    low = rng.uniform(400, 4000, 60)
+    high = low + rng.uniform(5, 80, 60)
+    bands = pd.DataFrame({"波段下限": high, "波段上限": low, "对应基团": "-", "对应成分": "-"})
+    peaks = np.r_[rng.uniform(400, 4000, 2_000), low[:5], high[:5]]
+    index = compile_bands(bands)
+    inside = (peaks[:, None] >= low) & (peaks[:, None] <= high)
+    first = np.where(inside.any(axis=1), inside.argmax(axis=1), -1)
+    assert np.array_equal(index.first_match(peaks), first)
+    pos, band = index.all_matches(peaks)
+    assert sorted(zip(pos.tolist(), band.tolist())) == sorted(zip(*map(list, np.nonzero(inside))))
+
+
+def test_peak_index_store_is_keyed_by_hash_and_bounded(tmp_path):
+    from peaks import _INDEX_CACHE, peak_index_for
+    from spectra import SpectraMatrix
+
+    rng = np.random.default_rng(0)
+    x = np.linspace(4000.0, 400.0, 500)
+    values = np.stack([synthetic_spectrum(500, rng)[1] for _ in range(4)])
+    sm = SpectraMatrix(values, x, np.array(list("abcd"), dtype=object), "Sample")
+    store = tmp_path / "peaks"
+    outside = tmp_path / "data"
+    outside.mkdir()
+    # A server-path stream key is an absolute path; it must not escape the store.
+    key = f"{outside / 'big.csv'}:123:456:20000"
+    for i in range(5):
+        index = peak_index_for(sm, key, 5, 0.001 * (i + 1), store_dir=str(store), max_stored=3)
+        assert len(index) > 0
+    assert list(outside.iterdir()) == []
+    files = sorted(p.name for p in store.iterdir())
+    assert len(files) == 3 and all(f.startswith("peaks-") and f.endswith(".parquet") for f in files)
+
+    _INDEX_CACHE.clear()
+    again = peak_index_for(sm, key, 5, 0.005, store_dir=str(store), max_stored=3)
+    pd.testing.assert_frame_equal(again.by_sample, index.by_sample)
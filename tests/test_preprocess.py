@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from preprocess import Preprocessing, als_baseline, preprocess_values, rubberband_baseline, savgol_rows
+from reference import als_reference, rubberband_reference, savgol_reference, synthetic_spectra
+
+X, Y = synthetic_spectra(6, 400, np.random.default_rng(0))
+
+
+def test_als_matches_dense_solve():
+    ref = np.vstack([als_reference(row, 1e4, 0.01, 10) for row in Y])
+    assert np.allclose(als_baseline(Y, 1e4, 0.01, 10), ref, rtol=1e-8, atol=1e-10)
+
+
+def test_rubberband_matches_hull_loop():
+    ref = np.vstack([rubberband_reference(X, row) for row in Y])
+    assert np.allclose(rubberband_baseline(X, Y), ref, rtol=1e-10, atol=1e-12)
+
+
+@pytest.mark.parametrize("window, order, derivative", [(5, 2, 0), (11, 3, 1), (15, 4, 2), (7, 2, 2)])
+def test_savgol_matches_polynomial_fits(window, order, derivative):
+    ref = np.vstack([savgol_reference(X, row, window, order, derivative) for row in Y])
+    assert np.allclose(savgol_rows(X, Y, window, order, derivative), ref, rtol=1e-7, atol=1e-9)
+
+
+def test_nan_gaps_kept():
+    gappy = Y.copy()
+    gappy[1, 50:60] = np.nan
+    out = preprocess_values(X, gappy, Preprocessing("rubberband", normalize="vector", sg_window=9))
+    assert np.isnan(out[1, 50:60]).all()
+    assert not np.isnan(np.delete(out, np.s_[50:60], axis=1)).any()
@@ -0,0 +1,36 @@
+import os
+
+import numpy as np
+import pytest
+
+from process_model import batch_regression, build_sample_table, regression_arrays, strongest_fits, t_pvalue
+from reference import regression_data, regression_reference
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_matches_polyfit_loop():
+    x, y, groups = regression_data(300, 4, 6, 5, np.random.default_rng(0))
+    x[groups == 2, 1] = 7.0  # constant x inside one group: no fit there
+    fast = regression_arrays(x, y, groups, 5)
+    ref = regression_reference(x, y, groups, 5)
+    for key in ref:
+        assert np.allclose(ref[key], fast[key], rtol=1e-8, atol=1e-10, equal_nan=True), key
+
+
+def test_t_pvalue_critical_values():
+    # Two-sided 5% critical values of Student's t.
+    p = t_pvalue(np.array([12.706, 2.228, 2.086, 1.960]), np.array([1, 10, 20, 1e6]))
+    assert np.allclose(p, 0.05, atol=2e-4)
+
+
+def test_shipped_data():
+    table = build_sample_table(REPO_DIR)
+    if not table:
+        pytest.skip("no experiment workbooks under the repo")
+    treated = table.frame[table.frame["系列"].fillna(0) > 0]
+    fits = batch_regression(treated, table.responses, table.variables, by=["纤维类型"])
+    assert len(fits)
+    top = strongest_fits(fits)
+    assert (top["p值"] < 0.05).all()
+    assert top["r"].abs().is_monotonic_decreasing
@@ -0,0 +1,38 @@
+import tracemalloc
+
+import numpy as np
+
+from profiling import Profiler
+
+
+def test_section_records_peak():
+    profiler = Profiler(enabled=True)
+    with profiler.section("alloc"):
+        block = np.ones(2_000_000)
+        del block
+    profiler.close()
+    assert profiler.records[0].peak_mb >= 15
+    assert not tracemalloc.is_tracing()
+
+
+def test_only_one_profiler_traces_memory():
+    first = Profiler(enabled=True)
+    second = Profiler(enabled=True)
+    assert first.memory_traced and not second.memory_traced
+    with second.section("timed"):
+        pass
+    assert second.records[0].peak_mb is None
+    second.close()
+    assert tracemalloc.is_tracing()
+    first.close()
+    assert not tracemalloc.is_tracing()
+    third = Profiler(enabled=True)
+    assert third.memory_traced
+    third.close()
+
+
+def test_disabled_profiler_leaves_tracemalloc_alone():
+    profiler = Profiler(enabled=False)
+    assert not profiler.memory_traced
+    assert profiler.section("x") is profiler.section("y")
+    assert not tracemalloc.is_tracing()
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+from recompute import ComputeGraph, Input, value_nbytes
+
+
+def graph_with_block(max_bytes, max_versions=4):
+    graph = ComputeGraph(max_versions=max_versions, max_bytes=max_bytes)
+    calls = []
+
+    @graph.node("block", inputs=["n"])
+    def node_block(n):
+        calls.append(n)
+        return np.zeros(n)
+
+    return graph, calls
+
+
+def test_versions_are_reused():
+    graph, calls = graph_with_block(max_bytes=1 << 20)
+    for n in (10, 20, 10, 20):
+        graph.evaluation(n=n)["block"]
+    assert calls == [10, 20]
+    assert graph.nbytes() == 30 * 8
+
+
+def test_byte_budget_evicts_least_recently_used():
+    graph, calls = graph_with_block(max_bytes=100 * 8)
+    graph.evaluation(n=40)["block"]
+    graph.evaluation(n=50)["block"]
+    graph.evaluation(n=40)["block"]  # hit: 40 becomes the most recent
+    graph.evaluation(n=30)["block"]  # over budget: evicts 50
+    assert graph.nbytes() == 70 * 8
+    graph.evaluation(n=40)["block"]
+    graph.evaluation(n=50)["block"]
+    assert calls == [40, 50, 30, 50]
+
+
+def test_oversized_value_is_not_cached():
+    graph, calls = graph_with_block(max_bytes=10 * 8)
+    assert graph.evaluation(n=20)["block"].shape == (20,)
+    graph.evaluation(n=20)["block"]
+    assert calls == [20, 20] and graph.nbytes() == 0
+
+
+def test_invalidate_releases_bytes():
+    graph, _ = graph_with_block(max_bytes=1 << 20, max_versions=2)
+    for n in (10, 20, 30):
+        graph.evaluation(n=n)["block"]
+    assert graph.nbytes() == 50 * 8
+    graph.invalidate("block")
+    assert graph.nbytes() == 0
+
+
+def test_value_nbytes_counts_nested_and_shared_once():
+    df = pd.DataFrame({"a": np.arange(100, dtype=np.float64)})
+    block = np.ones((10, 10))
+    assert value_nbytes(Input(df, "k")) == df.memory_usage(deep=True).sum() + len("k")
+    assert value_nbytes((block, {"again": block}, ["x"])) == block.nbytes + 1
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+
+from sampling import Reservoir, stratified_sample
+
+N = 200_000
+
+
+def _frame():
+    rng = np.random.default_rng(0)
+    groups = np.where(rng.random(N) < 0.001, "control", rng.choice(["A", "B", "C"], N, p=[0.6, 0.3, 0.1]))
+    df = pd.DataFrame({"g": groups, "x": rng.normal(size=N)})
+    df.loc[rng.integers(0, N, 30), "g"] = None
+    return df
+
+
+def test_stratified_keeps_every_group():
+    df = _frame()
+    strat = stratified_sample(df, 5_000, "g")
+    counts = df["g"].value_counts(dropna=False)
+    got = strat["g"].value_counts(dropna=False)
+    assert set(got.index.astype(str)) == set(counts.index.astype(str))
+    assert all(got[k] == min(counts[k], 50) or got[k] > 50 for k in counts.index)
+    assert abs(len(strat) - 5_000) <= len(counts)
+    assert strat.index.is_monotonic_increasing and not strat.index.has_duplicates
+    assert stratified_sample(df, 5_000, "g").index.equals(strat.index)
+
+
+def test_reservoir_is_uniform_over_the_stream():
+    df = _frame()
+    res = Reservoir(5_000)
+    for start in range(0, N, 30_000):
+        res.update(df.iloc[start : start + 30_000])
+    frame = res.frame
+    assert len(frame) == 5_000 and res.seen == N
+    assert frame["x"].equals(df.loc[frame.index, "x"])
+    # The kept positions should be spread evenly over the stream.
+    assert abs(frame.index.to_numpy().mean() / N - 0.5) < 0.02
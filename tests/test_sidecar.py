@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import sidecar
+from spectra import SpectraMatrix
+
+
+def wide_frame(rng, rows=6, offset=0.0):
+    df = pd.DataFrame(rng.random((rows, 5)) + offset, columns=[4000.0, 3000.0, 2000.0, 1000.0, 500.0])
+    df.insert(0, "Sample", [f"S{i}" for i in range(rows)])
+    return df
+
+
+def test_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    df = wide_frame(rng)
+    df["note"] = ["a", 1.5, np.nan, "b", 2, "c"]
+    target = str(tmp_path / "sc")
+    sidecar.write_frame(target, df)
+    pd.testing.assert_frame_equal(sidecar.read_frame(target), df)
+
+
+def test_rewrite_keeps_files_of_held_manifest(tmp_path):
+    rng = np.random.default_rng(1)
+    target = str(tmp_path / "sc")
+    old = wide_frame(rng)
+    sidecar.write_frame(target, old)
+    held = sidecar.read_manifest(target)
+
+    new = wide_frame(rng, offset=10.0)
+    sidecar.write_frame(target, new)
+    # A reader that picked up the manifest before the rebuild still sees a complete old version.
+    pd.testing.assert_frame_equal(sidecar.read_frame(target, held), old)
+    pd.testing.assert_frame_equal(sidecar.read_frame(target), new)
+    assert SpectraMatrix.from_sidecar(target).values.min() >= 10.0
+
+    sidecar.write_frame(target, wide_frame(rng, offset=20.0))
+    live = set(os.listdir(target))
+    assert held["files"]["numeric"] not in live
+    assert len([n for n in live if n.startswith("numeric-")]) == 2
+
+
+def test_uploads_are_not_persisted_by_default(monkeypatch):
+    monkeypatch.delenv(sidecar.PERSIST_UPLOADS_ENV, raising=False)
+    assert not sidecar.persist_uploads_enabled()
+    monkeypatch.setenv(sidecar.PERSIST_UPLOADS_ENV, "1")
+    assert sidecar.persist_uploads_enabled()
+
+
+def test_read_bytes_caches_by_content(tmp_path):
+    rng = np.random.default_rng(2)
+    df = wide_frame(rng)
+    calls = []
+
+    def parse():
+        calls.append(1)
+        return df
+
+    root = str(tmp_path / "uploads")
+    first = sidecar.read_bytes(b"payload", ("excel", 0), parse, root=root, max_entries=1)
+    second = sidecar.read_bytes(b"payload", ("excel", 0), parse, root=root, max_entries=1)
+    assert len(calls) == 1
+    pd.testing.assert_frame_equal(first, second)
+    sidecar.read_bytes(b"other", ("excel", 0), parse, root=root, max_entries=1)
+    assert len(os.listdir(root)) == 1
@@ -0,0 +1,38 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import spectra
+from spectra import SpectraMatrix, detect_ftir_structure, spectra_for
+
+
+def ftir_frame(rows, rng):
+    wavenumbers = np.linspace(4000.0, 400.0, 40)
+    df = pd.DataFrame(rng.random((rows, len(wavenumbers))), columns=wavenumbers[rng.permutation(len(wavenumbers))])
+    df.insert(0, "Sample", [f"S{i % 7}" for i in range(rows)])
+    return df
+
+
+def test_spilled_matrix_matches_in_memory(tmp_path, monkeypatch):
+    monkeypatch.setattr(spectra, "MEMMAP_THRESHOLD_BYTES", 0)
+    monkeypatch.setattr(spectra, "MEMMAP_CHUNK_BYTES", 40 * 8 * 3)  # three rows per chunk
+    rng = np.random.default_rng(0)
+    df = ftir_frame(50, rng)
+    ftir = detect_ftir_structure(df)
+    sm = spectra_for(df, ftir, memmap_dir=str(tmp_path), key="k")
+    ref = SpectraMatrix.from_frame(df, ftir)
+    assert sm.is_memmap
+    np.testing.assert_array_equal(sm.values, ref.values)
+    np.testing.assert_array_equal(sm.wavenumbers, ref.wavenumbers)
+    assert sm.sample_ids.tolist() == ref.sample_ids.tolist()
+    np.testing.assert_array_equal(sm.mean(["S3"]), ref.mean(["S3"]))
+
+
+def test_spill_directory_is_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(spectra, "MEMMAP_THRESHOLD_BYTES", 0)
+    rng = np.random.default_rng(1)
+    for i in range(5):
+        df = ftir_frame(10, rng)
+        spectra_for(df, detect_ftir_structure(df), memmap_dir=str(tmp_path), key=f"k{i}", max_spilled=2)
+    assert len([d for d in os.listdir(tmp_path) if d.startswith("spectra-")]) == 2
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from streaming import GROUP_STATS, stream_csv, stream_groupby
+
+ROWS = 600_000
+
+
+@pytest.fixture(scope="module")
+def csv(tmp_path_factory):
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame(
+        {
+            "样本": rng.choice(["LB0", "LB1-1", "LD2-3", "SS4-5", "SR3-2"], ROWS, p=[0.01, 0.3, 0.3, 0.3, 0.09]),
+            "批次": rng.integers(1, 5, ROWS),
+            "强度": rng.normal(50, 12, ROWS).round(3),
+            "读数": rng.lognormal(0, 1, ROWS),
+        }
+    )
+    df.loc[rng.random(ROWS) < 0.01, "强度"] = np.nan
+    raw = df.astype({"读数": object})
+    raw.loc[rng.choice(ROWS, 25, replace=False), "读数"] = "overload"
+    path = tmp_path_factory.mktemp("stream") / "big.csv"
+    raw.to_csv(path, index=False)
+    full = pd.read_csv(path)
+    full["读数"] = pd.to_numeric(full["读数"], errors="coerce")
+    return str(path), full
+
+
+def test_summary_matches_full_read(csv):
+    path, full = csv
+    summary = stream_csv(path, reservoir_rows=5_000, chunksize=50_000)
+    exact_cols = ["count", "mean", "std", "min", "max"]
+    assert summary.rows == len(full)
+    assert summary.coerced.get("读数") == 25
+    assert summary.stats.missing().tolist() == full.isna().sum().tolist()
+    assert np.allclose(summary.stats.describe()[exact_cols].to_numpy(float),
+                       full[["批次", "强度", "读数"]].describe().T[exact_cols].to_numpy(float))
+    assert int(summary.hists["强度"].table(30)["数量"].sum()) == int(full["强度"].notna().sum())
+    counts = summary.counts["样本"].top().sort_index().tolist()
+    assert counts == full["样本"].value_counts().sort_index().tolist()
+    assert len(summary.sample) == 5_000 and summary.sample.index.is_monotonic_increasing
+
+
+def test_groupby_matches_pandas(csv):
+    path, full = csv
+    plan = stream_csv(path, reservoir_rows=100, chunksize=50_000).plan
+    grouped = stream_groupby(path, plan, ["样本", "批次"], "强度", chunksize=50_000)
+    ref = full.groupby(["样本", "批次"])["强度"].agg(GROUP_STATS).reset_index()
+    assert np.allclose(grouped[GROUP_STATS].to_numpy(float), ref[GROUP_STATS].to_numpy(float))
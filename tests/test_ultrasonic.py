@@ -0,0 +1,42 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from reference import echoes_reference, same_echoes, signal_frame, spectral_reference, trace_stats_reference
+from ultrasonic import STAT_COLUMNS, SignalMatrix, default_bands, detect_echoes, spectral_features, trace_stats
+
+WORKBOOK = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        "数据整理归档", "data", "Ultrasonic_signal.xlsx")
+
+
+def _frames():
+    yield pytest.param(signal_frame(40, 1200, 3, np.random.default_rng(0)), id="synthetic")
+    if os.path.exists(WORKBOOK):
+        yield pytest.param(pd.read_excel(WORKBOOK), id="workbook")
+
+
+@pytest.fixture(scope="module", params=list(_frames()))
+def frame(request):
+    return request.param
+
+
+def test_trace_stats_match_loop(frame):
+    sm = SignalMatrix.from_frame(frame)
+    got = trace_stats(sm)[sm.primary].reset_index(drop=True)
+    got = got[got["Points"] > 0]
+    ref = trace_stats_reference(frame)
+    assert np.allclose(ref[STAT_COLUMNS].to_numpy(float), got[STAT_COLUMNS].to_numpy(float), rtol=1e-10, atol=1e-10)
+
+
+def test_spectral_features_match_loop(frame):
+    sm = SignalMatrix.from_frame(frame)
+    feats = spectral_features(sm)
+    got = feats[["DominantFreq", "SpectralCentroid"] + [c for c in feats if c.startswith("BandPower_")]]
+    assert np.allclose(spectral_reference(sm, default_bands()), got.to_numpy(float), rtol=1e-9, atol=1e-12)
+
+
+def test_echoes_match_loop(frame):
+    sm = SignalMatrix.from_frame(frame)
+    assert same_echoes(sm, echoes_reference(sm), detect_echoes(sm))
@@ -0,0 +1,434 @@
+"""
+Ultrasonic signal matrix engine
+超声回波信号矩阵
+
+Ultrasonic_signal.xlsx stores one echo trace per column: the first row holds
+the sample name on the first column of each sample's block, the repeated
+traces of that sample follow in unnamed columns, and the rest of the column
+is the signal. SignalMatrix.from_frame() turns that layout into
+
+    values    (n_traces x n_timepoints) float64, NaN where a cell is empty or not a number
+    valid     the matching boolean mask
+    samples   sample name per trace (the name of its block)
+    trace     0 for the named column, 1, 2 ... for the repeats after it
+
+with a single numeric conversion of the whole block. trace_stats() and
+pooled_stats() are axis-wise reductions over the masked matrix;
+spectral_features() takes one rFFT of all traces (in row chunks) and derives
+dominant frequency, spectral centroid/spread and power per frequency band.
+detect_echoes() segments every trace on its envelope (rolling RMS or
+Hilbert) in one pass over the flattened matrix; echo_features() turns the
+echoes into per-trace arrival times, time of flight and echo energy.
+"""
+
+import warnings
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+MAX_NAME_LENGTH = 20
+PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+STAT_COLUMNS = ["Points", "Mean", "Std", "Min", "Max", "RMS", "Peak2Peak", "Energy"]
+
+
+def name_columns(first_row: pd.Series) -> np.ndarray:
+    """Positions of the columns whose first cell is a sample name (short text, not the description)."""
+    text = first_row.map(lambda v: v if isinstance(v, str) else None)
+    named = text.notna() & (text.str.len() < MAX_NAME_LENGTH) & ~text.str.startswith("纤维", na=False)
+    return np.flatnonzero(named.to_numpy(dtype=bool))
+
+
+def detect_signal_layout(df: pd.DataFrame) -> Optional[Dict[str, object]]:
+    """Column-per-trace layout with sample names in the first row, or None."""
+    if df.shape[0] < 3 or df.shape[1] < 1:
+        return None
+    named = name_columns(df.iloc[0])
+    if len(named) == 0:
+        return None
+    # Named columns are object dtype (text on top); require mostly numbers below the names,
+    # which also rules out a sample-per-row table whose first cell happens to be a name.
+    probe = df.iloc[1 : min(len(df), 51), named].to_numpy().ravel()
+    if pd.to_numeric(pd.Series(probe), errors="coerce").notna().mean() < 0.5:
+        return None
+    return {"first": int(named[0]), "named": named}
+
+
+@dataclass
+class SignalMatrix:
+    values: np.ndarray
+    valid: np.ndarray
+    samples: np.ndarray
+    trace: np.ndarray
+    columns: np.ndarray
+
+    @property
+    def n_traces(self) -> int:
+        return self.values.shape[0]
+
+    @property
+    def n_timepoints(self) -> int:
+        return self.values.shape[1]
+
+    @property
+    def primary(self) -> np.ndarray:
+        return self.trace == 0
+
+    def unique_samples(self) -> List[str]:
+        return list(dict.fromkeys(self.samples.tolist()))
+
+    def select(self, rows: np.ndarray) -> "SignalMatrix":
+        return SignalMatrix(self.values[rows], self.valid[rows], self.samples[rows], self.trace[rows], self.columns[rows])
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, layout: Optional[Dict[str, object]] = None) -> "SignalMatrix":
+        layout = layout if layout is not None else detect_signal_layout(df)
+        if layout is None:
+            raise ValueError("no column-per-sample signal layout found")
+        first, named = layout["first"], np.asarray(layout["named"])
+        block = df.iloc[1:, first:]
+        if all(pd.api.types.is_numeric_dtype(t) for t in block.dtypes):
+            values = block.to_numpy(dtype=np.float64, na_value=np.nan)
+        else:
+            cells = block.to_numpy(dtype=object)
+            try:
+                values = cells.astype(np.float64)  # numbers and blanks only: one C-level cast
+            except (TypeError, ValueError):
+                # Stray text somewhere: one coercion pass over the whole block, text becomes NaN.
+                flat = pd.to_numeric(pd.Series(cells.ravel()), errors="coerce")
+                values = flat.to_numpy(dtype=np.float64).reshape(block.shape)
+        values = np.ascontiguousarray(values.T)
+        # Every column belongs to the last named column at or before it.
+        positions = np.arange(first, df.shape[1])
+        owner = np.searchsorted(named, positions, side="right") - 1
+        names = df.iloc[0, named].astype(str).str.strip().to_numpy(dtype=object)
+        return cls(
+            values=values,
+            valid=~np.isnan(values),
+            samples=names[owner],
+            trace=(positions - named[owner]).astype(np.intp),
+            columns=np.asarray(df.columns[first:], dtype=object),
+        )
+
+
+def _masked(sm: SignalMatrix) -> np.ndarray:
+    return np.where(sm.valid, sm.values, 0.0)
+
+
+def trace_stats(sm: SignalMatrix, percentiles: Sequence[float] = ()) -> pd.DataFrame:
+    """Per-trace time-domain statistics (population std, as np.std); all-empty traces give NaN."""
+    n = sm.valid.sum(axis=1)
+    empty = n == 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if n.min(initial=0) == sm.n_timepoints:
+            x = sm.values
+            lo, hi = x.min(axis=1), x.max(axis=1)
+        else:
+            x = _masked(sm)
+            lo = np.where(sm.valid, sm.values, np.inf).min(axis=1)
+            hi = np.where(sm.valid, sm.values, -np.inf).max(axis=1)
+            lo[empty], hi[empty] = np.nan, np.nan
+        energy = np.einsum("ij,ij->i", x, x)
+        mean = x.sum(axis=1) / n
+        centred = x - mean[:, None]
+        if x is not sm.values:
+            centred[~sm.valid] = 0.0
+        std = np.sqrt(np.einsum("ij,ij->i", centred, centred) / n)
+        rms = np.sqrt(energy / n)
+    out = pd.DataFrame(
+        {
+            "Sample": sm.samples,
+            "Trace": sm.trace,
+            "Points": n,
+            "Mean": mean,
+            "Std": std,
+            "Min": lo,
+            "Max": hi,
+            "RMS": rms,
+            "Peak2Peak": hi - lo,
+            "Energy": np.where(empty, np.nan, energy),
+        }
+    )
+    if len(percentiles):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # all-empty traces stay NaN
+            pct = np.nanpercentile(sm.values, list(percentiles), axis=1)
+        for p, row in zip(percentiles, pct):
+            out[f"P{p:g}"] = row
+    return out
+
+
+def pooled_stats(sm: SignalMatrix, percentiles: Sequence[float] = PERCENTILES) -> Dict[str, object]:
+    """Statistics of every valid point of every trace taken together."""
+    points = sm.values[sm.valid]
+    if points.size == 0:
+        return {"n": 0}
+    energy = float(np.dot(points, points))
+    mean = float(points.mean())
+    return {
+        "n": int(points.size),
+        "mean": mean,
+        "std": float(points.std()),
+        "min": float(points.min()),
+        "max": float(points.max()),
+        "peak2peak": float(points.max() - points.min()),
+        "rms": float(np.sqrt(energy / points.size)),
+        "energy": energy,
+        "power": energy / points.size,
+        "percentiles": dict(zip(percentiles, np.percentile(points, list(percentiles)).tolist())),
+    }
+
+
+# ---------------------------------------------------------------- frequency domain
+
+# Default bands as fractions of the Nyquist frequency (the sampling rate of the
+# workbook is not recorded, so frequencies are in cycles per sample unless a
+# sample_rate is given).
+BAND_FRACTIONS = (0.0, 0.05, 0.15, 0.3, 1.0)
+FFT_CHUNK_ROWS = 4096
+
+
+def default_bands(sample_rate: float = 1.0) -> List[Tuple[float, float]]:
+    edges = np.asarray(BAND_FRACTIONS) * sample_rate / 2.0
+    return list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+
+def band_label(low: float, high: float) -> str:
+    return f"{low:.4g}-{high:.4g}"
+
+
+def power_spectra(sm: SignalMatrix, window: Optional[str] = "hann") -> np.ndarray:
+    """One-sided power spectrum of every trace (mean removed, gaps zero), (n_traces x n_bins)."""
+    n = sm.valid.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(sm.valid, sm.values, 0.0).sum(axis=1) / n
+    taper = np.hanning(sm.n_timepoints) if window == "hann" else np.ones(sm.n_timepoints)
+    out = np.empty((sm.n_traces, sm.n_timepoints // 2 + 1))
+    for start in range(0, sm.n_traces, FFT_CHUNK_ROWS):
+        rows = slice(start, start + FFT_CHUNK_ROWS)
+        x = np.where(sm.valid[rows], sm.values[rows] - mean[rows, None], 0.0) * taper
+        spec = np.fft.rfft(x, axis=1)
+        out[rows] = spec.real ** 2 + spec.imag ** 2
+    # Fold the negative frequencies in: every bin but DC (and Nyquist for even lengths) counts twice.
+    out[:, 1 : (sm.n_timepoints + 1) // 2] *= 2.0
+    return out
+
+
+def spectral_features(sm: SignalMatrix, bands: Optional[Sequence[Tuple[float, float]]] = None,
+                      sample_rate: float = 1.0, window: Optional[str] = "hann") -> pd.DataFrame:
+    """Dominant frequency, centroid, spread, band powers and band-energy ratios for every trace.
+
+    Bands are half-open [low, high) in the units of sample_rate, the last band
+    also takes the Nyquist bin; all of them come from one cumulative sum of the
+    power spectra.
+    """
+    bands = default_bands(sample_rate) if bands is None else list(bands)
+    power = power_spectra(sm, window)
+    freq = np.fft.rfftfreq(sm.n_timepoints, d=1.0 / sample_rate)
+    total = power.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        centroid = power @ freq / total
+        spread = np.sqrt(np.maximum(power @ (freq * freq) / total - centroid * centroid, 0.0))
+    dominant = freq[np.argmax(power, axis=1)]
+    cumulative = np.concatenate([np.zeros((len(power), 1)), np.cumsum(power, axis=1)], axis=1)
+    low = np.searchsorted(freq, [b[0] for b in bands], side="left")
+    high = np.searchsorted(freq, [b[1] for b in bands], side="left")
+    high = np.where(np.isclose([b[1] for b in bands], freq[-1]), len(freq), high)
+    band_power = cumulative[:, high] - cumulative[:, low]
+    silent = ~(total > 0)
+    out = pd.DataFrame(
+        {
+            "DominantFreq": np.where(silent, np.nan, dominant),
+            "SpectralCentroid": np.where(silent, np.nan, centroid),
+            "SpectralSpread": np.where(silent, np.nan, spread),
+        }
+    )
+    for (lo, hi), bp in zip(bands, band_power.T):
+        out[f"BandPower_{band_label(lo, hi)}"] = bp
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for (lo, hi), bp in zip(bands, band_power.T):
+            out[f"BandRatio_{band_label(lo, hi)}"] = np.where(silent, np.nan, bp / total)
+    return out
+
+
+# ---------------------------------------------------------------- echoes
+
+ENVELOPES = {"rms": "滑动 RMS", "hilbert": "Hilbert 包络"}
+ECHO_COLUMNS = ["Trace", "Echo", "Onset", "Peak", "End", "PeakAmplitude", "Energy"]
+MAX_ECHOES = 4
+
+
+def _row_median(a: np.ndarray) -> np.ndarray:
+    """np.median(a, axis=1) with one partition: the upper middle is the kth element, the lower the max left of it."""
+    n = a.shape[1]
+    part = np.partition(a, n // 2, axis=1)
+    upper = part[:, n // 2]
+    return upper if n % 2 else 0.5 * (part[:, : n // 2].max(axis=1) + upper)
+
+
+def _centred(sm: SignalMatrix) -> np.ndarray:
+    """Traces minus their own median, gaps set to 0 (the baseline of these traces is not 0)."""
+    if sm.valid.all():
+        return sm.values - _row_median(sm.values)[:, None]
+    base = np.zeros(sm.n_traces)
+    gappy = ~sm.valid.all(axis=1)
+    base[~gappy] = _row_median(sm.values[~gappy])
+    if gappy.any():
+        # NaN sorts last, so the middle of the first `count` sorted values is the nanmedian.
+        ordered = np.sort(sm.values[gappy], axis=1)
+        count = sm.valid[gappy].sum(axis=1)
+        rows = np.arange(len(ordered))
+        middle = 0.5 * (ordered[rows, np.maximum(count - 1, 0) // 2] + ordered[rows, count // 2 - (count == 0)])
+        base[gappy] = np.where(count > 0, middle, 0.0)
+    return np.where(sm.valid, sm.values - base[:, None], 0.0)
+
+
+def _window_sums(x: np.ndarray, window: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Running sums of x over a centred window clipped at both ends, and the window lengths.
+
+    Returns (csum, counts) where csum is the cumulative sum of x padded by
+    window // 2 zeros on the left; the sum over samples [a, b) of a row is
+    csum[:, b + window // 2] - csum[:, a + window // 2].
+    """
+    n_traces, n_time = x.shape
+    half = window // 2
+    csum = np.zeros((n_traces, n_time + window + 1))
+    csum[:, half + 1 : half + 1 + n_time] = x
+    np.cumsum(csum, axis=1, out=csum)
+    pos = np.arange(n_time)
+    counts = np.minimum(pos - half + window, n_time) - np.maximum(pos - half, 0)
+    return csum, counts
+
+
+def _envelope(x: np.ndarray, method: str, window: int) -> Tuple[np.ndarray, np.ndarray]:
+    """(envelope, padded cumulative energy) of centred traces; see envelope()."""
+    n_time = x.shape[1]
+    window = max(1, min(int(window), n_time))
+    energy, counts = _window_sums(x * x, window)
+    if method == "rms":
+        env = energy[:, window : window + n_time] - energy[:, :n_time]
+        np.maximum(env, 0.0, out=env)
+        env /= counts
+        return np.sqrt(env, out=env), energy
+    if method != "hilbert":
+        raise ValueError(f"unknown envelope '{method}'")
+    # Analytic signal: the one-sided spectrum (rFFT, positive bins doubled) transformed back.
+    n_freq = n_time // 2 + 1
+    h = np.full(n_freq, 2.0)
+    h[0] = 1.0
+    if n_time % 2 == 0:
+        h[-1] = 1.0
+    amp = np.empty_like(x)
+    spectrum = np.zeros((min(len(x), FFT_CHUNK_ROWS), n_time), dtype=np.complex128)
+    for start in range(0, len(x), FFT_CHUNK_ROWS):
+        rows = slice(start, start + FFT_CHUNK_ROWS)
+        block = spectrum[: len(x[rows])]
+        block[:, :n_freq] = np.fft.rfft(x[rows], axis=1) * h
+        amp[rows] = np.abs(np.fft.ifft(block, axis=1))
+    # The analytic amplitude of noisy traces is spiky; smooth it with the same window.
+    csum, _ = _window_sums(amp, window)
+    return (csum[:, window : window + n_time] - csum[:, :n_time]) / counts, energy
+
+
+def envelope(sm: SignalMatrix, method: str = "rms", window: int = 15) -> np.ndarray:
+    """Amplitude envelope of every trace: centred rolling RMS, or the rolling mean of |analytic signal| (FFT Hilbert)."""
+    return _envelope(_centred(sm), method, window)[0]
+
+
+def echo_threshold(env: np.ndarray, k: float = 6.0, relative: float = 0.2, step: int = 1) -> np.ndarray:
+    """Per-trace level: noise floor (median + k * MAD of the envelope) or a share of its maximum, whichever is higher.
+
+    The noise floor is estimated on every step-th sample; a smoothed envelope
+    barely changes within half its window, so step = window // 2 loses nothing.
+    """
+    sub = env[:, :: max(1, int(step))]
+    med = _row_median(sub)
+    mad = _row_median(np.abs(sub - med[:, None])) * 1.4826
+    return np.maximum(med + k * mad, relative * env.max(axis=1))
+
+
+def detect_echoes(sm: SignalMatrix, method: str = "rms", window: int = 15, k: float = 6.0,
+                  relative: float = 0.2, min_gap: int = 10, min_width: int = 3) -> pd.DataFrame:
+    """ECHO_COLUMNS for every echo of every trace, in time order within a trace.
+
+    An echo is a run of envelope samples above the trace's threshold; runs closer
+    than min_gap samples are merged and runs shorter than min_width dropped.
+    Onset/Peak/End are sample indices (End exclusive), PeakAmplitude is the
+    envelope maximum and Energy the sum of squared centred samples in the run.
+    All traces are handled together on the flattened matrix.
+    """
+    window = max(1, min(int(window), sm.n_timepoints))
+    env, energy = _envelope(_centred(sm), method, window)
+    n_traces, n_time = env.shape
+    # A False column on both sides of every trace keeps runs from spilling into the next row.
+    stride = n_time + 1
+    padded = np.zeros((n_traces, n_time + 2), dtype=bool)
+    np.greater(env, echo_threshold(env, k, relative, window // 2)[:, None], out=padded[:, 1:-1])
+    edges = np.flatnonzero(padded[:, 1:] != padded[:, :-1])
+    starts, ends = edges[::2], edges[1::2]
+    if len(starts) == 0:
+        return pd.DataFrame(columns=ECHO_COLUMNS)
+    rows = starts // stride
+    # Merge runs of the same trace separated by a gap shorter than min_gap.
+    new = np.ones(len(starts), dtype=bool)
+    new[1:] = (rows[1:] != rows[:-1]) | (starts[1:] - ends[:-1] >= min_gap)
+    first = np.flatnonzero(new)
+    last = np.r_[first[1:], len(starts)] - 1
+    starts, ends, rows = starts[first], ends[last], rows[first]
+    keep = ends - starts >= min_width
+    starts, ends, rows = starts[keep] - rows[keep] * stride, ends[keep] - rows[keep] * stride, rows[keep]
+    if len(starts) == 0:
+        return pd.DataFrame(columns=ECHO_COLUMNS)
+
+    # Only the samples inside echoes are gathered: the peak is the first maximum of each run.
+    lengths = ends - starts
+    offsets = np.cumsum(lengths) - lengths
+    idx = _run_indices(rows * n_time + starts, rows * n_time + ends)
+    values = env.ravel()[idx]
+    peak_amp = np.maximum.reduceat(values, offsets)
+    run_id = np.repeat(np.arange(len(starts)), lengths)
+    hit = np.flatnonzero(values == peak_amp[run_id])
+    _, first_hit = np.unique(run_id[hit], return_index=True)
+    half = window // 2
+    return pd.DataFrame(
+        {
+            "Trace": rows,
+            "Echo": np.arange(len(starts)) - np.searchsorted(rows, rows, side="left") + 1,
+            "Onset": starts,
+            "Peak": starts + hit[first_hit] - offsets,
+            "End": ends,
+            "PeakAmplitude": peak_amp,
+            "Energy": energy[rows, ends + half] - energy[rows, starts + half],
+        }
+    )
+
+
+def _run_indices(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Concatenated np.arange(start, end) for every run, without a Python loop."""
+    lengths = ends - starts
+    offsets = np.arange(int(lengths.sum())) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(starts, lengths) + offsets
+
+
+def echo_features(sm: SignalMatrix, echoes: pd.DataFrame, max_echoes: int = MAX_ECHOES,
+                  sample_rate: Optional[float] = None) -> pd.DataFrame:
+    """One row per trace: echo count, peak time of the first max_echoes echoes, time of flight
+    between consecutive echoes and the energy of each; times in samples unless sample_rate is given."""
+    scale = 1.0 / sample_rate if sample_rate else 1.0
+    first = echoes[echoes["Echo"] <= max_echoes]
+    counts = np.bincount(echoes["Trace"].to_numpy(dtype=np.intp), minlength=sm.n_traces)
+    peak = np.full((sm.n_traces, max_echoes), np.nan)
+    energy = np.full((sm.n_traces, max_echoes), np.nan)
+    rows = first["Trace"].to_numpy(dtype=np.intp)
+    slot = first["Echo"].to_numpy(dtype=np.intp) - 1
+    peak[rows, slot] = first["Peak"].to_numpy(dtype=np.float64) * scale
+    energy[rows, slot] = first["Energy"].to_numpy(dtype=np.float64)
+    out = pd.DataFrame({"Echoes": counts})
+    for i in range(max_echoes):
+        out[f"Echo{i + 1}_Time"] = peak[:, i]
+    for i in range(max_echoes - 1):
+        out[f"TOF_{i + 1}-{i + 2}"] = peak[:, i + 1] - peak[:, i]
+    for i in range(max_echoes):
+        out[f"Echo{i + 1}_Energy"] = energy[:, i]
+    return out
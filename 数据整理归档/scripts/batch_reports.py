@@ -0,0 +1,267 @@
+"""
+Batch report runner for the offline analysis scripts
+离线分析脚本的批量运行器
+
+Every directory under the data root that holds the workbooks of an analysis
+is one experiment batch. Each (batch, analysis) job runs in a process pool,
+its printed report is saved as markdown and its result CSV next to the
+other results:
+
+    数据整理归档/results/<batch>/ftir_spectral_stats.csv ...
+    数据整理归档/reports/<batch>/ftir_analysis.md ...
+
+A job is skipped when the SHA-256 of its input workbooks, of the script
+that produces it and of the repo modules the scripts import (SHARED_MODULES)
+match the last successful run (kept in results/.batch_manifest.json) and
+its outputs still exist.
+
+Usage:
+    python batch_reports.py [data_root] [--jobs N] [--force] [--only ftir ultrasonic summary]
+"""
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ARCHIVE_DIR = os.path.dirname(SCRIPT_DIR)
+REPO_DIR = os.path.dirname(ARCHIVE_DIR)
+sys.path.insert(0, SCRIPT_DIR)
+sys.path.insert(0, REPO_DIR)
+from sidecar import file_sha256
+
+DATA_DIR = os.path.join(ARCHIVE_DIR, "data")
+RESULTS_DIR = os.path.join(ARCHIVE_DIR, "results")
+REPORTS_DIR = os.path.join(ARCHIVE_DIR, "reports")
+MANIFEST_NAME = ".batch_manifest.json"
+# Repo-root modules imported by the analysis scripts, directly or transitively.
+SHARED_MODULES = (
+    "process_model.py",
+    "sample_ids.py",
+    "sample_metadata.py",
+    "ultrasonic.py",
+    "spectra.py",
+    "peaks.py",
+    "sidecar.py",
+)
+
+
+@dataclass(frozen=True)
+class Analysis:
+    name: str
+    title: str
+    script: str
+    required: Tuple[str, ...]
+    results: Tuple[str, ...]
+    optional: Tuple[str, ...] = ()
+
+
+ANALYSES = {
+    a.name: a
+    for a in (
+        Analysis("ftir", "FTIR 光谱分析", "ftir_analysis.py", ("FTIR.xlsx",), ("ftir_spectral_stats.csv",)),
+        Analysis(
+            "ultrasonic", "超声信号分析", "ultrasonic_signal_analysis.py",
+            ("Ultrasonic_signal.xlsx",), ("ultrasonic_signal_stats.csv",),
+        ),
+        Analysis(
+            "summary", "综合数据分析", "data_analysis_report.py",
+            ("Break_force.xlsx", "纤维提取率.xlsx", "纤维脱胶前后测试.xlsx"), ("process_regression.csv",),
+            ("FTIR.xlsx", "Sample.xlsx"),
+        ),
+    )
+}
+
+
+@dataclass
+class Job:
+    batch: str
+    data_dir: str
+    analysis: Analysis
+    digest: str
+
+    @property
+    def key(self) -> str:
+        return f"{self.batch}::{self.analysis.name}"
+
+    @property
+    def out_dir(self) -> str:
+        return os.path.join(RESULTS_DIR, self.batch)
+
+    @property
+    def report_path(self) -> str:
+        return os.path.join(REPORTS_DIR, self.batch, f"{self.analysis.name}_analysis.md")
+
+
+# ---------------------------------------------------------------- discovery
+
+
+def find_batches(root: str) -> List[Tuple[str, str]]:
+    """(batch name, directory) for root and every sub-directory holding a known workbook."""
+    known = {name for a in ANALYSES.values() for name in a.required}
+    found = []
+    for folder, dirs, files in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        if known.intersection(files):
+            rel = os.path.relpath(folder, root)
+            found.append((os.path.basename(os.path.abspath(root)) if rel == "." else rel, folder))
+    return found
+
+
+def job_digest(data_dir: str, analysis: Analysis) -> str:
+    h = hashlib.sha256()
+    for name in analysis.required + analysis.optional:
+        path = os.path.join(data_dir, name)
+        h.update(name.encode("utf-8"))
+        h.update(file_sha256(path).encode("ascii") if os.path.exists(path) else b"-")
+    h.update(file_sha256(os.path.join(SCRIPT_DIR, analysis.script)).encode("ascii"))
+    for name in SHARED_MODULES:
+        h.update(name.encode("utf-8"))
+        h.update(file_sha256(os.path.join(REPO_DIR, name)).encode("ascii"))
+    return h.hexdigest()
+
+
+def plan_jobs(root: str, only: Optional[List[str]] = None) -> List[Job]:
+    jobs = []
+    for batch, folder in find_batches(root):
+        for analysis in ANALYSES.values():
+            if only and analysis.name not in only:
+                continue
+            if all(os.path.exists(os.path.join(folder, name)) for name in analysis.required):
+                jobs.append(Job(batch, folder, analysis, job_digest(folder, analysis)))
+    return jobs
+
+
+def load_manifest() -> Dict[str, Dict[str, object]]:
+    try:
+        with open(os.path.join(RESULTS_DIR, MANIFEST_NAME), encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(manifest: Dict[str, Dict[str, object]]) -> None:
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, MANIFEST_NAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, ensure_ascii=False, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def is_current(job: Job, manifest: Dict[str, Dict[str, object]]) -> bool:
+    entry = manifest.get(job.key)
+    if not entry or entry.get("digest") != job.digest:
+        return False
+    return all(os.path.exists(os.path.join(ARCHIVE_DIR, p)) for p in entry.get("outputs", []))
+
+
+# ---------------------------------------------------------------- worker
+
+
+def _call(analysis: Analysis, data_dir: str, out_dir: str) -> None:
+    if analysis.name == "ftir":
+        import ftir_analysis
+
+        ftir_analysis.analyze_ftir_data(os.path.join(data_dir, "FTIR.xlsx"), out_dir)
+    elif analysis.name == "ultrasonic":
+        import ultrasonic_signal_analysis
+
+        ultrasonic_signal_analysis.analyze_ultrasonic_signals(os.path.join(data_dir, "Ultrasonic_signal.xlsx"), out_dir)
+    else:
+        import data_analysis_report
+
+        data_analysis_report.run(data_dir, out_dir)
+
+
+def run_job(job: Job) -> Dict[str, object]:
+    """Run one analysis with stdout captured; returns the manifest entry (or the error)."""
+    os.makedirs(job.out_dir, exist_ok=True)
+    os.makedirs(os.path.dirname(job.report_path), exist_ok=True)
+    buffer = io.StringIO()
+    error = None
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(buffer):
+        try:
+            _call(job.analysis, job.data_dir, job.out_dir)
+        except Exception:
+            error = traceback.format_exc()
+    seconds = time.perf_counter() - t0
+    outputs = [p for p in (os.path.join(job.out_dir, n) for n in job.analysis.results) if os.path.exists(p)]
+    with open(job.report_path, "w", encoding="utf-8") as fh:
+        fh.write(f"# {job.analysis.title} | {job.batch}\n\n")
+        fh.write(f"- **数据目录**: `{job.data_dir}`\n")
+        fh.write(f"- **生成时间**: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+        fh.write(f"- **耗时**: {seconds:.2f} s\n")
+        if outputs:
+            fh.write("- **结果文件**: " + ", ".join(f"`{os.path.relpath(p, ARCHIVE_DIR)}`" for p in outputs) + "\n")
+        fh.write("\n```text\n" + buffer.getvalue().strip("\n") + "\n```\n")
+        if error:
+            fh.write("\n## ❌ Error\n\n```text\n" + error + "```\n")
+    return {
+        "digest": job.digest,
+        "outputs": [os.path.relpath(p, ARCHIVE_DIR) for p in outputs + [job.report_path]],
+        "seconds": round(seconds, 3),
+        "error": error,
+    }
+
+
+# ---------------------------------------------------------------- CLI
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run the analysis scripts over every experiment batch")
+    parser.add_argument("data_root", nargs="?", default=DATA_DIR)
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--force", action="store_true", help="re-run jobs whose inputs are unchanged")
+    parser.add_argument("--only", nargs="+", choices=sorted(ANALYSES))
+    args = parser.parse_args(argv)
+
+    jobs = plan_jobs(args.data_root, args.only)
+    manifest = load_manifest()
+    todo = [job for job in jobs if args.force or not is_current(job, manifest)]
+    skipped = [job for job in jobs if job not in todo]
+    print(f"{len(jobs)} jobs in {len({j.batch for j in jobs})} batches: {len(todo)} to run, {len(skipped)} unchanged")
+
+    timings: List[Tuple[str, str, float]] = [(job.key, "skipped", 0.0) for job in skipped]
+    failed = 0
+    t0 = time.perf_counter()
+    if todo:
+        with ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(todo)))) as pool:
+            futures = {pool.submit(run_job, job): job for job in todo}
+            for done, future in enumerate(as_completed(futures), 1):
+                job = futures[future]
+                try:
+                    entry = future.result()
+                except Exception as exc:  # the worker process itself died
+                    entry = {"digest": job.digest, "outputs": [], "seconds": 0.0, "error": repr(exc)}
+                status = "failed" if entry["error"] else "ok"
+                if entry["error"]:
+                    failed += 1
+                    manifest.pop(job.key, None)
+                else:
+                    manifest[job.key] = {k: v for k, v in entry.items() if k != "error"}
+                save_manifest(manifest)
+                timings.append((job.key, status, float(entry["seconds"])))
+                print(f"[{done}/{len(todo)}] {job.key:<32} {status:<7} {entry['seconds']:7.2f} s")
+                if entry["error"]:
+                    print("    " + str(entry["error"]).strip().splitlines()[-1])
+
+    print(f"\n{'job':<32} {'status':<8} {'seconds':>8}")
+    for key, status, seconds in sorted(timings, key=lambda t: -t[2]):
+        print(f"{key:<32} {status:<8} {seconds:8.2f}")
+    print(f"wall time {time.perf_counter() - t0:.2f} s, results in {RESULTS_DIR}, reports in {REPORTS_DIR}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
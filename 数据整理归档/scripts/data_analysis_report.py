@@ -3,18 +3,25 @@ Comprehensive Data Analysis Report Generator
 Analyzes Break_force.xlsx, 纤维提取率.xlsx, and 纤维脱胶前后测试.xlsx
 """
 
+import os
+import sys
 import pandas as pd
 import numpy as np
 from datetime import datetime
 
-def analyze_break_force():
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from process_model import EXTRACTION_RATE, STRENGTH, batch_regression, build_sample_table, strongest_fits
+from sample_ids import parse_sample_ids
+from sidecar import read_table
+
+def analyze_break_force(data_dir='.'):
     """Analyze fiber breaking strength data"""
     print("=" * 80)
     print("1. BREAK FORCE ANALYSIS (断裂强度分析)")
     print("=" * 80)
     
-    # Read with proper header
-    df = pd.read_excel('Break_force.xlsx', header=1)
+    # The header row holds the replicate names; LB0 is the first data row
+    df = read_table(os.path.join(data_dir, 'Break_force.xlsx'))
     df.columns = ['Sample', 'Sample_1', 'Sample_2', 'Sample_3', 'Empty', 'Average', 'Unit']
     df = df[df['Sample'].notna() & (df['Sample'] != 'Sample 1')]
     
@@ -28,8 +35,9 @@ def analyze_break_force():
     print(f"   Replicates per sample: 3")
     
     # Extract sample groups
-    df['Group'] = df['Sample'].str.extract(r'^([A-Z]+)')[0]
-    df['Series'] = df['Sample'].str.extract(r'(\d+)')[0]
+    sample_keys = parse_sample_ids(df['Sample'])
+    df['Group'] = sample_keys['prefix']
+    df['Series'] = sample_keys['series']
     
     # Statistics by group
     print(f"\n📈 Breaking Strength by Sample Type:")
@@ -70,13 +78,13 @@ def analyze_break_force():
     
     return df
 
-def analyze_extraction_rate():
+def analyze_extraction_rate(data_dir='.'):
     """Analyze fiber extraction rate data"""
     print("\n\n" + "=" * 80)
     print("2. EXTRACTION RATE ANALYSIS (纤维提取率分析)")
     print("=" * 80)
     
-    df = pd.read_excel('纤维提取率.xlsx', header=1)
+    df = read_table(os.path.join(data_dir, '纤维提取率.xlsx'))
     df.columns = ['Sample', 'Unit', 'Average', 'Extraction_Rate']
     df = df[df['Sample'].notna() & (df['Sample'] != 'Sample')]
     
@@ -88,7 +96,7 @@ def analyze_extraction_rate():
     print(f"   Formula: E = m1/m0 (dried weight after treatment / initial weight)")
     
     # Extract sample groups
-    df['Group'] = df['Sample'].str.extract(r'^([A-Z]+)')[0]
+    df['Group'] = parse_sample_ids(df['Sample'])['prefix']
     
     print(f"\n📈 Extraction Rate by Sample Type:")
     print(f"   {'Type':<10} {'Count':<8} {'Mean Rate':<12} {'Std Dev':<10} {'Min':<10} {'Max':<10}")
@@ -116,13 +124,13 @@ def analyze_extraction_rate():
     
     return df
 
-def analyze_before_after_degumming():
+def analyze_before_after_degumming(data_dir='.'):
     """Analyze fiber length before and after degumming"""
     print("\n\n" + "=" * 80)
     print("3. BEFORE/AFTER DEGUMMING ANALYSIS (脱胶前后测试)")
     print("=" * 80)
     
-    df = pd.read_excel('纤维脱胶前后测试.xlsx')
+    df = read_table(os.path.join(data_dir, '纤维脱胶前后测试.xlsx'))
     
     # Find section indices by checking first column for markers
     markers = df[df.iloc[:, 0].astype(str).str.contains('脱胶', na=False)]
@@ -226,29 +234,50 @@ def analyze_before_after_degumming():
     
     return before_lengths, after_lengths
 
-def generate_comprehensive_summary(break_df, extract_df):
-    """Generate comprehensive insights"""
+def generate_comprehensive_summary(break_df, extract_df, data_dir='.'):
+    """Generate comprehensive insights; returns every process-variable fit"""
     print("\n\n" + "=" * 80)
     print("4. COMPREHENSIVE INSIGHTS & RECOMMENDATIONS")
     print("=" * 80)
     
     print("\n🔬 Key Findings:")
     
-    # Finding 1: Strength vs Extraction trade-off
+    table = build_sample_table(os.path.abspath(data_dir))
+    frame = table.frame
+    treated_rows = frame[frame['系列'].fillna(0) > 0]
+    
+    # Finding 1: Strength vs Extraction trade-off, measured on the joined sample table
     print("\n   1. Strength-Extraction Trade-off:")
-    print("      - Degumming process significantly reduces fiber strength (40-50%)")
-    print("      - Higher extraction rates correlate with lower breaking strength")
-    print("      - LD (脱胶长纤维) series shows best balance")
+    controls = break_df[parse_sample_ids(break_df['Sample'])['is_control']]
+    treated = break_df[~parse_sample_ids(break_df['Sample'])['is_control']]
+    reduction = (controls['Average'].mean() - treated['Average'].mean()) / controls['Average'].mean() * 100
+    print(f"      - Degumming changes mean fiber strength by {-reduction:+.1f}% "
+          f"({controls['Average'].mean():.2f} → {treated['Average'].mean():.2f} MPa)")
+    if STRENGTH in frame and EXTRACTION_RATE in frame:
+        pooled = batch_regression(treated_rows, [STRENGTH], [EXTRACTION_RATE])
+        by_type = batch_regression(treated_rows, [STRENGTH], [EXTRACTION_RATE], by=['纤维类型'])
+        for _, fit in pd.concat([pooled, by_type]).iterrows():
+            verdict = "significant" if fit['p值'] < 0.05 else "not significant"
+            print(f"      - {fit['分组']}: strength vs extraction rate r = {fit['r']:+.2f} "
+                  f"(n={fit['n']}, p={fit['p值']:.3f}, {verdict})")
+    retention = (treated.groupby('Group', observed=True)['Average'].mean()
+                 / controls.groupby('Group', observed=True)['Average'].mean()).dropna()
+    if len(retention):
+        print(f"      - Best strength retention: {retention.idxmax()} ({retention.max() * 100:.1f}% of its control)")
     
     # Finding 2: Process optimization
     print("\n   2. Process Optimization Opportunities:")
-    controls = break_df[break_df['Sample'].isin(['LB0', 'LD0', 'SS0', 'SR0'])]
-    lb0_strength = controls[controls['Sample'] == 'LB0']['Average'].values[0]
-    ld0_strength = controls[controls['Sample'] == 'LD0']['Average'].values[0]
-    
-    print(f"      - LB0 (球刀长纤维) baseline: {lb0_strength:.2f} MPa")
-    print(f"      - LD0 (脱胶长纤维) baseline: {ld0_strength:.2f} MPa")
-    print(f"      - SS/SR (乱纤维) show 20-25% lower initial strength")
+    for _, row in controls.iterrows():
+        print(f"      - {row['Sample']} baseline: {row['Average']:.2f} MPa")
+    fits = batch_regression(treated_rows, table.responses, table.variables, by=['纤维类型'])
+    top = strongest_fits(fits[fits['响应'].isin([STRENGTH, EXTRACTION_RATE])], top=8)
+    if len(top):
+        print("      - Significant process-variable effects (p < 0.05, per fiber type):")
+        for _, fit in top.iterrows():
+            print(f"        {fit['分组']}: {fit['响应']} vs {fit['过程变量']}: slope {fit['斜率']:+.4g}, "
+                  f"r = {fit['r']:+.2f}, p = {fit['p值']:.3f}")
+    else:
+        print("      - No process variable has a significant linear effect on strength or extraction rate")
     
     # Finding 3: Variability analysis
     print("\n   3. Process Consistency:")
@@ -266,10 +295,11 @@ def generate_comprehensive_summary(break_df, extract_df):
     
     print("\n\n💡 Recommendations for Process Improvement:")
     print("   1. Optimize ultrasound parameters to minimize strength loss")
-    print("   2. Consider staged degumming for LB series (currently losing most strength)")
-    print("   3. LD series shows promise - investigate its pre-treatment method")
-    print("   4. SS/SR series need strength enhancement before degumming")
-    print("   5. Target extraction rate: 0.70-0.85 for optimal strength retention")
+    if len(retention):
+        print(f"   2. Consider staged degumming for {retention.idxmin()} series "
+              f"(lowest strength retention, {retention.min() * 100:.1f}%)")
+        print(f"   3. {retention.idxmax()} series retains the most strength - investigate its pre-treatment method")
+    print("   4. Tune the process variables listed above against their fitted slopes before scaling up")
     
     print("\n\n📊 Statistical Summary:")
     print("   ┌─────────────────────────────────────────────────────────┐")
@@ -279,11 +309,13 @@ def generate_comprehensive_summary(break_df, extract_df):
     print(f"   │ Sample types tested       │ 4 (LB, LD, SS, SR)          │")
     print(f"   │ Mean breaking strength    │ {break_df['Average'].mean():.2f} MPa{' '*20}│")
     print(f"   │ Mean extraction rate      │ {extract_df['Extraction_Rate'].mean():.3f} (≈{extract_df['Extraction_Rate'].mean()*100:.0f}%){' '*17}│")
-    print(f"   │ Strength retention        │ ~55-60% after degumming     │")
+    retained = f"{treated['Average'].mean() / controls['Average'].mean() * 100:.1f}% after degumming"
+    print(f"   │ Strength retention        │ {retained:<28}│")
     print("   └─────────────────────────────────────────────────────────┘")
+    return fits
 
-def main():
-    """Main analysis function"""
+def run(data_dir='.', out_dir=None):
+    """Run every analysis on the workbooks in data_dir; errors propagate to the caller"""
     print("\n")
     print("╔" + "═" * 78 + "╗")
     print("║" + " " * 20 + "PINEAPPLE LEAF FIBER ANALYSIS REPORT" + " " * 22 + "║")
@@ -292,23 +324,35 @@ def main():
     print(f"\nReport Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"Analyst: Data Analysis System")
     
+    break_df = analyze_break_force(data_dir)
+    extract_df = analyze_extraction_rate(data_dir)
+    before_df, after_df = analyze_before_after_degumming(data_dir)
+    fits = generate_comprehensive_summary(break_df, extract_df, data_dir)
+    
+    if out_dir is not None:
+        path = os.path.join(out_dir, 'process_regression.csv')
+        fits.to_csv(path, index=False, encoding='utf-8-sig')
+        print(f"\n💾 Results saved to: {path}")
+    
+    print("\n\n" + "=" * 80)
+    print("✓ ANALYSIS COMPLETE")
+    print("=" * 80)
+    print("\nNext Steps:")
+    print("1. Review the statistical findings above")
+    top = strongest_fits(fits[fits['响应'].isin([STRENGTH, EXTRACTION_RATE])], top=1)
+    if len(top):
+        fit = top.iloc[0]
+        print(f"2. Tune {fit['过程变量']} first for {fit['分组']} fibers "
+              f"(strongest effect on {fit['响应']}: r = {fit['r']:+.2f}, p = {fit['p值']:.3f})")
+    else:
+        print("2. Widen the tested process-variable ranges - no significant linear effect was found")
+    print("3. Consider fiber length distribution in quality assessment")
+    print("\n")
+
+def main():
+    """Main analysis function"""
     try:
-        # Run all analyses
-        break_df = analyze_break_force()
-        extract_df = analyze_extraction_rate()
-        before_df, after_df = analyze_before_after_degumming()
-        generate_comprehensive_summary(break_df, extract_df)
-        
-        print("\n\n" + "=" * 80)
-        print("✓ ANALYSIS COMPLETE")
-        print("=" * 80)
-        print("\nNext Steps:")
-        print("1. Review the statistical findings above")
-        print("2. Identify optimal processing parameters from LD series")
-        print("3. Design experiments to improve LB series strength retention")
-        print("4. Consider fiber length distribution in quality assessment")
-        print("\n")
-        
+        run()
     except Exception as e:
         print(f"\n❌ Error during analysis: {str(e)}")
         import traceback
@@ -3,13 +3,19 @@ FTIR Spectroscopy Data Analysis Report Generator
 FTIR光谱数据综合分析报告生成器
 """
 
+import os
+import sys
 import pandas as pd
 import numpy as np
 from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from sample_ids import parse_sample_ids
+from sidecar import read_table
 import warnings
 warnings.filterwarnings('ignore')
 
-def analyze_ftir_data():
+def analyze_ftir_data(path='FTIR.xlsx', out_dir='.'):
     """Comprehensive FTIR spectroscopy analysis"""
     
     print("\n")
@@ -20,7 +26,7 @@ def analyze_ftir_data():
     print(f"\nReport Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     
     # Load data
-    df = pd.read_excel('FTIR.xlsx')
+    df = read_table(path)
     
     print("\n" + "=" * 80)
     print("1. DATA STRUCTURE ANALYSIS | 数据结构分析")
@@ -115,8 +121,9 @@ def analyze_ftir_data():
     stats_df = pd.DataFrame(sample_stats)
     
     # Extract groups
-    stats_df['Group'] = stats_df['Sample'].astype(str).str.extract(r'^([A-Z]+)', expand=False)
-    stats_df['Is_Control'] = stats_df['Sample'].astype(str).str.contains('0$', na=False)
+    sample_keys = parse_sample_ids(stats_df['Sample'])
+    stats_df['Group'] = sample_keys['prefix']
+    stats_df['Is_Control'] = sample_keys['is_control']
     
     print(f"\n📊 Sample Statistics Summary:")
     print(f"   Total samples analyzed: {len(stats_df)}")
@@ -138,7 +145,7 @@ def analyze_ftir_data():
         print("4. GROUP COMPARISON | 组间对比")
         print("=" * 80)
         
-        group_stats = stats_df.groupby('Group').agg({
+        group_stats = stats_df.groupby('Group', observed=True).agg({
             'Sample': 'count',
             'Mean': ['mean', 'std'],
             'Std': 'mean',
@@ -241,7 +248,7 @@ def analyze_ftir_data():
     
     print(f"\n   2. Sample Variability:")
     if 'Group' in stats_df.columns:
-        group_cv = stats_df.groupby('Group')['Mean'].std() / stats_df.groupby('Group')['Mean'].mean() * 100
+        group_cv = stats_df.groupby('Group', observed=True)['Mean'].std() / stats_df.groupby('Group', observed=True)['Mean'].mean() * 100
         for group, cv in group_cv.items():
             status = "✓ Good" if cv < 10 else "⚠ Moderate" if cv < 20 else "❗ High"
             print(f"      - {group} series: CV = {cv:.2f}% ({status} consistency)")
@@ -257,11 +264,12 @@ def analyze_ftir_data():
     print(f"\n   1. Data Quality:")
     print(f"      - ✓ Dataset is complete with {len(samples)} samples")
     print(f"      - ✓ Spectral range covers all important regions")
-    print(f"      - Consider baseline correction if not already applied")
+    print(f"      - Baseline correction (ALS / rubber band), normalization and Savitzky-Golay")
+    print(f"        smoothing/derivatives are available in preprocess.py and the app's 光谱预处理 panel")
     
     print(f"\n   2. Advanced Analysis:")
     print(f"      - Peak deconvolution for overlapping bands")
-    print(f"      - Second derivative spectra for hidden peaks")
+    print(f"      - Second derivative spectra for hidden peaks (Savitzky-Golay, preprocess.py)")
     print(f"      - PCA to identify main sources of variation")
     print(f"      - Correlation with mechanical properties")
     
@@ -276,8 +284,9 @@ def analyze_ftir_data():
     print(f"      - Combine with ultrasonic data for comprehensive QC")
     
     # Save results
-    stats_df.to_csv('ftir_spectral_stats.csv', index=False, encoding='utf-8-sig')
-    print(f"\n💾 Results saved to: ftir_spectral_stats.csv")
+    out_path = os.path.join(out_dir, 'ftir_spectral_stats.csv')
+    stats_df.to_csv(out_path, index=False, encoding='utf-8-sig')
+    print(f"\n💾 Results saved to: {out_path}")
     
     print("\n" + "=" * 80)
     print("✓ FTIR ANALYSIS COMPLETE")
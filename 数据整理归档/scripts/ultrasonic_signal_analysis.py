@@ -3,13 +3,21 @@ Ultrasonic Signal Analysis Report Generator
 超声波信号分析报告生成器
 """
 
+import os
+import sys
 import pandas as pd
 import numpy as np
 from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from sample_ids import parse_sample_ids
+from sidecar import read_table
+from ultrasonic import (ENVELOPES, MAX_ECHOES, SignalMatrix, detect_echoes, echo_features, pooled_stats,
+                        spectral_features, trace_stats)
 import warnings
 warnings.filterwarnings('ignore')
 
-def analyze_ultrasonic_signals():
+def analyze_ultrasonic_signals(path='Ultrasonic_signal.xlsx', out_dir='.', sample_rate=None, envelope='rms'):
     """Comprehensive analysis of ultrasonic echo signals from fiber samples"""
     
     print("\n")
@@ -20,29 +28,23 @@ def analyze_ultrasonic_signals():
     print(f"\nReport Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     
     # Load data
-    df = pd.read_excel('数据集/Ultrasonic_signal.xlsx')
+    df = read_table(path)
     
     print("\n" + "=" * 80)
     print("1. DATA OVERVIEW | 数据概览")
     print("=" * 80)
     
     # The data structure: First row contains sample names, subsequent rows contain signal values
-    # Each column represents one sample's time-series signal
-    
-    sample_row = df.iloc[0]
-    valid_samples = []
-    sample_col_map = {}
-    
-    for col_idx, col in enumerate(df.columns):
-        val = sample_row[col]
-        if isinstance(val, str) and len(val) < 20 and not val.startswith('纤维'):
-            valid_samples.append(val)
-            sample_col_map[val] = col
+    # Each column represents one sample's time-series signal; repeat traces follow unnamed
+    signals = SignalMatrix.from_frame(df)
+    named = signals.select(signals.primary)
+    valid_samples = named.samples.tolist()
     
     print(f"\n📊 Dataset Structure:")
-    print(f"   Total rows (time points per sample): {len(df) - 1}")
+    print(f"   Total rows (time points per sample): {signals.n_timepoints}")
     print(f"   Total columns: {len(df.columns)}")
     print(f"   Data format: Each column = one sample's signal time series")
+    print(f"   Named traces: {named.n_traces}, unnamed repeat traces: {signals.n_traces - named.n_traces}")
     
     print(f"\n🔬 Detected Samples:")
     print(f"   Total unique sample IDs: {len(valid_samples)}")
@@ -63,30 +65,22 @@ def analyze_ultrasonic_signals():
     print("2. SIGNAL STATISTICS ANALYSIS | 信号统计分析")
     print("=" * 80)
     
-    # Collect all numeric signal data
-    all_signal_data = []
-    for sample in valid_samples:
-        col = sample_col_map[sample]
-        signal_vals = df[col].iloc[1:].values  # Skip first row (sample name)
-        signal_vals = pd.to_numeric(signal_vals, errors='coerce')
-        signal_vals = signal_vals[~np.isnan(signal_vals)]
-        all_signal_data.extend(signal_vals.tolist())
-    
-    signal_data = np.array(all_signal_data)
+    # Pooled statistics over every valid point of the named traces
+    pooled = pooled_stats(named)
     
     print(f"\n📈 Overall Signal Statistics:")
     print(f"   {'Metric':<25} {'Value':<20}")
     print(f"   {'-'*45}")
-    print(f"   {'Mean amplitude':<25} {np.mean(signal_data):.6f}")
-    print(f"   {'Std deviation':<25} {np.std(signal_data):.6f}")
-    print(f"   {'Min amplitude':<25} {np.min(signal_data):.6f}")
-    print(f"   {'Max amplitude':<25} {np.max(signal_data):.6f}")
-    print(f"   {'Peak-to-peak':<25} {np.max(signal_data) - np.min(signal_data):.6f}")
-    print(f"   {'RMS (Root Mean Square)':<25} {np.sqrt(np.mean(signal_data**2)):.6f}")
+    print(f"   {'Mean amplitude':<25} {pooled['mean']:.6f}")
+    print(f"   {'Std deviation':<25} {pooled['std']:.6f}")
+    print(f"   {'Min amplitude':<25} {pooled['min']:.6f}")
+    print(f"   {'Max amplitude':<25} {pooled['max']:.6f}")
+    print(f"   {'Peak-to-peak':<25} {pooled['peak2peak']:.6f}")
+    print(f"   {'RMS (Root Mean Square)':<25} {pooled['rms']:.6f}")
     
     # Signal energy analysis
-    signal_energy = np.sum(signal_data**2)
-    signal_power = signal_energy / len(signal_data)
+    signal_energy = pooled['energy']
+    signal_power = pooled['power']
     
     print(f"\n⚡ Signal Energy Analysis:")
     print(f"   Total energy: {signal_energy:.2e}")
@@ -94,43 +88,25 @@ def analyze_ultrasonic_signals():
     
     # Amplitude distribution
     print(f"\n📊 Amplitude Distribution:")
-    percentiles = [1, 5, 25, 50, 75, 95, 99]
-    for p in percentiles:
-        val = np.percentile(signal_data, p)
+    for p, val in pooled['percentiles'].items():
         print(f"   {p:2d}th percentile: {val:8.4f}")
     
     print("\n" + "=" * 80)
     print("3. SAMPLE-WISE ANALYSIS | 逐样本分析")
     print("=" * 80)
     
-    # Analyze each sample
-    sample_stats = []
-    
-    for sample in valid_samples:
-        col = sample_col_map[sample]
-        
-        # Get signal values for this sample (skip first row which is sample name)
-        signal_vals = df[col].iloc[1:].values
-        signal_vals = pd.to_numeric(signal_vals, errors='coerce')
-        signal_vals = signal_vals[~np.isnan(signal_vals)]
-        
-        if len(signal_vals) == 0:
-            continue
-        
-        stats = {
-            'Sample': sample,
-            'Points': len(signal_vals),
-            'Mean': np.mean(signal_vals),
-            'Std': np.std(signal_vals),
-            'Min': np.min(signal_vals),
-            'Max': np.max(signal_vals),
-            'RMS': np.sqrt(np.mean(signal_vals**2)),
-            'Peak2Peak': np.max(signal_vals) - np.min(signal_vals),
-            'Energy': np.sum(signal_vals**2)
-        }
-        sample_stats.append(stats)
-    
-    stats_df = pd.DataFrame(sample_stats)
+    # Analyze each sample: one row per named trace
+    stats_df = trace_stats(named)
+    has_data = (stats_df['Points'] > 0).to_numpy()
+    stats_df = stats_df[has_data].drop(columns='Trace').reset_index(drop=True)
+    # Frequency-domain features of the same traces, one batched rFFT
+    analysed = named.select(has_data)
+    spectral_df = spectral_features(analysed, sample_rate=sample_rate or 1.0)
+    freq_unit = 'Hz' if sample_rate else 'cycles/sample'
+    # Echo segmentation on the envelope of the same traces
+    echoes = detect_echoes(analysed, envelope)
+    echo_df = echo_features(analysed, echoes, sample_rate=sample_rate)
+    time_unit = 's' if sample_rate else 'samples'
     
     print(f"\n📋 Sample Statistics Summary:")
     print(f"   Total samples analyzed: {len(stats_df)}")
@@ -156,25 +132,53 @@ def analyze_ultrasonic_signals():
     for idx, row in top_p2p.iterrows():
         print(f"      {row['Sample']}: P2P={row['Peak2Peak']:.4f} (Max={row['Max']:.4f}, Min={row['Min']:.4f})")
     
+    print(f"\n🎵 Frequency-Domain Features (rFFT, Hann window, frequencies in {freq_unit}):")
+    print(f"   Dominant frequency: median {spectral_df['DominantFreq'].median():.4g}, "
+          f"range {spectral_df['DominantFreq'].min():.4g} - {spectral_df['DominantFreq'].max():.4g}")
+    print(f"   Spectral centroid:  mean {spectral_df['SpectralCentroid'].mean():.4g} "
+          f"± {spectral_df['SpectralCentroid'].std():.4g}")
+    print(f"   Mean share of signal power per band:")
+    for col in [c for c in spectral_df.columns if c.startswith('BandRatio_')]:
+        print(f"      {col[len('BandRatio_'):]:<20} {spectral_df[col].mean() * 100:6.1f}%")
+    
+    print(f"\n📍 Echo Segmentation ({ENVELOPES[envelope]} envelope, times in {time_unit}):")
+    counts = echo_df['Echoes']
+    print(f"   Echoes per trace: median {counts.median():.0f}, range {counts.min()} - {counts.max()}, "
+          f"total {len(echoes)}")
+    print(f"   {'Echo':<6} {'Traces':<8} {'Mean time':<12} {'Mean energy':<12}")
+    for i in range(1, MAX_ECHOES + 1):
+        times = echo_df[f'Echo{i}_Time']
+        print(f"   {i:<6} {times.notna().sum():<8} {times.mean():<12.4g} {echo_df[f'Echo{i}_Energy'].mean():<12.4g}")
+    for i in range(1, MAX_ECHOES):
+        tof = echo_df[f'TOF_{i}-{i + 1}']
+        if tof.notna().any():
+            print(f"   Time of flight echo {i} -> {i + 1}: mean {tof.mean():.4g} ± {tof.std():.4g} (n={tof.notna().sum()})")
+    print(f"   Note: echoes are numbered in arrival order; matching them to the direct bounce,")
+    print(f"         fiber, solution and impurity components above is an assumption to verify.")
+    
     # Group analysis (if sample naming follows pattern)
-    stats_df['Group'] = stats_df['Sample'].str.extract(r'^([A-Z]+)', expand=False)
+    stats_df['Group'] = parse_sample_ids(stats_df['Sample'])['prefix']
+    stats_df = pd.concat([stats_df, spectral_df, echo_df], axis=1)
     
     if stats_df['Group'].notna().sum() > 0:
         print("\n" + "=" * 80)
         print("4. GROUP COMPARISON | 组间对比")
         print("=" * 80)
         
-        group_stats = stats_df.groupby('Group').agg({
+        group_stats = stats_df.groupby('Group', observed=True).agg({
             'Sample': 'count',
             'RMS': ['mean', 'std'],
             'Mean': ['mean', 'std'],
             'Energy': 'mean',
-            'Peak2Peak': 'mean'
+            'Peak2Peak': 'mean',
+            'SpectralCentroid': 'mean',
+            'Echoes': 'mean',
+            'TOF_1-2': 'mean',
         }).round(4)
         
         print(f"\n📊 Group-wise Signal Characteristics:")
-        print(f"\n   {'Group':<8} {'N':<5} {'Avg RMS':<12} {'RMS Std':<12} {'Avg Mean':<12} {'Avg Energy':<15}")
-        print(f"   {'-'*70}")
+        print(f"\n   {'Group':<8} {'N':<5} {'Avg RMS':<12} {'RMS Std':<12} {'Avg Mean':<12} {'Avg Energy':<15} {'Centroid':<10} {'Echoes':<8} {'TOF 1-2':<10}")
+        print(f"   {'-'*100}")
         
         for group in group_stats.index:
             n = int(group_stats.loc[group, ('Sample', 'count')])
@@ -183,7 +187,11 @@ def analyze_ultrasonic_signals():
             avg_mean = group_stats.loc[group, ('Mean', 'mean')]
             avg_energy = group_stats.loc[group, ('Energy', 'mean')]
             
-            print(f"   {group:<8} {n:<5} {avg_rms:<12.4f} {rms_std:<12.4f} {avg_mean:<12.4f} {avg_energy:<15.2e}")
+            centroid = group_stats.loc[group, ('SpectralCentroid', 'mean')]
+            n_echoes = group_stats.loc[group, ('Echoes', 'mean')]
+            tof = group_stats.loc[group, ('TOF_1-2', 'mean')]
+            print(f"   {group:<8} {n:<5} {avg_rms:<12.4f} {rms_std:<12.4f} {avg_mean:<12.4f} {avg_energy:<15.2e} "
+                  f"{centroid:<10.4g} {n_echoes:<8.2f} {tof:<10.4g}")
     
     print("\n" + "=" * 80)
     print("5. SIGNAL QUALITY ASSESSMENT | 信号质量评估")
@@ -191,8 +199,8 @@ def analyze_ultrasonic_signals():
     
     # Signal-to-Noise Ratio estimation
     # Assuming noise is related to the signal variation
-    signal_mean = np.abs(np.mean(signal_data))
-    noise_estimate = np.std(signal_data)
+    signal_mean = np.abs(pooled['mean'])
+    noise_estimate = pooled['std']
     snr_estimate = signal_mean / noise_estimate if noise_estimate > 0 else 0
     snr_db = 20 * np.log10(snr_estimate) if snr_estimate > 0 else -np.inf
     
@@ -211,7 +219,7 @@ def analyze_ultrasonic_signals():
     print(f"   Signal quality: {quality}")
     
     # Consistency analysis
-    cv = (np.std(signal_data) / np.abs(np.mean(signal_data))) * 100 if np.mean(signal_data) != 0 else 0
+    cv = (pooled['std'] / np.abs(pooled['mean'])) * 100 if pooled['mean'] != 0 else 0
     print(f"   Coefficient of Variation: {cv:.2f}%")
     
     if cv < 10:
@@ -231,7 +239,7 @@ def analyze_ultrasonic_signals():
     
     # Finding 1: Signal characteristics
     print(f"\n   1. Signal Characteristics:")
-    print(f"      - Overall amplitude range: {np.min(signal_data):.4f} to {np.max(signal_data):.4f}")
+    print(f"      - Overall amplitude range: {pooled['min']:.4f} to {pooled['max']:.4f}")
     print(f"      - Predominantly negative amplitudes indicate reflection/absorption patterns")
     print(f"      - RMS variation across samples: {stats_df['RMS'].std():.4f}")
     
@@ -249,7 +257,7 @@ def analyze_ultrasonic_signals():
     # Finding 3: Signal strength patterns
     print(f"\n   3. Signal Strength Patterns:")
     if len(stats_df) > 0 and 'Group' in stats_df.columns:
-        group_means = stats_df.groupby('Group')['RMS'].mean().sort_values(ascending=False)
+        group_means = stats_df.groupby('Group', observed=True)['RMS'].mean().sort_values(ascending=False)
         if len(group_means) > 0:
             strongest = group_means.index[0]
             weakest = group_means.index[-1]
@@ -265,8 +273,8 @@ def analyze_ultrasonic_signals():
     
     print(f"\n   2. Feature Extraction:")
     print(f"      - Extract time-domain features: RMS, peak amplitude, zero-crossing rate")
-    print(f"      - Extract frequency-domain features: FFT power spectrum, dominant frequencies")
-    print(f"      - Calculate echo delay times to estimate fiber distance/position")
+    print(f"      - Frequency-domain features (band power, centroid, dominant frequency) are in ultrasonic_signal_stats.csv")
+    print(f"      - Echo times, time of flight and per-echo energy are in ultrasonic_signal_stats.csv")
     
     print(f"\n   3. Correlation with Physical Properties:")
     print(f"      - Correlate RMS values with fiber breaking strength (from Break_force.xlsx)")
@@ -280,7 +288,7 @@ def analyze_ultrasonic_signals():
     
     print(f"\n   5. Advanced Analysis (Future Work):")
     print(f"      - Time-frequency analysis (STFT, Wavelet transform)")
-    print(f"      - Echo peak detection and tracking")
+    print(f"      - Tracking echoes across repeat traces of the same sample")
     print(f"      - Signal pattern classification using CNN/RNN models")
     print(f"      - Synthetic aperture focusing for 3D fiber imaging")
     
@@ -299,8 +307,9 @@ def analyze_ultrasonic_signals():
         print(f"... ({len(stats_df) - 20} more samples)")
     
     # Save results
-    stats_df.to_csv('ultrasonic_signal_stats.csv', index=False, encoding='utf-8-sig')
-    print(f"\n💾 Results saved to: ultrasonic_signal_stats.csv")
+    out_path = os.path.join(out_dir, 'ultrasonic_signal_stats.csv')
+    stats_df.to_csv(out_path, index=False, encoding='utf-8-sig')
+    print(f"\n💾 Results saved to: {out_path}")
     
     print("\n" + "=" * 80)
     print("✓ ANALYSIS COMPLETE")